@@ -5,6 +5,8 @@ ChatPPT 主入口脚本
 运行方式：
     python main.py ui      # 启动 Web UI
     python main.py test    # 运行命令行测试
+    python main.py worker [N]  # 启动 N 个渲染工作进程 (任务队列模式)
+    python main.py batch requests.jsonl [--output DIR] [--workers N] [--no-resume]  # 批量生成
 """
 
 import sys
@@ -38,36 +40,21 @@ else:
 
 def main():
     if len(sys.argv) < 2:
-        print("用法: python main.py [ui|test]")
-        print("  ui   - 启动 Web UI")
-        print("  test - 运行命令行测试")
+        print("用法: python main.py [ui|test|worker|batch]")
+        print("  ui    - 启动 Web UI")
+        print("  test  - 运行命令行测试")
+        print("  worker - 启动渲染工作进程 (任务队列模式)")
+        print("  batch - 从 JSONL 文件批量生成 PPT")
         sys.exit(1)
 
     command = sys.argv[1].lower()
 
     if command == "ui":
         print("🚀 启动 ChatPPT Web UI...")
-        from ui.gradio_app import create_ui
-        import gradio as gr
-
-        demo = create_ui()
-        # 修复 Gradio 6.0 API 变更
-        # 禁用代理对 localhost 的影响
-        os.environ['no_proxy'] = '127.0.0.1,localhost'
-
-        demo.launch(
-            theme=gr.themes.Soft(),
-            server_name="0.0.0.0",  # 绑定到所有接口
-            server_port=7861,  # 换个端口
-            show_error=True,
-            share=False,
-            enable_monitoring=False,
-            # 绕过代理设置
-            app_kwargs={
-                "timeout": 120,
-                "proxy_headers": False
-            }
-        )
+        from ui.gradio_app import launch_ui
+
+        # 预热、任务队列工作进程与启动参数 (含缩略图目录的 allowed_paths) 统一由 launch_ui 处理
+        launch_ui()
 
     elif command == "test":
         print("🧪 运行 ChatPPT 简单测试...")
@@ -98,9 +85,41 @@ def main():
         print("💡 如果要运行完整测试，请配置 .env 文件中的 API Key，然后使用:")
         print("   python -m src.ui.gradio_app  # 或 python main.py ui")
 
+    elif command == "worker":
+        from src.utils.job_queue import JobWorkerPool
+
+        workers = int(sys.argv[2]) if len(sys.argv) > 2 else None
+        pool = JobWorkerPool(workers)
+        print(f"🛠️ 启动 {pool.num_workers} 个渲染工作进程 (队列: {os.getenv('JOB_QUEUE_PATH', 'data/jobs.sqlite')})")
+        pool.start()
+        try:
+            pool.join()
+        except KeyboardInterrupt:
+            pool.stop()
+
+    elif command == "batch":
+        import argparse
+        from src.workflow.batch import run_batch
+
+        parser = argparse.ArgumentParser(prog="python main.py batch", description="从 JSONL 文件批量生成 PPT (无人工确认)")
+        parser.add_argument("input", help="请求文件，每行一个 JSON：{\"id\": ..., \"input_text\": ..., \"file\": ...}")
+        parser.add_argument("--output", default="data/batch", help="输出目录 (默认 data/batch)")
+        parser.add_argument("--workers", type=int, default=None, help="并发进程数 (默认 BATCH_WORKERS 或 4)")
+        parser.add_argument("--no-resume", action="store_true", help="忽略已有的结果清单，全部重新生成")
+        args = parser.parse_args(sys.argv[2:])
+
+        print(f"📦 批量生成: {args.input} -> {args.output}")
+        summary = run_batch(args.input, args.output, workers=args.workers, resume=not args.no_resume)
+        print(f"✅ 完成 {summary['succeeded']} 个，失败 {summary['failed']} 个，跳过 {summary['skipped']} 个，"
+              f"耗时 {summary['elapsed_seconds']}s ({summary['decks_per_minute']} decks/min)")
+        for name, seconds in summary["avg_stage_seconds"].items():
+            print(f"   {name}: 平均 {seconds}s")
+        if summary["failed"]:
+            sys.exit(1)
+
     else:
         print(f"未知命令: {command}")
-        print("可用命令: ui, test")
+        print("可用命令: ui, test, worker, batch")
         sys.exit(1)
 
 if __name__ == "__main__":
@@ -28,4 +28,8 @@ class PPTState(TypedDict):
     current_step: str
     is_approved: bool
     error: Optional[str]
-    generated_file: Optional[str]
\ No newline at end of file
+    generated_file: Optional[str]
+    # 指定输出文件路径 (为空时按标题保存到 data/outputs)
+    output_path: Optional[str]
+    # 自定义模板路径 (.potx/.pptx，为空时使用 PPT_TEMPLATE 或默认模板)
+    template_path: Optional[str]
\ No newline at end of file
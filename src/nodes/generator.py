@@ -1,19 +1,160 @@
-from typing import List
+import os
+from typing import List, Optional
 from pydantic import BaseModel, Field
-from langchain_core.prompts import ChatPromptTemplate
 from src.models.state import PPTState, SlideContent
-from src.utils.llm_factory import LLMFactory
+from src.utils.chain_registry import ChainRegistry
 from src.utils.layout_manager import LayoutManager
-from src.utils.prompt_manager import read_prompt
 from src.utils.logger import logger
 
+# 用户消息模板
+USER_TEMPLATE = "PPT 总标题: {title}\n大纲章节: {chapters}\n\n请为每个章节生成一张幻灯片，为每一张幻灯片创建合适的标题、要点内容、图片关键词和版式类型。确保每张幻灯片都有非空的标题。"
+CHAPTER_USER_TEMPLATE = "PPT 总标题: {title}\n完整大纲: {chapters}\n\n当前页面: {page}\n{instruction}"
+# 融合模式下追加的要求：直接生成优化后的英文配图提示词，省去 image_advisor 的 LLM 调用
+FUSED_INSTRUCTION = "\n\n注意：image_query 必须直接是优化后的英文图像提示词 (English only)，具体、可视化、符合商务演示审美，不要使用中文。"
+
 class SlidesList(BaseModel):
     """用于结构化输出多张幻灯片的列表"""
     slides: List[SlideContent] = Field(description="幻灯片内容列表")
 
+class FusedSlideContent(SlideContent):
+    """融合模式下的幻灯片结构：image_query 直接为优化后的英文图像提示词"""
+    image_query: Optional[str] = Field(None, description="具体、高质量、符合商务演示审美的英文图像提示词 (English only)")
+
+class FusedSlidesList(BaseModel):
+    """融合模式下用于结构化输出多张幻灯片的列表"""
+    slides: List[FusedSlideContent] = Field(description="幻灯片内容列表")
+
+def _is_fused_mode() -> bool:
+    return os.getenv("GENERATOR_FUSED_IMAGE_QUERY", "false").lower() == "true"
+
+def _chapter_chain():
+    if _is_fused_mode():
+        return ChainRegistry.get_chain("generator_chapter_fused", "generator", "generator_chapter", CHAPTER_USER_TEMPLATE + FUSED_INSTRUCTION, FusedSlideContent)
+    return ChainRegistry.get_chain("generator_chapter", "generator", "generator_chapter", CHAPTER_USER_TEMPLATE, SlideContent)
+
+def _deck_chain():
+    # 获取预编译的链 (generator 专用模型，结构化输出生成列表)
+    if _is_fused_mode():
+        return ChainRegistry.get_chain("generator_fused", "generator", "generator", USER_TEMPLATE + FUSED_INSTRUCTION, FusedSlidesList)
+    return ChainRegistry.get_chain("generator", "generator", "generator", USER_TEMPLATE, SlidesList)
+
+def _chapter_inputs(outline) -> List[dict]:
+    """分章节生成的输入：标题页与每个章节各一个"""
+    chapters_str = ", ".join(outline.chapters)
+    return [{
+        "title": outline.title,
+        "chapters": chapters_str,
+        "page": "标题页",
+        "instruction": "请生成标题页：总标题作为标题，bullet_points 只包含一条简短副标题，layout_type 为 title_slide。"
+    }] + [{
+        "title": outline.title,
+        "chapters": chapters_str,
+        "page": f"第 {i} 章: {chapter}",
+        "instruction": "请只为当前章节生成一张幻灯片，包含非空标题、要点内容、图片关键词和版式类型。"
+    } for i, chapter in enumerate(outline.chapters, 1)]
+
+def _merge_chapter_results(outline, results) -> List[SlideContent]:
+    """按大纲顺序合并分章节结果，失败的页面使用章节名兜底"""
+    slides = []
+    for i, result in enumerate(results):
+        if isinstance(result, SlideContent):
+            slides.append(result)
+            continue
+        # 单页失败不影响整体，使用章节名兜底，后续修复逻辑会补全版式
+        logger.error(f"Content Generator: Failed to generate slide {i+1}: {result}")
+        if i == 0:
+            slides.append(SlideContent(title=outline.title, layout_type="title_slide"))
+        else:
+            slides.append(SlideContent(title=outline.chapters[i - 1], layout_type="title_content"))
+    return slides
+
+def _generate_per_chapter(outline) -> List[SlideContent]:
+    """
+    分章节并发生成：标题页与每个章节各发起一次 LLM 调用，
+    通过 chain.batch 控制并发数，结果按大纲顺序合并。
+    """
+    inputs = _chapter_inputs(outline)
+    max_concurrency = int(os.getenv("GENERATOR_MAX_CONCURRENCY", "8"))
+    logger.info(f"Content Generator: Fan-out generation of {len(inputs)} slides (max concurrency: {max_concurrency})")
+    results = _chapter_chain().batch(inputs, config={"max_concurrency": max_concurrency}, return_exceptions=True)
+    return _merge_chapter_results(outline, results)
+
+async def _agenerate_per_chapter(outline) -> List[SlideContent]:
+    """分章节并发生成的异步版本"""
+    inputs = _chapter_inputs(outline)
+    max_concurrency = int(os.getenv("GENERATOR_MAX_CONCURRENCY", "8"))
+    logger.info(f"Content Generator: Fan-out generation of {len(inputs)} slides (max concurrency: {max_concurrency})")
+    results = await _chapter_chain().abatch(inputs, config={"max_concurrency": max_concurrency}, return_exceptions=True)
+    return _merge_chapter_results(outline, results)
+
+def _fix_slides(state: PPTState, outline, raw_slides) -> PPTState:
+    """检查并修复生成的 slides (标题页、空标题、版式与配图需求)"""
+    # 融合模式的结果统一转换回 SlideContent
+    raw_slides = [SlideContent(**slide.model_dump()) if isinstance(slide, FusedSlideContent) else slide for slide in raw_slides]
+
+    logger.info(f"Content Generator: Successfully generated {len(raw_slides)} slides.")
+
+    # 检查并修复生成的slides
+    fixed_slides = []
+    for i, slide in enumerate(raw_slides):
+        # 记录原始slide对象的详细信息
+        logger.info(f"Content Generator: Slide {i+1} raw data - title: '{slide.title}', layout_type: '{slide.layout_type}', image_query: '{slide.image_query}'")
+
+        # 特殊处理第一张slide（标题页）
+        if i == 0:
+            # 确保第一张是标题页
+            slide.layout_type = "title_slide"
+            # 标题页通常不需要图片，清空image_query
+            slide.image_query = None
+            logger.info(f"Content Generator: Set slide 1 as title slide with layout 'title_slide'")
+            fixed_slides.append(slide)
+            continue
+
+        # 修复标题
+        if not slide.title or slide.title.strip() == "":
+            # 对于内容页，如果标题为空，使用对应的章节名
+            chapter_index = i - 1  # 因为第一张是标题页，所以章节索引要减1
+            if chapter_index < len(outline.chapters):
+                slide.title = outline.chapters[chapter_index]
+                logger.warning(f"Content Generator: Fixed empty title for slide {i+1} to chapter: '{slide.title}'")
+            else:
+                slide.title = f"幻灯片 {i+1}"
+                logger.warning(f"Content Generator: Used default title for slide {i+1}: '{slide.title}'")
+
+        # 检查和修复layout_type
+        valid_layouts = ["title_slide", "title_content", "section_header", "two_column", "comparison", "title_only", "blank", "content_caption", "picture_caption", "default"]
+        if not slide.layout_type or slide.layout_type not in valid_layouts:
+            logger.warning(f"Content Generator: Invalid layout_type '{slide.layout_type}' for slide {i+1}, using 'title_content'")
+            slide.layout_type = "title_content"  # 默认使用有图片的标准布局
+        else:
+            logger.info(f"Content Generator: Slide {i+1} layout_type: '{slide.layout_type}' -> layout index: {LayoutManager.get_layout_index(slide.layout_type)}")
+
+        # 检查图片需求：只有特定布局才需要图片
+        layouts_with_pictures = ["title_content", "picture_caption"]  # 有图片占位符的布局
+        if slide.layout_type not in layouts_with_pictures:
+            slide.image_query = None  # 清空不需要图片的布局的image_query
+            logger.info(f"Content Generator: Cleared image_query for layout '{slide.layout_type}' (no picture placeholder)")
+
+        fixed_slides.append(slide)
+
+    return {
+        **state,
+        "slides": fixed_slides,
+        "current_step": "image_advisory"
+    }
+
+def _on_error(state: PPTState, e: Exception) -> PPTState:
+    logger.exception("Content Generator: Failed to generate slides.")
+    return {
+        **state,
+        "error": f"Error in content generator: {str(e)}"
+    }
+
 def content_generator_node(state: PPTState) -> PPTState:
     """
     内容生成节点：根据大纲扩写每张幻灯片的详细内容
+    GENERATOR_FANOUT=true 时按章节并发生成，否则一次调用生成全部幻灯片
+    GENERATOR_FUSED_IMAGE_QUERY=true 时同时生成英文配图提示词，image_advisor 仅修复不合格的提示词
     """
     outline = state.get("outline")
     if not outline:
@@ -22,84 +163,44 @@ def content_generator_node(state: PPTState) -> PPTState:
 
     logger.info(f"Content Generator: Generating slides for: {outline.title}...")
     
-    # 获取 generator 专用的模型 (qwen-plus)
-    llm = LLMFactory.get_model("generator")
-    
-    # 从外部文件读取 Prompts
-    system_prompt = read_prompt("generator")
-    
-    # 定义提示词
-    prompt = ChatPromptTemplate.from_messages([
-        ("system", system_prompt),
-        ("user", "PPT 总标题: {title}\n大纲章节: {chapters}\n\n请为每个章节生成一张幻灯片，为每一张幻灯片创建合适的标题、要点内容、图片关键词和版式类型。确保每张幻灯片都有非空的标题。")
-    ])
-    
-    # 使用结构化输出生成列表
-    structured_llm = llm.with_structured_output(SlidesList)
-    chain = prompt | structured_llm
-    
     try:
         chapters_str = ", ".join(outline.chapters)
         logger.info(f"Content Generator: Processing outline '{outline.title}' with chapters: {chapters_str}")
 
-        result = chain.invoke({
-            "title": outline.title,
-            "chapters": chapters_str
-        })
-
-        logger.info(f"Content Generator: Successfully generated {len(result.slides)} slides.")
-
-        # 检查并修复生成的slides
-        fixed_slides = []
-        for i, slide in enumerate(result.slides):
-            # 记录原始slide对象的详细信息
-            logger.info(f"Content Generator: Slide {i+1} raw data - title: '{slide.title}', layout_type: '{slide.layout_type}', image_query: '{slide.image_query}'")
-
-            # 特殊处理第一张slide（标题页）
-            if i == 0:
-                # 确保第一张是标题页
-                slide.layout_type = "title_slide"
-                # 标题页通常不需要图片，清空image_query
-                slide.image_query = None
-                logger.info(f"Content Generator: Set slide 1 as title slide with layout 'title_slide'")
-                fixed_slides.append(slide)
-                continue
-
-            # 修复标题
-            if not slide.title or slide.title.strip() == "":
-                # 对于内容页，如果标题为空，使用对应的章节名
-                chapter_index = i - 1  # 因为第一张是标题页，所以章节索引要减1
-                if chapter_index < len(outline.chapters):
-                    slide.title = outline.chapters[chapter_index]
-                    logger.warning(f"Content Generator: Fixed empty title for slide {i+1} to chapter: '{slide.title}'")
-                else:
-                    slide.title = f"幻灯片 {i+1}"
-                    logger.warning(f"Content Generator: Used default title for slide {i+1}: '{slide.title}'")
-
-            # 检查和修复layout_type
-            valid_layouts = ["title_slide", "title_content", "section_header", "two_column", "comparison", "title_only", "blank", "content_caption", "picture_caption", "default"]
-            if not slide.layout_type or slide.layout_type not in valid_layouts:
-                logger.warning(f"Content Generator: Invalid layout_type '{slide.layout_type}' for slide {i+1}, using 'title_content'")
-                slide.layout_type = "title_content"  # 默认使用有图片的标准布局
-            else:
-                logger.info(f"Content Generator: Slide {i+1} layout_type: '{slide.layout_type}' -> layout index: {LayoutManager.get_layout_index(slide.layout_type)}")
+        if os.getenv("GENERATOR_FANOUT", "false").lower() == "true":
+            raw_slides = _generate_per_chapter(outline)
+        else:
+            raw_slides = _deck_chain().invoke({
+                "title": outline.title,
+                "chapters": chapters_str
+            }).slides
 
-            # 检查图片需求：只有特定布局才需要图片
-            layouts_with_pictures = ["title_content", "picture_caption"]  # 有图片占位符的布局
-            if slide.layout_type not in layouts_with_pictures:
-                slide.image_query = None  # 清空不需要图片的布局的image_query
-                logger.info(f"Content Generator: Cleared image_query for layout '{slide.layout_type}' (no picture placeholder)")
+        return _fix_slides(state, outline, raw_slides)
+    except Exception as e:
+        return _on_error(state, e)
 
-            fixed_slides.append(slide)
+async def acontent_generator_node(state: PPTState) -> PPTState:
+    """内容生成节点的异步版本 (Web UI 使用)"""
+    outline = state.get("outline")
+    if not outline:
+        logger.error("Content Generator: No outline found to generate content.")
+        return {**state, "error": "No outline found to generate content"}
+
+    logger.info(f"Content Generator: Generating slides for: {outline.title}...")
+
+    try:
+        chapters_str = ", ".join(outline.chapters)
+        logger.info(f"Content Generator: Processing outline '{outline.title}' with chapters: {chapters_str}")
+
+        if os.getenv("GENERATOR_FANOUT", "false").lower() == "true":
+            raw_slides = await _agenerate_per_chapter(outline)
+        else:
+            result = await _deck_chain().ainvoke({
+                "title": outline.title,
+                "chapters": chapters_str
+            })
+            raw_slides = result.slides
 
-        return {
-            **state,
-            "slides": fixed_slides,
-            "current_step": "image_advisory"
-        }
+        return _fix_slides(state, outline, raw_slides)
     except Exception as e:
-        logger.exception("Content Generator: Failed to generate slides.")
-        return {
-            **state,
-            "error": f"Error in content generator: {str(e)}"
-        }
+        return _on_error(state, e)
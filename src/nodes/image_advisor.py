@@ -1,11 +1,13 @@
+import os
 from typing import List
 from pydantic import BaseModel, Field
-from langchain_core.prompts import ChatPromptTemplate
-from src.models.state import PPTState, SlideContent
-from src.utils.llm_factory import LLMFactory
-from src.utils.prompt_manager import read_prompt
+from src.models.state import PPTState
+from src.utils.chain_registry import ChainRegistry
 from src.utils.logger import logger
 
+# 用户消息模板 (幻灯片内容作为模板变量传入，模板本身保持不变)
+USER_TEMPLATE = "以下是 PPT 的幻灯片内容，请为每张幻灯片提供一个优化的英文图像搜索关键词：\n\n{slides_info}"
+
 class ImageQueryRefinement(BaseModel):
     """单个幻灯片的配图优化建议"""
     index: int = Field(description="幻灯片索引")
@@ -15,57 +17,89 @@ class ImageAdvisorOutput(BaseModel):
     """配图建议节点的结构化输出"""
     refinements: List[ImageQueryRefinement] = Field(description="针对各张幻灯片的优化列表")
 
-def image_advisor_node(state: PPTState) -> PPTState:
+def is_valid_image_query(query: str) -> bool:
+    """融合模式下 generator 产出的配图提示词是否合格：英文且包含 2-60 个单词"""
+    return bool(query) and query.isascii() and 2 <= len(query.split()) <= 60
+
+def _prepare(state: PPTState):
     """
-    配图建议节点：优化每张幻灯片的配图关键词，并准备进行搜索
+    选出需要优化的幻灯片并构造输入
+    :return: (targets, slides_info)，无需调用 LLM 时 targets 为空
     """
     slides = state.get("slides", [])
-    if not slides:
-        logger.warning("Image Advisor: No slides found to advise.")
-        return state
+    targets = list(range(len(slides)))
+    if os.getenv("GENERATOR_FUSED_IMAGE_QUERY", "false").lower() == "true":
+        targets = [i for i, slide in enumerate(slides) if slide.image_query is not None and not is_valid_image_query(slide.image_query)]
+        if not targets:
+            logger.info("Image Advisor: All image queries from fused generator are valid, skipping LLM call.")
+            return [], ""
+        logger.info(f"Image Advisor: Repairing {len(targets)} invalid image queries...")
+    else:
+        logger.info(f"Image Advisor: Refining image queries for {len(slides)} slides...")
 
-    logger.info(f"Image Advisor: Refining image queries for {len(slides)} slides...")
-    
-    # 获取 image_advisor 专用的模型 (qwen-turbo)
-    llm = LLMFactory.get_model("image_advisor")
-    
-    # 从外部文件读取 Prompts
-    system_prompt = read_prompt("image_advisor")
-    
     # 构造输入内容
     slides_info = "\n".join([
-        f"Slide {i+1}: {slide.title}\nPoints: {', '.join(slide.bullet_points)}\nCurrent Query: {slide.image_query}"
-        for i, slide in enumerate(slides)
-    ])
-    
-    prompt = ChatPromptTemplate.from_messages([
-        ("system", system_prompt),
-        ("user", f"以下是 PPT 的幻灯片内容，请为每张幻灯片提供一个优化的英文图像搜索关键词：\n\n{slides_info}")
+        f"Slide {i+1}: {slides[i].title}\nPoints: {', '.join(slides[i].bullet_points)}\nCurrent Query: {slides[i].image_query}"
+        for i in targets
     ])
-    
-    # 使用结构化输出
-    structured_llm = llm.with_structured_output(ImageAdvisorOutput)
-    chain = prompt | structured_llm
-    
+    return targets, slides_info
+
+def _get_chain():
+    # 获取预编译的链 (image_advisor 专用模型，结构化输出)
+    return ChainRegistry.get_chain("image_advisor", "image_advisor", "image_advisor", USER_TEMPLATE, ImageAdvisorOutput)
+
+def _apply(state: PPTState, targets, result) -> PPTState:
+    # 更新 state 中的 slides
+    updated_slides = state.get("slides", []).copy()
+    for refinement in result.refinements:
+        idx = refinement.index - 1
+        if idx in targets:
+            updated_slides[idx].image_query = refinement.refined_query
+            logger.info(f"Slide {refinement.index} query refined: {refinement.refined_query}")
+
+    return {
+        **state,
+        "slides": updated_slides,
+        "current_step": "image_searching"
+    }
+
+def _on_error(state: PPTState, e: Exception) -> PPTState:
+    logger.exception("Image Advisor: Failed to refine queries.")
+    return {
+        **state,
+        "error": f"Error in image advisor: {str(e)}"
+    }
+
+def image_advisor_node(state: PPTState) -> PPTState:
+    """
+    配图建议节点：优化每张幻灯片的配图关键词，并准备进行搜索
+    GENERATOR_FUSED_IMAGE_QUERY=true 时 generator 已直接生成英文提示词，
+    本节点仅对不合格的提示词调用 LLM 修复，全部合格时直接跳过
+    """
+    if not state.get("slides"):
+        logger.warning("Image Advisor: No slides found to advise.")
+        return state
+
+    targets, slides_info = _prepare(state)
+    if not targets:
+        return {**state, "current_step": "image_searching"}
+
+    try:
+        return _apply(state, targets, _get_chain().invoke({"slides_info": slides_info}))
+    except Exception as e:
+        return _on_error(state, e)
+
+async def aimage_advisor_node(state: PPTState) -> PPTState:
+    """配图建议节点的异步版本 (Web UI 使用)"""
+    if not state.get("slides"):
+        logger.warning("Image Advisor: No slides found to advise.")
+        return state
+
+    targets, slides_info = _prepare(state)
+    if not targets:
+        return {**state, "current_step": "image_searching"}
+
     try:
-        result = chain.invoke({})
-        
-        # 更新 state 中的 slides
-        updated_slides = slides.copy()
-        for refinement in result.refinements:
-            idx = refinement.index - 1
-            if 0 <= idx < len(updated_slides):
-                updated_slides[idx].image_query = refinement.refined_query
-                logger.info(f"Slide {refinement.index} query refined: {refinement.refined_query}")
-        
-        return {
-            **state,
-            "slides": updated_slides,
-            "current_step": "image_searching"
-        }
+        return _apply(state, targets, await _get_chain().ainvoke({"slides_info": slides_info}))
     except Exception as e:
-        logger.exception("Image Advisor: Failed to refine queries.")
-        return {
-            **state,
-            "error": f"Error in image advisor: {str(e)}"
-        }
+        return _on_error(state, e)
@@ -1,9 +1,29 @@
-from langchain_core.prompts import ChatPromptTemplate
 from src.models.state import PPTState, PPTOutline
-from src.utils.llm_factory import LLMFactory
-from src.utils.prompt_manager import read_prompt
+from src.utils.chain_registry import ChainRegistry
 from src.utils.logger import logger
 
+# 用户消息模板
+USER_TEMPLATE = "{input}"
+
+def _get_chain():
+    # 获取预编译的链 (system prompt 读取自按照 RoleTaskFormat 编写的外部文件，修改后自动重载)
+    return ChainRegistry.get_chain("planner", "planner", "planner", USER_TEMPLATE, PPTOutline)
+
+def _on_outline(state: PPTState, outline) -> PPTState:
+    logger.info(f"Content Planner: Successfully generated outline: {outline.title}")
+    return {
+        **state,
+        "outline": outline,
+        "current_step": "content_generation"
+    }
+
+def _on_error(state: PPTState, e: Exception) -> PPTState:
+    logger.exception("Content Planner: Failed to generate outline.")
+    return {
+        **state,
+        "error": f"Error in content planner: {str(e)}"
+    }
+
 def content_planner_node(state: PPTState) -> PPTState:
     """
     大纲生成节点：根据用户输入生成 PPT 大纲
@@ -15,34 +35,23 @@ def content_planner_node(state: PPTState) -> PPTState:
 
     logger.info(f"Content Planner: Generating outline for: {input_text[:50]}...")
     
-    # 获取 planner 专用的模型
-    llm = LLMFactory.get_model("planner")
-    
-    # 从外部文件读取按照 RoleTaskFormat 编写的 Prompts
-    system_prompt = read_prompt("planner")
-    title = "Content Planner"
-    
-    # 定义提示词
-    prompt = ChatPromptTemplate.from_messages([
-        ("system", system_prompt),
-        ("user", "{input}")
-    ])
-    
-    # 使用结构化输出
-    structured_llm = llm.with_structured_output(PPTOutline)
-    chain = prompt | structured_llm
-    
     try:
-        outline = chain.invoke({"input": input_text, "title": title})
-        logger.info(f"Content Planner: Successfully generated outline: {outline.title}")
-        return {
-            **state,
-            "outline": outline,
-            "current_step": "content_generation"
-        }
+        outline = _get_chain().invoke({"input": input_text, "title": "Content Planner"})
+        return _on_outline(state, outline)
+    except Exception as e:
+        return _on_error(state, e)
+
+async def acontent_planner_node(state: PPTState) -> PPTState:
+    """大纲生成节点的异步版本 (Web UI 使用)"""
+    input_text = state.get("input_text", "")
+    if not input_text:
+        logger.error("Content Planner: No input text provided.")
+        return {**state, "error": "No input text provided"}
+
+    logger.info(f"Content Planner: Generating outline for: {input_text[:50]}...")
+
+    try:
+        outline = await _get_chain().ainvoke({"input": input_text, "title": "Content Planner"})
+        return _on_outline(state, outline)
     except Exception as e:
-        logger.exception("Content Planner: Failed to generate outline.")
-        return {
-            **state,
-            "error": f"Error in content planner: {str(e)}"
-        }
+        return _on_error(state, e)
@@ -1,27 +1,43 @@
+import asyncio
 import json
 import os
-import time
 import dashscope
 from dashscope import MultiModalConversation
 from langchain_core.messages import HumanMessage
+from langchain_core.runnables import RunnableConfig
 from src.models.state import PPTState
 from src.utils.llm_factory import LLMFactory
 from src.utils.prompt_manager import read_prompt
 from src.utils.tools import search_real_photo, generate_creative_image
+from src.utils.async_image_engine import AsyncImageEngine, DEFAULT_IMAGE_MODEL, DEFAULT_IMAGE_SIZE, DEFAULT_NEGATIVE_PROMPT
+from src.utils.image_cache import ImageCache, image_cache
+from src.utils.placeholder_image import PlaceholderImage
+from src.utils.render_cache import render_cache
+from src.utils.resilience import OutboundError, resilience
+from src.utils.speculative_images import speculative_images
 from src.utils.logger import logger
 
 # 设置DashScope API URL
 dashscope.base_http_api_url = 'https://dashscope.aliyuncs.com/api/v1'
 
+DASHSCOPE_IMAGE_MODEL = DEFAULT_IMAGE_MODEL
+
 def generate_image_with_dashscope(prompt: str) -> str:
     """
     使用DashScope multimodal-generation API生成图片
+    命中图片缓存时直接返回本地文件路径，否则生成后下载入缓存
     """
     api_key = os.getenv("LLM_API_KEY") or os.getenv("DASHSCOPE_API_KEY")
     if not api_key:
         logger.error("DashScope API key not found")
         return ""
 
+    key = ImageCache.make_key(DASHSCOPE_IMAGE_MODEL, DEFAULT_IMAGE_SIZE, DEFAULT_NEGATIVE_PROMPT, prompt)
+    return image_cache.get_or_create(key, lambda: _call_dashscope_image(prompt, api_key))
+
+def _call_dashscope_image(prompt: str, api_key: str) -> str:
+    """调用 DashScope 生成图片并返回结果 URL (重试与熔断由 resilience 统一处理)"""
+
     messages = [
         {
             "role": "user",
@@ -31,114 +47,227 @@ def generate_image_with_dashscope(prompt: str) -> str:
         }
     ]
 
-    # 重试逻辑：最多重试1次，遇到频率限制时等待5秒
-    max_retries = 1
-    retry_count = 0
+    def call():
+        logger.info(f"Generating image with DashScope: {prompt[:50]}...")
+        response = MultiModalConversation.call(
+            api_key=api_key,
+            model=DASHSCOPE_IMAGE_MODEL,
+            messages=messages,
+            result_format='message',
+            stream=False,
+            watermark=False,
+            prompt_extend=True,
+            negative_prompt=DEFAULT_NEGATIVE_PROMPT,
+            size=DEFAULT_IMAGE_SIZE
+        )
+        if response.status_code != 200:
+            raise OutboundError(response.status_code, f"{getattr(response, 'code', '')} {getattr(response, 'message', '')}")
+        return response
 
-    while retry_count <= max_retries:
-        try:
-            logger.info(f"Generating image with DashScope: {prompt[:50]}... (attempt {retry_count + 1})")
-            response = MultiModalConversation.call(
-                api_key=api_key,
-                model="qwen-image-max",
-                messages=messages,
-                result_format='message',
-                stream=False,
-                watermark=False,
-                prompt_extend=True,
-                negative_prompt="低分辨率，低画质，肢体畸形，手指畸形，画面过饱和，蜡像感，人脸无细节，过度光滑，画面具有AI感。构图混乱。文字模糊，扭曲。",
-                size='1664*928'
-            )
-
-            if response.status_code == 200:
-                # 从响应中提取图片URL
-                if hasattr(response, 'output') and response.output:
-                    if hasattr(response.output, 'choices') and response.output.choices:
-                        choice = response.output.choices[0]
-                        if hasattr(choice, 'message') and choice.message:
-                            content = choice.message.content
-                            if content and isinstance(content, list) and len(content) > 0:
-                                first_item = content[0]
-                                if isinstance(first_item, dict) and 'image' in first_item:
-                                    image_url = first_item['image']
-                                    logger.info(f"Image generated successfully: {image_url}")
-                                    return image_url
-                logger.error("Unexpected response format from DashScope API")
-                logger.error(f"Response structure: {response}")
-                if hasattr(response, 'output'):
-                    logger.error(f"Output attributes: {dir(response.output)}")
-                return ""
-            else:
-                logger.error(f"DashScope API error: {response.status_code}")
-                if hasattr(response, 'code'):
-                    logger.error(f"Error code: {response.code}")
-                if hasattr(response, 'message'):
-                    logger.error(f"Error message: {response.message}")
-
-                    # 检查是否是频率限制错误
-                    error_message = str(response.message).lower()
-                    if "rate limit" in error_message and retry_count < max_retries:
-                        logger.warning(f"Rate limit exceeded, retrying in 5 seconds... (attempt {retry_count + 1})")
-                        time.sleep(5)
-                        retry_count += 1
-                        continue
-                    else:
-                        return ""
-                return ""
-        except Exception as e:
-            logger.exception(f"Exception during DashScope image generation (attempt {retry_count + 1})")
-
-            # 检查是否是频率限制错误
-            error_message = str(e).lower()
-            if "rate limit" in error_message and retry_count < max_retries:
-                logger.warning(f"Rate limit exceeded, retrying in 5 seconds... (attempt {retry_count + 1})")
-                time.sleep(5)
-                retry_count += 1
-                continue
-            else:
-                return ""
+    try:
+        response = resilience.call("dashscope_image", call)
+    except Exception as e:
+        logger.error(f"DashScope image generation failed: {str(e)}")
+        return ""
 
-    # 所有重试都失败
-    logger.error("All retry attempts failed for DashScope image generation")
+    # 从响应中提取图片URL
+    if hasattr(response, 'output') and response.output:
+        if hasattr(response.output, 'choices') and response.output.choices:
+            choice = response.output.choices[0]
+            if hasattr(choice, 'message') and choice.message:
+                content = choice.message.content
+                if content and isinstance(content, list) and len(content) > 0:
+                    first_item = content[0]
+                    if isinstance(first_item, dict) and 'image' in first_item:
+                        image_url = first_item['image']
+                        logger.info(f"Image generated successfully: {image_url}")
+                        return image_url
+    logger.error("Unexpected response format from DashScope API")
+    logger.error(f"Response structure: {response}")
+    if hasattr(response, 'output'):
+        logger.error(f"Output attributes: {dir(response.output)}")
     return ""
 
-def visual_agent_node(state: PPTState) -> PPTState:
+def _is_usable_image(image_source: str) -> bool:
+    """图片来源是否可用：远程 URL 或缓存中的本地文件"""
+    return bool(image_source) and (image_source.startswith("http") or os.path.exists(image_source))
+
+def _build_prompt(slide) -> str:
+    """使用幻灯片的 image_query 作为 AI 生成图片的提示词"""
+    return slide.image_query or f"{slide.title} - {', '.join(slide.bullet_points)}"
+
+def _is_async_mode() -> bool:
+    # 尚未确认异步接口 (image-synthesis) 支持默认的 qwen-image-max，默认使用同步生成
+    return os.getenv("IMAGE_ASYNC_MODE", "false").lower() == "true"
+
+def start_speculative_generation(thread_id: str, slides):
     """
-    视觉 Agent 节点：直接使用 AI 生成图片
+    HITL 中断 (image_advisor 之后) 时在后台提前生成图片。
+    仅在异步模式且 IMAGE_SPECULATIVE=true (默认) 时启用。
     """
-    slides = state.get("slides", [])
-    if not slides:
-        return state
+    if not thread_id or not slides or not _is_async_mode():
+        return
+    if os.getenv("IMAGE_SPECULATIVE", "true").lower() != "true":
+        return
+    speculative_images.start(thread_id, [_build_prompt(slide) for slide in slides])
 
-    logger.info(f"Visual Agent: Generating AI images for {len(slides)} slides...")
+def _reuse_rendered(slides):
+    """
+    复用内容未变化的幻灯片上次渲染时的配图 (按幻灯片哈希匹配)
+    :return: (每页的幻灯片哈希, 仍需生成的幻灯片索引)
+    """
+    hashes = [render_cache.slide_hash(slide) for slide in slides]
+    remaining = []
+    for i, slide_hash in enumerate(hashes):
+        image_path = render_cache.get_image(slide_hash)
+        if _is_usable_image(image_path):
+            slides[i].image_path = image_path
+        else:
+            remaining.append(i)
+    if len(remaining) < len(slides):
+        logger.info(f"Visual Agent: Reused images of {len(slides) - len(remaining)} unchanged slides")
+    return hashes, remaining
 
-    updated_slides = slides.copy()
+def _remember_images(slides, hashes, indices):
+    """记录新生成的配图，占位图不记录 (下次渲染时重试生成)"""
+    for i in indices:
+        image_path = slides[i].image_path
+        if _is_usable_image(image_path) and not PlaceholderImage.is_placeholder(image_path):
+            render_cache.put_image(hashes[i], image_path)
+
+def _reuse_speculative(thread_id, slides, indices):
+    """复用推测生成中 prompt 未被修改的结果，返回仍需生成的幻灯片索引"""
+    prompts = {i: _build_prompt(slides[i]) for i in indices}
+    timeout = float(os.getenv("IMAGE_GEN_TIMEOUT", "300"))
+    results = speculative_images.collect(thread_id, prompts.values(), timeout=timeout)
+    return _apply_speculative(slides, indices, prompts, results)
+
+async def _areuse_speculative(thread_id, slides, indices):
+    """_reuse_speculative 的异步版本"""
+    prompts = {i: _build_prompt(slides[i]) for i in indices}
+    timeout = float(os.getenv("IMAGE_GEN_TIMEOUT", "300"))
+    results = await speculative_images.acollect(thread_id, prompts.values(), timeout=timeout)
+    return _apply_speculative(slides, indices, prompts, results)
+
+async def await_speculative(thread_id, slides):
+    """
+    等待会话的推测生成结束 (取消 image_query 已被修改的任务)。
+    生成的图片已写入图片缓存，任务队列模式在入队前调用，工作进程可直接命中缓存。
+    """
+    timeout = float(os.getenv("IMAGE_GEN_TIMEOUT", "300"))
+    await speculative_images.acollect(thread_id, [_build_prompt(slide) for slide in slides], timeout=timeout)
+
+def _apply_speculative(slides, indices, prompts, results):
+    remaining = []
+    for i in indices:
+        image_path = results.get(prompts[i])
+        if _is_usable_image(image_path):
+            slides[i].image_path = image_path
+            logger.info(f"Visual Agent: Slide {i+1} reused speculative image")
+        else:
+            remaining.append(i)
+    if results:
+        logger.info(f"Visual Agent: Reused {len(indices) - len(remaining)} speculative images")
+    return remaining
+
+def _on_image(slides, prompts):
+    """生成完成的回调：成功时回填 image_path，失败时使用本地占位图"""
+    def on_complete(i, image_url):
+        slide = slides[i]
+        if _is_usable_image(image_url):
+            slide.image_path = image_url
+            logger.info(f"Visual Agent: Slide {i+1} got AI-generated image")
+        else:
+            logger.warning(f"Visual Agent: Failed to generate image for Slide {i+1}")
+            slide.image_path = PlaceholderImage.render(slide.title or prompts[i])
+    return on_complete
+
+def _generate_async(slides, indices):
+    """异步模式：一次性提交所有幻灯片的任务，任务完成时回填 image_path"""
+    prompts = {i: _build_prompt(slides[i]) for i in indices}
+    AsyncImageEngine().run(prompts, on_complete=_on_image(slides, prompts))
 
-    for i, slide in enumerate(updated_slides):
+def _generate_sync(slides, indices):
+    """同步模式：逐页调用 DashScope 生成图片"""
+    for i in indices:
+        slide = slides[i]
         logger.info(f"Visual Agent: Generating image for Slide {i+1}: {slide.title}")
 
-        # 使用幻灯片的 image_query 作为 AI 生成图片的提示词
-        prompt = slide.image_query or f"{slide.title} - {', '.join(slide.bullet_points)}"
+        prompt = _build_prompt(slide)
 
         try:
             # 直接使用 DashScope API 生成图片
             image_url = generate_image_with_dashscope(prompt)
 
-            if image_url and image_url.startswith("http"):
+            if _is_usable_image(image_url):
                 slide.image_path = image_url
                 logger.info(f"Visual Agent: Slide {i+1} got AI-generated image")
             else:
                 logger.warning(f"Visual Agent: Failed to generate image for Slide {i+1}")
-                # 使用占位图作为fallback (使用支持PNG的服务)
-                slide.image_path = f"https://via.placeholder.com/600x400.png?text={prompt.replace(' ', '+')}"
+                # 使用本地渲染的占位图作为fallback
+                slide.image_path = PlaceholderImage.render(slide.title or prompt)
 
         except Exception as e:
             logger.error(f"Visual Agent: Error generating image for slide {i+1}: {str(e)}")
-            # 使用占位图作为fallback
-            slide.image_path = f"https://placehold.co/600x400?text={prompt.replace(' ', '+')}"
+            # 使用本地渲染的占位图作为fallback
+            slide.image_path = PlaceholderImage.render(slide.title or prompt)
+
+def _finish(state: PPTState, slides) -> PPTState:
+    stats = image_cache.stats()
+    logger.info(f"Visual Agent: Image cache hits: {stats['hits']}, misses: {stats['misses']}, hit rate: {stats['hit_rate']:.0%}")
 
     return {
         **state,
-        "slides": updated_slides,
+        "slides": slides,
         "current_step": "final_render"
     }
+
+def visual_agent_node(state: PPTState, config: RunnableConfig = None) -> PPTState:
+    """
+    视觉 Agent 节点：直接使用 AI 生成图片
+    IMAGE_ASYNC_MODE=true 时使用异步任务并发生成，否则 (默认) 逐页同步生成
+    会优先复用 HITL 中断期间推测生成的图片 (按 thread_id 与 image_query 匹配)
+    """
+    slides = state.get("slides", [])
+    if not slides:
+        return state
+
+    logger.info(f"Visual Agent: Generating AI images for {len(slides)} slides...")
+
+    updated_slides = slides.copy()
+
+    thread_id = (config or {}).get("configurable", {}).get("thread_id")
+    hashes, pending = _reuse_rendered(updated_slides)
+    indices = _reuse_speculative(thread_id, updated_slides, pending)
+
+    if _is_async_mode():
+        _generate_async(updated_slides, indices)
+    else:
+        _generate_sync(updated_slides, indices)
+
+    _remember_images(updated_slides, hashes, pending)
+    return _finish(state, updated_slides)
+
+async def avisual_agent_node(state: PPTState, config: RunnableConfig = None) -> PPTState:
+    """视觉 Agent 节点的异步版本 (Web UI 使用)：等待图片任务期间不占用线程"""
+    slides = state.get("slides", [])
+    if not slides:
+        return state
+
+    logger.info(f"Visual Agent: Generating AI images for {len(slides)} slides...")
+
+    updated_slides = slides.copy()
+
+    thread_id = (config or {}).get("configurable", {}).get("thread_id")
+    hashes, pending = _reuse_rendered(updated_slides)
+    indices = await _areuse_speculative(thread_id, updated_slides, pending)
+
+    if _is_async_mode():
+        prompts = {i: _build_prompt(updated_slides[i]) for i in indices}
+        await AsyncImageEngine().arun(prompts, on_complete=_on_image(updated_slides, prompts))
+    else:
+        # 同步模式使用 DashScope SDK 的阻塞调用，放到线程中执行
+        await asyncio.to_thread(_generate_sync, updated_slides, indices)
+
+    _remember_images(updated_slides, hashes, pending)
+    return _finish(state, updated_slides)
@@ -1,28 +1,80 @@
+import asyncio
 import gradio as gr
 import json
+import os
 import uuid
+from langchain_core.utils.json import parse_partial_json
 from src.workflow.graph import app
 from src.models.state import PPTOutline, SlideContent
+from src.nodes.visual_agent import start_speculative_generation, await_speculative
+from src.utils.llm_factory import LLMFactory
+from src.utils.job_queue import JobQueue, JobWorkerPool, get_job_queue, is_job_queue_enabled
+from src.utils.slide_thumbnail import slide_thumbnailer
 from src.utils.logger import logger
 from src.utils.docx_parser import DocxParser
 from src.utils.whisper_asr import WhisperASR
+from src.utils.input_condenser import InputCondenser
 
 def process_input(input_text, upload_file):
-    """处理混合输入"""
+    """处理混合输入 (过长的文档与转录文本会先浓缩，保证 planner 输入大小有上限)"""
     final_text = input_text or ""
     if upload_file is not None:
         file_path = upload_file.name
         if file_path.endswith(".docx"):
-            final_text = f"{final_text}\n\n参考文档内容：\n{DocxParser.parse(file_path)}"
+            final_text = f"{final_text}\n\n参考文档内容：\n{InputCondenser.condense(DocxParser.parse(file_path))}"
         elif file_path.endswith((".mp3", ".wav", ".m4a", ".flac")):
-            final_text = f"{final_text}\n\n语音转录内容：\n{WhisperASR.transcribe(file_path)}"
+            final_text = f"{final_text}\n\n语音转录内容：\n{InputCondenser.condense(WhisperASR.transcribe(file_path))}"
     return final_text
 
-def start_workflow(input_text, upload_file):
-    """启动工作流并运行到第一个中断点 (Planner)"""
-    combined_text = process_input(input_text, upload_file)
+def _chunk_text(chunk) -> str:
+    """提取消息块中的增量文本 (普通内容或 tool call 参数)"""
+    text = chunk.content if isinstance(chunk.content, str) else ""
+    for tool_chunk in getattr(chunk, "tool_call_chunks", None) or []:
+        text += tool_chunk.get("args") or ""
+    return text
+
+def _parse_partial(buffer: str):
+    """解析尚未完整的 JSON 文本，无法解析时返回 None"""
+    start = buffer.find("{")
+    if start < 0:
+        return None
+    try:
+        return parse_partial_json(buffer[start:])
+    except Exception:
+        return None
+
+async def _run_streaming(payload, config, node_name):
+    """
+    运行工作流直到下一个中断点 (异步执行，等待 LLM 期间不占用线程)。
+    UI_STREAMING=true (默认) 时使用 LangGraph messages 流，逐个 token 解析指定节点的结构化输出，
+    每次解析出新内容时产出当前的部分结果列表 (并发调用各自独立解析)。
+    """
+    if os.getenv("UI_STREAMING", "true").lower() != "true":
+        await app.ainvoke(payload, config=config)
+        return
+
+    buffers = {}
+    async for chunk, metadata in app.astream(payload, config=config, stream_mode="messages"):
+        if metadata.get("langgraph_node") != node_name:
+            continue
+        text = _chunk_text(chunk)
+        if not text:
+            continue
+        key = chunk.id or "default"
+        buffers[key] = buffers.get(key, "") + text
+        parsed = [_parse_partial(buffer) for buffer in buffers.values()]
+        yield [p for p in parsed if isinstance(p, dict)]
+
+def _format_outline(title, chapters) -> str:
+    return f"标题: {title}\n" + "\n".join([f"- {c}" for c in chapters])
+
+async def start_workflow(input_text, upload_file):
+    """启动工作流并运行到第一个中断点 (Planner)，流式展示生成中的大纲"""
+    # 文档解析、语音转录与长文本浓缩为阻塞操作，放到线程中执行
+    combined_text = await asyncio.to_thread(process_input, input_text, upload_file)
     if not combined_text.strip():
-        return gr.update(visible=False), "请输入需求", ""
+        yield gr.update(visible=False), "请输入需求", ""
+        return
     
     # 为当前会话生成唯一的 thread_id
     thread_id = str(uuid.uuid4())
@@ -42,24 +94,30 @@ def start_workflow(input_text, upload_file):
     }
     
     try:
-        # 运行工作流，它会在 planner 之后中断
-        app.invoke(initial_state, config=config)
+        # 运行工作流，它会在 planner 之后中断；生成过程中逐步展示已解析出的标题与章节
+        async for partials in _run_streaming(initial_state, config, "planner"):
+            if partials:
+                partial = partials[0]
+                chapters = [c for c in partial.get("chapters") or [] if isinstance(c, str)]
+                yield gr.update(visible=True), _format_outline(partial.get("title", ""), chapters), thread_id
         
         # 获取中断后的状态
-        state = app.get_state(config).values
+        state = (await app.aget_state(config)).values
         outline = state.get("outline")
         
         if outline:
-            outline_str = f"标题: {outline.title}\n" + "\n".join([f"- {c}" for c in outline.chapters])
-            return gr.update(visible=True), outline_str, thread_id
-        return gr.update(visible=False), "未能生成大纲", thread_id
+            yield gr.update(visible=True), _format_outline(outline.title, outline.chapters), thread_id
+            return
+        yield gr.update(visible=False), "未能生成大纲", thread_id
     except Exception as e:
         logger.exception("UI Error in start_workflow")
-        return gr.update(visible=False), f"系统异常: {str(e)}", ""
+        yield gr.update(visible=False), f"系统异常: {str(e)}", ""
 
-def resume_to_details(thread_id, outline_text):
-    """从大纲中断点恢复，运行到第二个中断点 (Image Advisor)"""
-    if not thread_id: return gr.update(visible=False), "无效的会话"
+async def resume_to_details(thread_id, outline_text):
+    """从大纲中断点恢复，运行到第二个中断点 (Image Advisor)，流式展示生成中的幻灯片"""
+    if not thread_id:
+        yield gr.update(visible=False), "无效的会话"
+        return
     
     config = {"configurable": {"thread_id": thread_id}}
     logger.info(f"UI: Resuming session {thread_id} to details...")
@@ -72,24 +130,109 @@ def resume_to_details(thread_id, outline_text):
         new_outline = PPTOutline(title=title, chapters=chapters)
         
         # 更新状态：覆盖 outline 并标记已批准
-        app.update_state(config, {"outline": new_outline, "is_approved": True}, as_node="planner")
+        await app.aupdate_state(config, {"outline": new_outline, "is_approved": True}, as_node="planner")
         
-        # 2. 继续运行，它会在 image_advisor 之后中断
-        app.invoke(None, config=config)
+        # 2. 继续运行，它会在 image_advisor 之后中断；逐页展示 generator 已生成的幻灯片
+        async for partials in _run_streaming(None, config, "generator"):
+            partial_slides = []
+            for partial in partials:
+                # 单次生成返回 {"slides": [...]}，分章节生成时每个调用返回一张幻灯片
+                partial_slides.extend((partial.get("slides") or []) if "slides" in partial else [partial])
+            partial_slides = [slide for slide in partial_slides if isinstance(slide, dict) and slide]
+            if partial_slides:
+                yield gr.update(visible=True), json.dumps(partial_slides, indent=2, ensure_ascii=False)
         
         # 3. 获取最新状态
-        state = app.get_state(config).values
+        state = (await app.aget_state(config)).values
         slides = state.get("slides", [])
         slides_json = json.dumps([s.dict() for s in slides], indent=2, ensure_ascii=False)
+
+        # 4. 用户编辑详情期间，在后台提前生成配图
+        start_speculative_generation(thread_id, slides)
         
-        return gr.update(visible=True), slides_json
+        yield gr.update(visible=True), slides_json
     except Exception as e:
         logger.exception("UI Error in resume_to_details")
-        return gr.update(visible=False), f"生成详情异常: {str(e)}"
+        yield gr.update(visible=False), f"生成详情异常: {str(e)}"
+
+def _format_preview(outline, slides) -> str:
+    slides_md = ""
+    slide_number = 1
+
+    # 添加标题页预览
+    if outline and outline.title:
+        slides_md += f"### Slide {slide_number}: {outline.title} (标题页)\n"
+        slides_md += f"**演示文稿标题页**\n\n"
+        slides_md += f"**章节大纲:**\n"
+        for chapter in outline.chapters:
+            slides_md += f"- {chapter}\n"
+        slides_md += f"\n---\n\n"
+        slide_number += 1
 
-def resume_to_render(thread_id, slides_json):
-    """从详情中断点恢复，完成最终渲染"""
-    if not thread_id: return "无效的会话", None
+    # 添加内容页预览
+    for slide in slides:
+        slides_md += f"### Slide {slide_number}: {slide.title}\n"
+        for point in slide.bullet_points: slides_md += f"- {point}\n"
+        slides_md += f"\n**视觉建议:** `{slide.image_query}` | **版式:** `{slide.layout_type}`\n\n---\n\n"
+        slide_number += 1
+    return slides_md
+
+async def _render_with_job_queue(thread_id, config):
+    """
+    任务队列模式：配图生成与渲染提交给工作进程执行，轮询任务状态直到结束。
+    产出 (状态信息, None)，成功时把结果写回工作流状态。
+    """
+    state = (await app.aget_state(config)).values
+    slides = state.get("slides", [])
+    await await_speculative(thread_id, slides)
+
+    queue = get_job_queue()
+    job_id = queue.enqueue("render", {
+        "thread_id": thread_id,
+        "outline": state["outline"].model_dump(),
+        "slides": [s.model_dump() for s in slides],
+        "template_path": state.get("template_path"),
+        "output_path": state.get("output_path")
+    })
+    yield f"渲染任务已提交，任务 ID: `{job_id}`\n\n等待工作进程处理..."
+
+    poll_interval = float(os.getenv("JOB_POLL_INTERVAL", "0.5"))
+    status = JobQueue.QUEUED
+    while True:
+        job = queue.get(job_id)
+        if job["status"] in (JobQueue.DONE, JobQueue.FAILED):
+            break
+        # 只在状态变化时更新界面 (工作进程崩溃后任务会重新入队)，避免每次轮询都推送相同的消息
+        if job["status"] != status:
+            status = job["status"]
+            if status == JobQueue.RUNNING:
+                yield f"渲染任务进行中，任务 ID: `{job_id}`\n\n正在生成配图并渲染..."
+            else:
+                yield f"渲染任务已重新入队，任务 ID: `{job_id}`\n\n等待工作进程处理..."
+        await asyncio.sleep(poll_interval)
+
+    if job["status"] == JobQueue.FAILED:
+        raise RuntimeError(job["error"])
+
+    result = job["result"]
+    # 工作进程已把结果写回检查点时不再重复写入；否则 (内存检查点) 以 renderer 的身份写回，工作流随之结束
+    if result.get("checkpointed"):
+        return
+    await app.aupdate_state(config, {
+        "slides": [SlideContent(**s) for s in result["slides"]],
+        "generated_file": result["generated_file"],
+        "current_step": "completed"
+    }, as_node="renderer")
+
+async def resume_to_render(thread_id, slides_json):
+    """
+    从详情中断点恢复，完成最终渲染
+    JOB_QUEUE_ENABLED=true 时提交到持久化任务队列，由预热的工作进程执行，期间展示任务状态
+    预览使用本地绘制并缓存的缩略图，不再让浏览器重新下载远程图片
+    """
+    if not thread_id:
+        yield "无效的会话", None, None
+        return
     
     config = {"configurable": {"thread_id": thread_id}}
     logger.info(f"UI: Finalizing session {thread_id}...")
@@ -99,44 +242,29 @@ def resume_to_render(thread_id, slides_json):
         slides_data = json.loads(slides_json)
         updated_slides = [SlideContent(**s) for s in slides_data]
         
-        app.update_state(config, {"slides": updated_slides}, as_node="image_advisor")
+        await app.aupdate_state(config, {"slides": updated_slides}, as_node="image_advisor")
         
         # 2. 继续运行直到结束 (现在会经过 visual_agent 节点)
-        app.invoke(None, config=config)
+        if is_job_queue_enabled():
+            async for status in _render_with_job_queue(thread_id, config):
+                yield status, None, None
+        else:
+            # 渲染在独立线程池中执行
+            await app.ainvoke(None, config=config)
         
         # 3. 获取结果
-        state = app.get_state(config).values
+        state = (await app.aget_state(config)).values
         outline = state.get("outline")
         slides = state.get("slides", [])
         file_path = state.get("generated_file")
 
         logger.info(f"UI: Final state - outline: {outline.title if outline else 'None'}, slides: {len(slides)}, file: {file_path}")
-
-        slides_md = ""
-        slide_number = 1
-
-        # 添加标题页预览
-        if outline and outline.title:
-            slides_md += f"### Slide {slide_number}: {outline.title} (标题页)\n"
-            slides_md += f"**演示文稿标题页**\n\n"
-            slides_md += f"**章节大纲:**\n"
-            for chapter in outline.chapters:
-                slides_md += f"- {chapter}\n"
-            slides_md += f"\n---\n\n"
-            slide_number += 1
-
-        # 添加内容页预览
-        for slide in slides:
-            slides_md += f"### Slide {slide_number}: {slide.title}\n"
-            for point in slide.bullet_points: slides_md += f"- {point}\n"
-            if slide.image_path: slides_md += f"\n![Image]({slide.image_path})\n"
-            slides_md += f"\n**视觉建议:** `{slide.image_query}` | **版式:** `{slide.layout_type}`\n\n---\n\n"
-            slide_number += 1
             
-        return slides_md, file_path
+        thumbnails = await asyncio.to_thread(slide_thumbnailer.render_deck, outline, slides, state.get("template_path"))
+        yield _format_preview(outline, slides), thumbnails, file_path
     except Exception as e:
         logger.exception("UI Error in resume_to_render")
-        return f"渲染异常: {str(e)}", None
+        yield f"渲染异常: {str(e)}", None, None
 
 def create_ui():
     with gr.Blocks(title="ChatPPT - AI Agent (HITL & Persistence)") as demo:
@@ -164,6 +292,7 @@ def create_ui():
             with gr.Column(scale=1):
                 gr.Markdown("### 4. 最终成品预览")
                 download_output = gr.File(label="下载生成的 PPT 文件")
+                thumbnails_output = gr.Gallery(label="幻灯片缩略图", columns=2, height="auto")
                 slides_output = gr.Markdown(label="预览内容", value="等待渲染完成后生成...")
                 session_info = gr.Label(label="当前会话 ID (Thread ID)")
         
@@ -183,7 +312,7 @@ def create_ui():
         render_btn.click(
             fn=resume_to_render, 
             inputs=[thread_id_state, details_editor], 
-            outputs=[slides_output, download_output]
+            outputs=[slides_output, thumbnails_output, download_output]
         )
         
     return demo
@@ -194,6 +323,13 @@ def launch_ui():
     # 禁用代理对 localhost 的影响
     os.environ['no_proxy'] = '127.0.0.1,localhost'
 
+    # 预热 LLM 连接池
+    LLMFactory.warm_up()
+
+    # 启动渲染工作进程
+    if is_job_queue_enabled():
+        JobWorkerPool().start()
+
     demo = create_ui()
     demo.launch(
         theme=gr.themes.Soft(),
@@ -202,6 +338,7 @@ def launch_ui():
         show_error=True,
         share=False,
         enable_monitoring=False,
+        allowed_paths=[os.path.abspath(slide_thumbnailer.cache.cache_dir)],
         app_kwargs={
             "timeout": 120,
             "proxy_headers": False
@@ -0,0 +1,357 @@
+import asyncio
+import os
+import threading
+import time
+from collections import deque
+from typing import Callable, Dict, Hashable, Optional, Tuple
+import httpx
+import requests
+from src.utils.image_cache import ImageCache, image_cache
+from src.utils.resilience import CircuitOpenError, resilience
+from src.utils.logger import logger
+
+# 图片生成的公共参数 (同步与异步路径共用)
+DEFAULT_IMAGE_MODEL = "qwen-image-max"
+DEFAULT_IMAGE_SIZE = "1664*928"
+DEFAULT_NEGATIVE_PROMPT = "低分辨率，低画质，肢体畸形，手指畸形，画面过饱和，蜡像感，人脸无细节，过度光滑，画面具有AI感。构图混乱。文字模糊，扭曲。"
+
+class AsyncImageEngine:
+    """
+    异步图片生成引擎：采用 DashScope 异步任务协议，先提交任务再统一轮询。
+
+    1. 提交: POST {base_url}/services/aigc/text2image/image-synthesis (X-DashScope-Async: enable)
+    2. 轮询: GET {base_url}/tasks/{task_id}，在同一个循环中查询所有进行中的任务
+    3. 同时在途的任务数受 max_concurrency 限制，有任务完成即补充提交
+    4. 命中图片缓存的 prompt 不提交任务，生成成功的图片下载入缓存并返回本地路径
+    5. cancel() 可在其他线程中取消尚未完成的任务 (未提交的直接丢弃，在途的调用取消接口)
+
+    base_url 可通过 IMAGE_GEN_API_BASE 指向本地 stub 服务，以便离线压测。
+    """
+
+    SUBMIT_PATH = "/services/aigc/text2image/image-synthesis"
+    TASK_PATH = "/tasks/{task_id}"
+    CANCEL_PATH = "/tasks/{task_id}/cancel"
+    # 熔断器名称
+    ENDPOINT = "dashscope_async"
+
+    # DashScope 任务状态
+    SUCCEEDED = "SUCCEEDED"
+    FINAL_FAILED = ("FAILED", "CANCELED", "UNKNOWN")
+
+    def __init__(self,
+                 api_key: Optional[str] = None,
+                 base_url: Optional[str] = None,
+                 model: Optional[str] = None,
+                 max_concurrency: Optional[int] = None,
+                 poll_interval: Optional[float] = None,
+                 timeout: Optional[float] = None):
+        self.api_key = api_key or os.getenv("LLM_API_KEY") or os.getenv("DASHSCOPE_API_KEY")
+        self.base_url = (base_url or os.getenv("IMAGE_GEN_API_BASE") or "https://dashscope.aliyuncs.com/api/v1").rstrip("/")
+        self.model = model or os.getenv("IMAGE_ASYNC_MODEL", DEFAULT_IMAGE_MODEL)
+        self.max_concurrency = max(1, max_concurrency or int(os.getenv("IMAGE_GEN_CONCURRENCY", "4")))
+        self.poll_interval = poll_interval if poll_interval is not None else float(os.getenv("IMAGE_POLL_INTERVAL", "2"))
+        self.timeout = timeout if timeout is not None else float(os.getenv("IMAGE_GEN_TIMEOUT", "300"))
+        self.session = requests.Session()
+        self._cancelled = set()
+        self._cancel_lock = threading.Lock()
+
+    def _headers(self, is_async: bool = False) -> Dict[str, str]:
+        headers = {
+            "Authorization": f"Bearer {self.api_key}",
+            "Content-Type": "application/json"
+        }
+        if is_async:
+            headers["X-DashScope-Async"] = "enable"
+        return headers
+
+    def _payload(self, prompt: str) -> Dict:
+        return {
+            "model": self.model,
+            "input": {
+                "prompt": prompt,
+                "negative_prompt": DEFAULT_NEGATIVE_PROMPT
+            },
+            "parameters": {
+                "size": DEFAULT_IMAGE_SIZE,
+                "n": 1,
+                "prompt_extend": True,
+                "watermark": False
+            }
+        }
+
+    @staticmethod
+    def _parse_task(data: Dict) -> Tuple[str, str]:
+        output = data.get("output", {})
+        status = output.get("task_status", "UNKNOWN")
+        results = output.get("results") or []
+        image_url = results[0].get("url", "") if results else ""
+        return status, image_url
+
+    def submit(self, prompt: str) -> str:
+        """提交一个图片生成任务，返回 task_id (失败时返回空字符串)"""
+        def call():
+            response = self.session.post(
+                f"{self.base_url}{self.SUBMIT_PATH}",
+                json=self._payload(prompt),
+                headers=self._headers(is_async=True),
+                timeout=10
+            )
+            response.raise_for_status()
+            return response
+
+        try:
+            response = resilience.call(self.ENDPOINT, call)
+            task_id = response.json().get("output", {}).get("task_id", "")
+            logger.info(f"AsyncImageEngine: Submitted task {task_id} for prompt: {prompt[:50]}...")
+            return task_id
+        except Exception as e:
+            logger.error(f"AsyncImageEngine: Failed to submit task: {str(e)}")
+            return ""
+
+    async def asubmit(self, client: httpx.AsyncClient, prompt: str) -> str:
+        """submit 的异步版本"""
+        async def call():
+            response = await client.post(
+                f"{self.base_url}{self.SUBMIT_PATH}",
+                json=self._payload(prompt),
+                headers=self._headers(is_async=True)
+            )
+            response.raise_for_status()
+            return response
+
+        try:
+            response = await resilience.acall(self.ENDPOINT, call)
+            task_id = response.json().get("output", {}).get("task_id", "")
+            logger.info(f"AsyncImageEngine: Submitted task {task_id} for prompt: {prompt[:50]}...")
+            return task_id
+        except Exception as e:
+            logger.error(f"AsyncImageEngine: Failed to submit task: {str(e)}")
+            return ""
+
+    def fetch(self, task_id: str) -> Tuple[str, str]:
+        """查询任务状态，返回 (task_status, image_url)"""
+        def call():
+            response = self.session.get(
+                f"{self.base_url}{self.TASK_PATH.format(task_id=task_id)}",
+                headers=self._headers(),
+                timeout=10
+            )
+            response.raise_for_status()
+            return response
+
+        try:
+            # 轮询本身会在下一轮重试，这里只尝试一次并计入熔断
+            response = resilience.call(self.ENDPOINT, call, max_attempts=1)
+            return self._parse_task(response.json())
+        except CircuitOpenError:
+            # 服务不可用时立即结束任务，由调用方使用本地占位图
+            return "UNKNOWN", ""
+        except Exception as e:
+            # 单次查询失败不终止任务，下一轮继续轮询
+            logger.warning(f"AsyncImageEngine: Failed to fetch task {task_id}: {str(e)}")
+            return "RUNNING", ""
+
+    async def afetch(self, client: httpx.AsyncClient, task_id: str) -> Tuple[str, str]:
+        """fetch 的异步版本"""
+        async def call():
+            response = await client.get(
+                f"{self.base_url}{self.TASK_PATH.format(task_id=task_id)}",
+                headers=self._headers()
+            )
+            response.raise_for_status()
+            return response
+
+        try:
+            response = await resilience.acall(self.ENDPOINT, call, max_attempts=1)
+            return self._parse_task(response.json())
+        except CircuitOpenError:
+            return "UNKNOWN", ""
+        except Exception as e:
+            logger.warning(f"AsyncImageEngine: Failed to fetch task {task_id}: {str(e)}")
+            return "RUNNING", ""
+
+    def cancel(self, keys):
+        """取消指定 key 的任务，被取消的任务以空结果结束"""
+        with self._cancel_lock:
+            self._cancelled.update(keys)
+
+    def _is_cancelled(self, key) -> bool:
+        with self._cancel_lock:
+            return key in self._cancelled
+
+    def _cancel_task(self, task_id: str):
+        """调用取消接口 (仅对排队中的任务生效)，失败时忽略"""
+        try:
+            self.session.post(
+                f"{self.base_url}{self.CANCEL_PATH.format(task_id=task_id)}",
+                headers=self._headers(),
+                timeout=10
+            )
+        except Exception as e:
+            logger.debug(f"AsyncImageEngine: Failed to cancel task {task_id}: {str(e)}")
+
+    async def _acancel_task(self, client: httpx.AsyncClient, task_id: str):
+        try:
+            await client.post(f"{self.base_url}{self.CANCEL_PATH.format(task_id=task_id)}", headers=self._headers())
+        except Exception as e:
+            logger.debug(f"AsyncImageEngine: Failed to cancel task {task_id}: {str(e)}")
+
+    def _split_cached(self, prompts: Dict[Hashable, str], finish) -> Tuple[Dict[Hashable, str], deque]:
+        """命中缓存的 prompt 直接完成，返回 (key -> 缓存键, 待提交队列)"""
+        cache_keys = {}
+        pending = deque()
+        for key, prompt in prompts.items():
+            cache_keys[key] = ImageCache.make_key(self.model, DEFAULT_IMAGE_SIZE, DEFAULT_NEGATIVE_PROMPT, prompt)
+            cached_path = image_cache.get(cache_keys[key])
+            if cached_path:
+                finish(key, cached_path)
+            else:
+                pending.append((key, prompt))
+        return cache_keys, pending
+
+    def run(self,
+            prompts: Dict[Hashable, str],
+            on_complete: Optional[Callable[[Hashable, str], None]] = None) -> Dict[Hashable, str]:
+        """
+        批量生成图片
+        :param prompts: key -> prompt，key 通常为幻灯片索引
+        :param on_complete: 每个任务结束时回调 (key, image_url)，失败时 image_url 为空字符串
+        :return: key -> image_url (已缓存时为本地文件路径)
+        """
+        results: Dict[Hashable, str] = {}
+
+        def finish(key, url):
+            results[key] = url
+            if on_complete:
+                on_complete(key, url)
+
+        if not self.api_key:
+            logger.error("DashScope API key not found")
+            for key in prompts:
+                finish(key, "")
+            return results
+
+        cache_keys, pending = self._split_cached(prompts, finish)
+
+        in_flight: Dict[str, Hashable] = {}
+        start = time.monotonic()
+
+        logger.info(f"AsyncImageEngine: Generating {len(pending)} images (concurrency: {self.max_concurrency})")
+
+        while pending or in_flight:
+            # 补充提交，直到在途任务达到并发上限
+            while pending and len(in_flight) < self.max_concurrency:
+                key, prompt = pending.popleft()
+                if self._is_cancelled(key):
+                    finish(key, "")
+                    continue
+                task_id = self.submit(prompt)
+                if task_id:
+                    in_flight[task_id] = key
+                else:
+                    finish(key, "")
+
+            if not in_flight:
+                continue
+
+            if time.monotonic() - start > self.timeout:
+                logger.error(f"AsyncImageEngine: Timed out with {len(in_flight) + len(pending)} unfinished tasks")
+                for key in list(in_flight.values()) + [key for key, _ in pending]:
+                    finish(key, "")
+                break
+
+            time.sleep(self.poll_interval)
+
+            for task_id in list(in_flight):
+                if self._is_cancelled(in_flight[task_id]):
+                    logger.info(f"AsyncImageEngine: Task {task_id} cancelled")
+                    self._cancel_task(task_id)
+                    finish(in_flight.pop(task_id), "")
+                    continue
+
+                status, image_url = self.fetch(task_id)
+                if status == self.SUCCEEDED:
+                    logger.info(f"AsyncImageEngine: Task {task_id} succeeded: {image_url}")
+                    key = in_flight.pop(task_id)
+                    finish(key, image_cache.put_url(cache_keys[key], image_url) or image_url)
+                elif status in self.FINAL_FAILED:
+                    logger.error(f"AsyncImageEngine: Task {task_id} ended with status {status}")
+                    finish(in_flight.pop(task_id), "")
+
+        logger.info(f"AsyncImageEngine: Finished {len(results)} tasks in {time.monotonic() - start:.1f}s")
+        return results
+
+    async def arun(self,
+                   prompts: Dict[Hashable, str],
+                   on_complete: Optional[Callable[[Hashable, str], None]] = None) -> Dict[Hashable, str]:
+        """
+        run 的异步版本：轮询间隔使用 asyncio.sleep，等待期间不占用线程
+        (Web UI 的异步执行路径使用)
+        """
+        results: Dict[Hashable, str] = {}
+
+        def finish(key, url):
+            results[key] = url
+            if on_complete:
+                on_complete(key, url)
+
+        if not self.api_key:
+            logger.error("DashScope API key not found")
+            for key in prompts:
+                finish(key, "")
+            return results
+
+        cache_keys, pending = self._split_cached(prompts, finish)
+        in_flight: Dict[str, Hashable] = {}
+        start = time.monotonic()
+
+        logger.info(f"AsyncImageEngine: Generating {len(pending)} images (concurrency: {self.max_concurrency})")
+
+        async with httpx.AsyncClient(timeout=10) as client:
+            while pending or in_flight:
+                # 补充提交，直到在途任务达到并发上限 (同一批提交并发发出)
+                batch = []
+                while pending and len(in_flight) + len(batch) < self.max_concurrency:
+                    key, prompt = pending.popleft()
+                    if self._is_cancelled(key):
+                        finish(key, "")
+                    else:
+                        batch.append((key, prompt))
+                task_ids = await asyncio.gather(*(self.asubmit(client, prompt) for _, prompt in batch))
+                for (key, _), task_id in zip(batch, task_ids):
+                    if task_id:
+                        in_flight[task_id] = key
+                    else:
+                        finish(key, "")
+
+                if not in_flight:
+                    continue
+
+                if time.monotonic() - start > self.timeout:
+                    logger.error(f"AsyncImageEngine: Timed out with {len(in_flight) + len(pending)} unfinished tasks")
+                    for key in list(in_flight.values()) + [key for key, _ in pending]:
+                        finish(key, "")
+                    break
+
+                await asyncio.sleep(self.poll_interval)
+
+                for task_id in list(in_flight):
+                    if self._is_cancelled(in_flight[task_id]):
+                        logger.info(f"AsyncImageEngine: Task {task_id} cancelled")
+                        await self._acancel_task(client, task_id)
+                        finish(in_flight.pop(task_id), "")
+
+                statuses = await asyncio.gather(*(self.afetch(client, task_id) for task_id in in_flight))
+                for task_id, (status, image_url) in zip(list(in_flight), statuses):
+                    if status == self.SUCCEEDED:
+                        logger.info(f"AsyncImageEngine: Task {task_id} succeeded: {image_url}")
+                        key = in_flight.pop(task_id)
+                        # 下载入缓存为阻塞的文件与网络 IO，放到线程中执行
+                        cached_path = await asyncio.to_thread(image_cache.put_url, cache_keys[key], image_url)
+                        finish(key, cached_path or image_url)
+                    elif status in self.FINAL_FAILED:
+                        logger.error(f"AsyncImageEngine: Task {task_id} ended with status {status}")
+                        finish(in_flight.pop(task_id), "")
+
+        logger.info(f"AsyncImageEngine: Finished {len(results)} tasks in {time.monotonic() - start:.1f}s")
+        return results
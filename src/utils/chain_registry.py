@@ -0,0 +1,60 @@
+import threading
+from typing import Type
+from pydantic import BaseModel
+from langchain_core.prompts import ChatPromptTemplate
+from src.utils.llm_factory import LLMFactory
+from src.utils.llm_cache import llm_cache
+from src.utils.llm_hedging import llm_hedger
+from src.utils.resilience import resilience
+from src.utils.prompt_manager import read_prompt, get_prompt_mtime
+from src.utils.logger import logger
+
+class ChainRegistry:
+    """
+    预编译链注册表：每个节点的 prompt | structured_llm 链在进程内只构建一次。
+
+    - 用户消息模板中的 {变量} 在调用时填充，模板本身保持不变
+    - system prompt 文件的 mtime 变化时自动重新构建 (热更新)
+    - 失败时经 resilience 统一重试与熔断
+    - 开启 LLM_HEDGE_ENABLED 时，慢请求会被对冲到备用模型
+    """
+
+    _chains = {}
+    _lock = threading.Lock()
+
+    @staticmethod
+    def get_chain(chain_name: str, node_name: str, prompt_name: str, user_template: str, schema: Type[BaseModel]):
+        """
+        获取 (或构建) 链
+        :param chain_name: 链的唯一名称 (同一节点可注册多条链)
+        :param node_name: 节点名称，决定使用的模型与缓存开关
+        :param prompt_name: src/prompts/ 下的 system prompt 文件名
+        :param user_template: 用户消息模板
+        :param schema: 结构化输出的 Pydantic 模型
+        """
+        version = get_prompt_mtime(prompt_name)
+        cached = ChainRegistry._chains.get(chain_name)
+        if cached and cached[0] == version:
+            return cached[1]
+
+        with ChainRegistry._lock:
+            cached = ChainRegistry._chains.get(chain_name)
+            if cached and cached[0] == version:
+                return cached[1]
+
+            prompt = ChatPromptTemplate.from_messages([
+                ("system", read_prompt(prompt_name)),
+                ("user", user_template)
+            ])
+            llm = LLMFactory.get_model(node_name)
+            # 缓存在外层：命中缓存时不发起请求，也不参与对冲
+            # 重试与熔断按模型区分端点，主模型不可用时不影响备用模型
+            chain = resilience.wrap(f"llm:{llm.model_name}", prompt | llm.with_structured_output(schema))
+            if llm_hedger.is_enabled_for(node_name):
+                fallback_llm = LLMFactory.get_fallback_model(node_name)
+                fallback = resilience.wrap(f"llm:{fallback_llm.model_name}", prompt | fallback_llm.with_structured_output(schema)) if fallback_llm else None
+                chain = llm_hedger.wrap(node_name, chain, fallback)
+            chain = llm_cache.wrap(node_name, prompt, llm, schema, chain=chain)
+            ChainRegistry._chains[chain_name] = (version, chain)
+            logger.info(f"ChainRegistry: {'Reloaded' if cached else 'Built'} chain '{chain_name}' (prompt: {prompt_name})")
+            return chain
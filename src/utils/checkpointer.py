@@ -0,0 +1,418 @@
+import asyncio
+import os
+import random
+import sqlite3
+import threading
+import time
+import zlib
+from typing import Any, AsyncIterator, Dict, Iterator, List, Optional, Sequence, Tuple
+from langchain_core.runnables import RunnableConfig
+from langgraph.checkpoint.base import (
+    WRITES_IDX_MAP,
+    BaseCheckpointSaver,
+    ChannelVersions,
+    Checkpoint,
+    CheckpointMetadata,
+    CheckpointTuple,
+    get_checkpoint_id,
+    get_checkpoint_metadata,
+    writes_sort_key,
+)
+from langgraph.checkpoint.memory import MemorySaver
+from langgraph.checkpoint.serde.jsonplus import JsonPlusSerializer
+from src.utils.logger import logger
+
+# 超过该大小的序列化结果使用 zlib 压缩 (小对象压缩收益不明显)
+COMPRESS_MIN_BYTES = 512
+COMPRESSED_SUFFIX = "+zlib"
+
+# 检查点中会出现的自定义类型，登记后反序列化时不再告警
+STATE_TYPES = [("src.models.state", "PPTOutline"), ("src.models.state", "SlideContent")]
+
+class SQLiteCheckpointer(BaseCheckpointSaver[str]):
+    """
+    基于 SQLite 的 LangGraph 检查点存储，替代常驻内存的 MemorySaver：
+    - 检查点保存在磁盘 (WAL)，进程内不保留历史状态，服务重启后 HITL 会话可继续
+    - 序列化结果 (msgpack) 超过 COMPRESS_MIN_BYTES 时以 zlib 压缩存储
+    - 后台线程定期清理：超过 CHECKPOINT_MAX_AGE_HOURS 未更新的会话、超出 CHECKPOINT_MAX_THREADS 的最旧会话，
+      以及每个会话中最近 CHECKPOINT_KEEP_PER_THREAD 个之前的历史检查点
+
+    表结构与 MemorySaver 的三个字典一致：checkpoints (检查点本身)、blobs (按版本存储的通道值)、writes (待应用写入)。
+    """
+
+    def __init__(self, path: Optional[str] = None):
+        super().__init__(serde=JsonPlusSerializer(allowed_msgpack_modules=STATE_TYPES))
+        self.path = path or os.getenv("CHECKPOINT_PATH", "data/checkpoints.sqlite")
+        self.max_age = float(os.getenv("CHECKPOINT_MAX_AGE_HOURS", "72")) * 3600
+        self.max_threads = int(os.getenv("CHECKPOINT_MAX_THREADS", "1000"))
+        self.keep_per_thread = int(os.getenv("CHECKPOINT_KEEP_PER_THREAD", "2"))
+        self.gc_interval = float(os.getenv("CHECKPOINT_GC_INTERVAL", "600"))
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._lock = threading.Lock()
+        self._gc_thread = None
+        self._stop = threading.Event()
+        self._conn = sqlite3.connect(self.path, check_same_thread=False, timeout=30, isolation_level=None)
+        # GC 后用 incremental_vacuum 归还磁盘空间：auto_vacuum 须在建表前设置，
+        # 已有的数据库 (旧版本创建) 模式不同时执行一次 VACUUM 完成切换
+        if self._conn.execute("PRAGMA auto_vacuum").fetchone()[0] != 2:
+            self._conn.execute("PRAGMA auto_vacuum=INCREMENTAL")
+            if self._conn.execute("SELECT COUNT(*) FROM sqlite_master").fetchone()[0]:
+                logger.info(f"Checkpointer: Converting {self.path} to incremental auto-vacuum")
+                self._conn.execute("VACUUM")
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        # 限制页缓存大小 (KB)，长时间运行时内存占用保持稳定
+        self._conn.execute("PRAGMA cache_size=-2048")
+        self._conn.executescript(
+            "CREATE TABLE IF NOT EXISTS checkpoints ("
+            "thread_id TEXT NOT NULL, checkpoint_ns TEXT NOT NULL, checkpoint_id TEXT NOT NULL, parent_id TEXT, "
+            "type TEXT NOT NULL, checkpoint BLOB NOT NULL, metadata_type TEXT NOT NULL, metadata BLOB NOT NULL, "
+            "PRIMARY KEY (thread_id, checkpoint_ns, checkpoint_id));"
+            "CREATE TABLE IF NOT EXISTS blobs ("
+            "thread_id TEXT NOT NULL, checkpoint_ns TEXT NOT NULL, channel TEXT NOT NULL, version TEXT NOT NULL, "
+            "type TEXT NOT NULL, value BLOB, "
+            "PRIMARY KEY (thread_id, checkpoint_ns, channel, version));"
+            "CREATE TABLE IF NOT EXISTS writes ("
+            "thread_id TEXT NOT NULL, checkpoint_ns TEXT NOT NULL, checkpoint_id TEXT NOT NULL, task_id TEXT NOT NULL, "
+            "idx INTEGER NOT NULL, channel TEXT NOT NULL, type TEXT NOT NULL, value BLOB, task_path TEXT NOT NULL DEFAULT '', "
+            "PRIMARY KEY (thread_id, checkpoint_ns, checkpoint_id, task_id, idx));"
+            "CREATE TABLE IF NOT EXISTS threads (thread_id TEXT PRIMARY KEY, updated_at REAL NOT NULL);"
+            "CREATE INDEX IF NOT EXISTS idx_threads_updated ON threads (updated_at);"
+        )
+
+    # ---- 序列化 ----
+
+    def _dumps(self, value: Any) -> Tuple[str, bytes]:
+        type_, data = self.serde.dumps_typed(value)
+        if len(data) >= COMPRESS_MIN_BYTES:
+            return type_ + COMPRESSED_SUFFIX, zlib.compress(data)
+        return type_, data
+
+    def _loads(self, type_: str, data: bytes) -> Any:
+        if type_.endswith(COMPRESSED_SUFFIX):
+            type_, data = type_[:-len(COMPRESSED_SUFFIX)], zlib.decompress(data)
+        return self.serde.loads_typed((type_, data))
+
+    # ---- 读取 ----
+
+    def _load_blobs(self, thread_id: str, checkpoint_ns: str, versions: ChannelVersions) -> Dict[str, Any]:
+        values = {}
+        for channel, version in versions.items():
+            row = self._conn.execute(
+                "SELECT type, value FROM blobs WHERE thread_id = ? AND checkpoint_ns = ? AND channel = ? AND version = ?",
+                (thread_id, checkpoint_ns, channel, str(version))
+            ).fetchone()
+            if row and row[0] != "empty":
+                values[channel] = self._loads(row[0], row[1])
+        return values
+
+    def _load_writes(self, thread_id: str, checkpoint_ns: str, checkpoint_id: str) -> List[Tuple[str, str, Any]]:
+        rows = self._conn.execute(
+            "SELECT task_id, idx, channel, type, value, task_path FROM writes "
+            "WHERE thread_id = ? AND checkpoint_ns = ? AND checkpoint_id = ?",
+            (thread_id, checkpoint_ns, checkpoint_id)
+        ).fetchall()
+        rows.sort(key=lambda r: writes_sort_key(r[5], r[0], r[1]))
+        return [(task_id, channel, self._loads(type_, value)) for task_id, _, channel, type_, value, _ in rows]
+
+    def _to_tuple(self, thread_id: str, checkpoint_ns: str, row) -> CheckpointTuple:
+        checkpoint_id, parent_id, type_, data, metadata_type, metadata = row
+        checkpoint = self._loads(type_, data)
+        return CheckpointTuple(
+            config={"configurable": {"thread_id": thread_id, "checkpoint_ns": checkpoint_ns, "checkpoint_id": checkpoint_id}},
+            checkpoint={
+                **checkpoint,
+                "channel_values": self._load_blobs(thread_id, checkpoint_ns, checkpoint["channel_versions"])
+            },
+            metadata=self._loads(metadata_type, metadata),
+            pending_writes=self._load_writes(thread_id, checkpoint_ns, checkpoint_id),
+            parent_config=(
+                {"configurable": {"thread_id": thread_id, "checkpoint_ns": checkpoint_ns, "checkpoint_id": parent_id}}
+                if parent_id else None
+            )
+        )
+
+    def get_tuple(self, config: RunnableConfig) -> Optional[CheckpointTuple]:
+        thread_id = config["configurable"]["thread_id"]
+        checkpoint_ns = config["configurable"].get("checkpoint_ns", "")
+        checkpoint_id = get_checkpoint_id(config)
+        query = "SELECT checkpoint_id, parent_id, type, checkpoint, metadata_type, metadata FROM checkpoints " \
+                "WHERE thread_id = ? AND checkpoint_ns = ?"
+        params = [thread_id, checkpoint_ns]
+        if checkpoint_id:
+            query += " AND checkpoint_id = ?"
+            params.append(checkpoint_id)
+        else:
+            query += " ORDER BY checkpoint_id DESC LIMIT 1"
+        with self._lock:
+            row = self._conn.execute(query, params).fetchone()
+            if not row:
+                return None
+            return self._to_tuple(thread_id, checkpoint_ns, row)
+
+    def list(
+        self,
+        config: Optional[RunnableConfig],
+        *,
+        filter: Optional[Dict[str, Any]] = None,
+        before: Optional[RunnableConfig] = None,
+        limit: Optional[int] = None
+    ) -> Iterator[CheckpointTuple]:
+        query = "SELECT thread_id, checkpoint_ns, checkpoint_id, parent_id, type, checkpoint, metadata_type, metadata " \
+                "FROM checkpoints WHERE 1 = 1"
+        params = []
+        if config:
+            query += " AND thread_id = ?"
+            params.append(config["configurable"]["thread_id"])
+            if config["configurable"].get("checkpoint_ns") is not None:
+                query += " AND checkpoint_ns = ?"
+                params.append(config["configurable"].get("checkpoint_ns", ""))
+            if get_checkpoint_id(config):
+                query += " AND checkpoint_id = ?"
+                params.append(get_checkpoint_id(config))
+        if before and get_checkpoint_id(before):
+            query += " AND checkpoint_id < ?"
+            params.append(get_checkpoint_id(before))
+        query += " ORDER BY thread_id, checkpoint_ns, checkpoint_id DESC"
+
+        with self._lock:
+            rows = self._conn.execute(query, params).fetchall()
+        for thread_id, checkpoint_ns, *row in rows:
+            if limit is not None and limit <= 0:
+                break
+            # 元数据按需反序列化后再过滤
+            if filter:
+                metadata = self._loads(row[4], row[5])
+                if not all(metadata.get(k) == v for k, v in filter.items()):
+                    continue
+            if limit is not None:
+                limit -= 1
+            with self._lock:
+                item = self._to_tuple(thread_id, checkpoint_ns, row)
+            yield item
+
+    # ---- 写入 ----
+
+    def put(
+        self,
+        config: RunnableConfig,
+        checkpoint: Checkpoint,
+        metadata: CheckpointMetadata,
+        new_versions: ChannelVersions
+    ) -> RunnableConfig:
+        self._ensure_gc_thread()
+        thread_id = config["configurable"]["thread_id"]
+        checkpoint_ns = config["configurable"].get("checkpoint_ns", "")
+        checkpoint = checkpoint.copy()
+        values = checkpoint.pop("channel_values")
+        blob_rows = []
+        for channel, version in new_versions.items():
+            type_, data = self._dumps(values[channel]) if channel in values else ("empty", None)
+            blob_rows.append((thread_id, checkpoint_ns, channel, str(version), type_, data))
+        type_, data = self._dumps(checkpoint)
+        metadata_type, metadata_data = self._dumps(get_checkpoint_metadata(config, metadata))
+
+        with self._lock:
+            self._conn.execute("BEGIN")
+            try:
+                self._conn.executemany("INSERT OR REPLACE INTO blobs VALUES (?, ?, ?, ?, ?, ?)", blob_rows)
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO checkpoints VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                    (thread_id, checkpoint_ns, checkpoint["id"], config["configurable"].get("checkpoint_id"),
+                     type_, data, metadata_type, metadata_data)
+                )
+                self._conn.execute("INSERT OR REPLACE INTO threads VALUES (?, ?)", (thread_id, time.time()))
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+        return {"configurable": {"thread_id": thread_id, "checkpoint_ns": checkpoint_ns, "checkpoint_id": checkpoint["id"]}}
+
+    def put_writes(self, config: RunnableConfig, writes: Sequence[Tuple[str, Any]], task_id: str, task_path: str = "") -> None:
+        thread_id = config["configurable"]["thread_id"]
+        checkpoint_ns = config["configurable"].get("checkpoint_ns", "")
+        checkpoint_id = config["configurable"]["checkpoint_id"]
+        rows = []
+        for idx, (channel, value) in enumerate(writes):
+            type_, data = self._dumps(value)
+            rows.append((thread_id, checkpoint_ns, checkpoint_id, task_id, WRITES_IDX_MAP.get(channel, idx), channel, type_, data, task_path))
+        # 与 MemorySaver 一致：普通写入不覆盖已有记录，特殊写入 (错误、中断等，idx < 0) 总是覆盖
+        with self._lock:
+            self._conn.execute("BEGIN")
+            try:
+                for row in rows:
+                    verb = "INSERT OR REPLACE" if row[4] < 0 else "INSERT OR IGNORE"
+                    self._conn.execute(f"{verb} INTO writes VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)", row)
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+
+    def delete_thread(self, thread_id: str) -> None:
+        with self._lock:
+            self._delete_threads([thread_id])
+
+    def prune(self, thread_ids: Sequence[str], *, strategy: str = "keep_latest") -> None:
+        with self._lock:
+            if strategy == "delete":
+                self._delete_threads(thread_ids)
+            else:
+                for thread_id in thread_ids:
+                    for (checkpoint_ns,) in self._conn.execute(
+                        "SELECT DISTINCT checkpoint_ns FROM checkpoints WHERE thread_id = ?", (thread_id,)
+                    ).fetchall():
+                        self._prune_thread(thread_id, checkpoint_ns, keep=1)
+
+    def get_next_version(self, current: Optional[str], channel: None) -> str:
+        # 与 MemorySaver 相同的版本格式
+        if current is None:
+            current_v = 0
+        elif isinstance(current, int):
+            current_v = current
+        else:
+            current_v = int(current.split(".")[0])
+        return f"{current_v + 1:032}.{random.random():016}"
+
+    # ---- 异步接口：在线程中执行，不阻塞事件循环 ----
+
+    async def aget_tuple(self, config: RunnableConfig) -> Optional[CheckpointTuple]:
+        return await asyncio.to_thread(self.get_tuple, config)
+
+    async def alist(
+        self,
+        config: Optional[RunnableConfig],
+        *,
+        filter: Optional[Dict[str, Any]] = None,
+        before: Optional[RunnableConfig] = None,
+        limit: Optional[int] = None
+    ) -> AsyncIterator[CheckpointTuple]:
+        items = await asyncio.to_thread(lambda: list(self.list(config, filter=filter, before=before, limit=limit)))
+        for item in items:
+            yield item
+
+    async def aput(
+        self,
+        config: RunnableConfig,
+        checkpoint: Checkpoint,
+        metadata: CheckpointMetadata,
+        new_versions: ChannelVersions
+    ) -> RunnableConfig:
+        return await asyncio.to_thread(self.put, config, checkpoint, metadata, new_versions)
+
+    async def aput_writes(self, config: RunnableConfig, writes: Sequence[Tuple[str, Any]], task_id: str, task_path: str = "") -> None:
+        await asyncio.to_thread(self.put_writes, config, writes, task_id, task_path)
+
+    async def adelete_thread(self, thread_id: str) -> None:
+        await asyncio.to_thread(self.delete_thread, thread_id)
+
+    async def aprune(self, thread_ids: Sequence[str], *, strategy: str = "keep_latest") -> None:
+        await asyncio.to_thread(self.prune, thread_ids, strategy=strategy)
+
+    # ---- 垃圾回收 ----
+
+    def _delete_threads(self, thread_ids: Sequence[str]):
+        self._conn.execute("BEGIN")
+        try:
+            for table in ("checkpoints", "blobs", "writes", "threads"):
+                self._conn.executemany(f"DELETE FROM {table} WHERE thread_id = ?", [(t,) for t in thread_ids])
+            self._conn.execute("COMMIT")
+        except Exception:
+            self._conn.execute("ROLLBACK")
+            raise
+
+    def _prune_thread(self, thread_id: str, checkpoint_ns: str, keep: int) -> int:
+        """
+        只保留会话最近 keep 个检查点，删除更早的检查点、其待应用写入以及不再被引用的通道值版本
+        (本工作流未使用 DeltaChannel，最新检查点本身即包含完整状态)
+        """
+        rows = self._conn.execute(
+            "SELECT checkpoint_id, type, checkpoint FROM checkpoints WHERE thread_id = ? AND checkpoint_ns = ? "
+            "ORDER BY checkpoint_id DESC", (thread_id, checkpoint_ns)
+        ).fetchall()
+        if len(rows) <= keep:
+            return 0
+        kept, removed = rows[:keep], [r[0] for r in rows[keep:]]
+        referenced = set()
+        for _, type_, data in kept:
+            referenced.update((channel, str(version)) for channel, version in self._loads(type_, data)["channel_versions"].items())
+        orphaned = [
+            (thread_id, checkpoint_ns, channel, version)
+            for channel, version in self._conn.execute(
+                "SELECT channel, version FROM blobs WHERE thread_id = ? AND checkpoint_ns = ?", (thread_id, checkpoint_ns)
+            ).fetchall()
+            if (channel, version) not in referenced
+        ]
+        self._conn.execute("BEGIN")
+        try:
+            params = [(thread_id, checkpoint_ns, checkpoint_id) for checkpoint_id in removed]
+            self._conn.executemany("DELETE FROM checkpoints WHERE thread_id = ? AND checkpoint_ns = ? AND checkpoint_id = ?", params)
+            self._conn.executemany("DELETE FROM writes WHERE thread_id = ? AND checkpoint_ns = ? AND checkpoint_id = ?", params)
+            self._conn.executemany("DELETE FROM blobs WHERE thread_id = ? AND checkpoint_ns = ? AND channel = ? AND version = ?", orphaned)
+            self._conn.execute("COMMIT")
+        except Exception:
+            self._conn.execute("ROLLBACK")
+            raise
+        return len(removed)
+
+    def gc(self) -> Dict[str, int]:
+        """执行一次清理，返回删除的会话数与检查点数"""
+        with self._lock:
+            expired = set()
+            if self.max_age > 0:
+                expired.update(r[0] for r in self._conn.execute(
+                    "SELECT thread_id FROM threads WHERE updated_at < ?", (time.time() - self.max_age,)
+                ).fetchall())
+            if self.max_threads > 0:
+                expired.update(r[0] for r in self._conn.execute(
+                    "SELECT thread_id FROM threads ORDER BY updated_at DESC LIMIT -1 OFFSET ?", (self.max_threads,)
+                ).fetchall())
+            if expired:
+                self._delete_threads(list(expired))
+
+            pruned = 0
+            if self.keep_per_thread > 0:
+                for thread_id, checkpoint_ns in self._conn.execute(
+                    "SELECT thread_id, checkpoint_ns FROM checkpoints GROUP BY thread_id, checkpoint_ns HAVING COUNT(*) > ?",
+                    (self.keep_per_thread,)
+                ).fetchall():
+                    pruned += self._prune_thread(thread_id, checkpoint_ns, self.keep_per_thread)
+
+            if expired or pruned:
+                self._conn.execute("PRAGMA incremental_vacuum")
+                self._conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+        if expired or pruned:
+            logger.info(f"Checkpointer: GC removed {len(expired)} sessions and {pruned} old checkpoints")
+        return {"threads": len(expired), "checkpoints": pruned}
+
+    def _ensure_gc_thread(self):
+        """首次写入时启动后台清理线程 (只读取检查点的进程不启动)"""
+        if self._gc_thread is not None or self.gc_interval <= 0:
+            return
+        with self._lock:
+            if self._gc_thread is not None:
+                return
+            self._gc_thread = threading.Thread(target=self._gc_loop, name="checkpoint-gc", daemon=True)
+        self._gc_thread.start()
+
+    def _gc_loop(self):
+        while True:
+            try:
+                self.gc()
+            except Exception as e:
+                logger.error(f"Checkpointer: GC failed: {e}")
+            if self._stop.wait(self.gc_interval):
+                return
+
+    def close(self):
+        self._stop.set()
+        with self._lock:
+            self._conn.close()
+
+def create_checkpointer() -> BaseCheckpointSaver:
+    """按 CHECKPOINT_BACKEND 创建检查点存储：sqlite (默认) 或 memory"""
+    backend = os.getenv("CHECKPOINT_BACKEND", "sqlite").lower()
+    if backend == "memory":
+        return MemorySaver(serde=JsonPlusSerializer(allowed_msgpack_modules=STATE_TYPES))
+    return SQLiteCheckpointer()
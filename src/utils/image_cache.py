@@ -0,0 +1,183 @@
+import hashlib
+import os
+import tempfile
+import threading
+from typing import Callable, Dict, Optional
+from urllib.parse import urlparse
+import requests
+from src.utils.resilience import resilience
+from src.utils.logger import logger
+
+class ImageCache:
+    """
+    持久化图片缓存：以 (model, size, negative_prompt, 归一化 prompt) 的哈希为键，
+    缓存下载后的图片字节 (而不是会过期的结果 URL)。
+
+    - 文件按键值前两位分目录存放：{cache_dir}/ab/abcdef....png
+    - 命中时刷新文件 mtime，超出磁盘预算时按 mtime 淘汰最久未使用的条目 (LRU)
+    - hits / misses 计数器可通过 stats() 查看
+    """
+
+    CONTENT_TYPE_EXT = {
+        "image/png": ".png",
+        "image/jpeg": ".jpg",
+        "image/webp": ".webp",
+        "image/gif": ".gif"
+    }
+
+    def __init__(self, cache_dir: Optional[str] = None, max_bytes: Optional[int] = None, enabled: Optional[bool] = None):
+        self.cache_dir = cache_dir or os.getenv("IMAGE_CACHE_DIR", "data/image_cache")
+        self.max_bytes = max_bytes if max_bytes is not None else int(float(os.getenv("IMAGE_CACHE_MAX_MB", "1024")) * 1024 * 1024)
+        self.enabled = enabled if enabled is not None else os.getenv("IMAGE_CACHE_ENABLED", "true").lower() == "true"
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._total_bytes = None
+
+    @staticmethod
+    def make_key(model: str, size: str, negative_prompt: str, prompt: str) -> str:
+        """根据生成参数计算缓存键，prompt 归一化为小写并合并空白"""
+        normalized_prompt = " ".join((prompt or "").split()).lower()
+        raw = "\x1f".join([model or "", size or "", negative_prompt or "", normalized_prompt])
+        return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+    def _entry_dir(self, key: str) -> str:
+        return os.path.join(self.cache_dir, key[:2])
+
+    def get(self, key: str) -> Optional[str]:
+        """查询缓存，命中时返回本地文件路径并刷新其最近使用时间"""
+        if not self.enabled:
+            return None
+
+        entry_dir = self._entry_dir(key)
+        if os.path.isdir(entry_dir):
+            for name in os.listdir(entry_dir):
+                if name.startswith(key):
+                    path = os.path.join(entry_dir, name)
+                    try:
+                        os.utime(path)
+                    except OSError:
+                        continue
+                    with self._lock:
+                        self.hits += 1
+                    logger.info(f"ImageCache: Hit {key[:12]} -> {path}")
+                    return path
+
+        with self._lock:
+            self.misses += 1
+        return None
+
+    def put(self, key: str, data: bytes, ext: str = ".png") -> str:
+        """写入图片字节并返回本地文件路径 (原子写入)"""
+        entry_dir = self._entry_dir(key)
+        os.makedirs(entry_dir, exist_ok=True)
+        path = os.path.join(entry_dir, f"{key}{ext}")
+
+        fd, tmp_path = tempfile.mkstemp(dir=entry_dir, suffix=".tmp")
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+
+        # 覆盖已有条目时扣除旧文件的大小，并删除同一键下其他扩展名的文件
+        # (替换与计数在同一把锁内，避免并发写入同一键时重复扣除)
+        with self._lock:
+            replaced = 0
+            for name in os.listdir(entry_dir):
+                if not name.startswith(key):
+                    continue
+                old_path = os.path.join(entry_dir, name)
+                try:
+                    replaced += os.path.getsize(old_path)
+                    if old_path != path:
+                        os.remove(old_path)
+                except OSError:
+                    continue
+            os.replace(tmp_path, path)
+            if self._total_bytes is not None:
+                self._total_bytes += len(data) - replaced
+        self._evict()
+        return path
+
+    def put_url(self, key: str, url: str) -> Optional[str]:
+        """下载远程图片并写入缓存，失败时返回 None"""
+        if not self.enabled:
+            return None
+        def call():
+            response = requests.get(url, timeout=30)
+            response.raise_for_status()
+            return response
+
+        try:
+            response = resilience.call(f"download:{urlparse(url).netloc}", call)
+            content_type = response.headers.get("Content-Type", "").split(";")[0].strip()
+            ext = self.CONTENT_TYPE_EXT.get(content_type) or os.path.splitext(url.split("?")[0])[1] or ".png"
+            path = self.put(key, response.content, ext)
+            logger.info(f"ImageCache: Stored {key[:12]} ({len(response.content)} bytes)")
+            return path
+        except Exception as e:
+            logger.warning(f"ImageCache: Failed to cache image from {url}: {str(e)}")
+            return None
+
+    def get_or_create(self, key: str, producer: Callable[[], str]) -> str:
+        """
+        命中缓存时直接返回本地路径；否则调用 producer 生成图片 URL，
+        下载入缓存后返回本地路径。下载失败时退回原始 URL。
+        """
+        path = self.get(key)
+        if path:
+            return path
+
+        url = producer()
+        if not url or not url.startswith(("http://", "https://")):
+            return url
+        return self.put_url(key, url) or url
+
+    def _scan(self):
+        """扫描缓存目录，返回 [(mtime, size, path)]"""
+        entries = []
+        if not os.path.isdir(self.cache_dir):
+            return entries
+        for root, _, files in os.walk(self.cache_dir):
+            for name in files:
+                if name.endswith(".tmp"):
+                    continue
+                path = os.path.join(root, name)
+                try:
+                    st = os.stat(path)
+                except OSError:
+                    continue
+                entries.append((st.st_mtime, st.st_size, path))
+        return entries
+
+    def _evict(self):
+        """超出磁盘预算时按最近使用时间淘汰条目"""
+        with self._lock:
+            if self._total_bytes is None:
+                self._total_bytes = sum(size for _, size, _ in self._scan())
+            if self._total_bytes <= self.max_bytes:
+                return
+
+            entries = sorted(self._scan())
+            total = sum(size for _, size, _ in entries)
+            for _, size, path in entries:
+                if total <= self.max_bytes:
+                    break
+                try:
+                    os.remove(path)
+                    total -= size
+                    logger.info(f"ImageCache: Evicted {os.path.basename(path)}")
+                except OSError:
+                    pass
+            self._total_bytes = total
+
+    def stats(self) -> Dict[str, float]:
+        """返回缓存命中统计"""
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / total if total else 0.0
+            }
+
+# 全局默认缓存实例
+image_cache = ImageCache()
@@ -1,38 +1,49 @@
 import os
-import requests
+import dashscope
+from src.utils.image_cache import ImageCache, image_cache
+from src.utils.resilience import OutboundError, resilience
 from src.utils.logger import logger
 
 class WanxGenerator:
     """
     阿里云通义万相图像生成工具
     """
-    
+
+    SIZE = '1024*1024'
+
     @staticmethod
     def generate_image(prompt: str) -> str:
         """
-        调用通义万相生成图片并返回 URL
+        调用通义万相生成图片，返回缓存中的本地路径 (缓存不可用时返回 URL)
         """
-        api_key = os.getenv("LLM_API_KEY")
         model = os.getenv("IMAGE_GEN_MODEL", "wanx-v1")
-        
+        key = ImageCache.make_key(model, WanxGenerator.SIZE, "", prompt)
+        return image_cache.get_or_create(key, lambda: WanxGenerator._call_wanx(prompt, model))
+
+    @staticmethod
+    def _call_wanx(prompt: str, model: str) -> str:
+        """调用通义万相生成图片并返回 URL"""
+        api_key = os.getenv("LLM_API_KEY")
+
         logger.info(f"Wanx: Generating image for prompt: {prompt[:50]}...")
         
-        try:
+        def call():
             rsp = dashscope.ImageSynthesis.call(
                 api_key=api_key,
                 model=model,
                 prompt=prompt,
                 n=1,
-                size='1024*1024'
+                size=WanxGenerator.SIZE
             )
-            
-            if rsp.status_code == 200:
-                image_url = rsp.output.results[0].url
-                logger.info(f"Wanx: Image generated successfully: {image_url}")
-                return image_url
-            else:
-                logger.error(f"Wanx: Failed to generate image. Code: {rsp.code}, Message: {rsp.message}")
-                return ""
+            if rsp.status_code != 200:
+                raise OutboundError(rsp.status_code, f"Code: {rsp.code}, Message: {rsp.message}")
+            return rsp
+
+        try:
+            rsp = resilience.call("dashscope_wanx", call)
+            image_url = rsp.output.results[0].url
+            logger.info(f"Wanx: Image generated successfully: {image_url}")
+            return image_url
         except Exception as e:
-            logger.exception("Wanx: Exception during image generation")
+            logger.error(f"Wanx: Failed to generate image: {str(e)}")
             return ""
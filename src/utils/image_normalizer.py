@@ -0,0 +1,176 @@
+import hashlib
+import multiprocessing
+import os
+import tempfile
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Dict, Optional, Tuple
+from PIL import Image
+from src.utils.render_cache import normalized_image_cache
+from src.utils.logger import logger
+
+EMU_PER_INCH = 914400
+
+def normalize_image(src_path: str, dst_dir: str, box: Tuple[int, int], dpi: int, quality: int) -> str:
+    """
+    将图片缩放到覆盖目标区域 (EMU) 所需的像素尺寸，并重新编码、去除元数据。
+    不透明图片输出 JPEG，带透明通道的图片输出 PNG。
+    该函数在子进程中执行，需保持为模块级函数。
+    """
+    box_width_px = max(1, int(box[0] / EMU_PER_INCH * dpi))
+    box_height_px = max(1, int(box[1] / EMU_PER_INCH * dpi))
+
+    with Image.open(src_path) as img:
+        img.load()
+        # 按覆盖目标区域计算缩放比例 (insert_picture 会裁剪填充占位符)，不放大
+        scale = max(box_width_px / img.width, box_height_px / img.height)
+        if scale < 1:
+            new_size = (max(1, round(img.width * scale)), max(1, round(img.height * scale)))
+            img = img.resize(new_size, Image.LANCZOS)
+
+        has_alpha = img.mode in ("RGBA", "LA") or (img.mode == "P" and "transparency" in img.info)
+        if has_alpha:
+            img = img.convert("RGBA")
+            ext, save_kwargs = ".png", {"format": "PNG", "optimize": True}
+        else:
+            img = img.convert("RGB")
+            ext, save_kwargs = ".jpg", {"format": "JPEG", "quality": quality, "optimize": True, "progressive": True}
+
+        # 丢弃 EXIF / ICC 等元数据
+        img.info = {}
+        fd, dst_path = tempfile.mkstemp(dir=dst_dir, suffix=ext)
+        with os.fdopen(fd, "wb") as f:
+            img.save(f, **save_kwargs)
+    return dst_path
+
+def in_child_process() -> bool:
+    """
+    是否运行在其他进程创建的子进程中 (批量渲染、任务队列、分片渲染的工作进程)：
+    这些进程本身已按 CPU 数并行，再各自创建进程池会成倍占用 CPU
+    """
+    return multiprocessing.parent_process() is not None
+
+# 归一化进程池：进程内共享，首次使用时创建，避免每次渲染都重新启动一组进程
+_pool = None
+_pool_lock = threading.Lock()
+
+def _get_pool(max_workers: int) -> Optional[ProcessPoolExecutor]:
+    """
+    返回共享进程池；在子进程中返回 None，由调用方在进程内执行。
+    使用 spawn 启动工作进程：进程池可能在渲染线程中首次创建，fork 多线程进程 (连接池、日志锁) 可能死锁
+    """
+    global _pool
+    if in_child_process() or max_workers <= 1:
+        return None
+    with _pool_lock:
+        if _pool is None:
+            _pool = ProcessPoolExecutor(max_workers=max_workers, mp_context=multiprocessing.get_context("spawn"))
+        return _pool
+
+def _reset_pool():
+    """进程池损坏 (工作进程异常退出) 时丢弃，下次使用时重新创建"""
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.shutdown(wait=False, cancel_futures=True)
+            _pool = None
+
+class ImageNormalizer:
+    """
+    图片归一化：在进程池中将待嵌入的图片缩放到目标占位符大小并重新压缩，
+    避免把原始全分辨率 PNG 写入 .pptx。
+    """
+
+    def __init__(self, dpi: Optional[int] = None, quality: Optional[int] = None, max_workers: Optional[int] = None):
+        self.dpi = dpi or int(os.getenv("IMAGE_EMBED_DPI", "150"))
+        self.quality = quality or int(os.getenv("IMAGE_EMBED_QUALITY", "85"))
+        self.max_workers = max_workers or int(os.getenv("IMAGE_NORMALIZE_WORKERS", "0")) or os.cpu_count() or 1
+        self.enabled = os.getenv("IMAGE_NORMALIZE_ENABLED", "true").lower() == "true"
+
+    def normalize_all(self, jobs: Dict[str, Tuple[int, int]], dst_dir: str) -> Dict[str, str]:
+        """
+        批量归一化图片
+        :param jobs: 本地图片路径 -> 目标区域 (宽, 高) EMU
+        :return: 原路径 -> 归一化后的路径 (失败的图片不在结果中)
+        """
+        if not self.enabled or not jobs:
+            return {}
+
+        # 上次渲染已归一化过的图片直接复用，只有新图片或目标区域变化的图片进入进程池
+        results = {}
+        keys = {src: self._cache_key(src, box) for src, box in jobs.items()}
+        for src, key in keys.items():
+            cached = normalized_image_cache.get(key)
+            if cached:
+                results[src] = cached
+        pending = {src: box for src, box in jobs.items() if src not in results}
+        if results:
+            logger.info(f"ImageNormalizer: Reused {len(results)} normalized images, {len(pending)} to process")
+
+        for src, dst in self._normalize_pending(pending, dst_dir).items():
+            results[src] = self._store(keys[src], dst)
+
+        before = sum(os.path.getsize(src) for src in results)
+        after = sum(os.path.getsize(dst) for dst in results.values())
+        logger.info(f"ImageNormalizer: Normalized {len(results)} images ({before // 1024} KB -> {after // 1024} KB, {self.dpi} DPI)")
+        return results
+
+    def _normalize_pending(self, pending: Dict[str, Tuple[int, int]], dst_dir: str) -> Dict[str, str]:
+        """在共享进程池中归一化；进程池不可用或损坏时，剩余图片在当前进程内归一化"""
+        normalized = {}
+        if not pending:
+            return normalized
+
+        pool = _get_pool(self.max_workers)
+        if pool is not None:
+            try:
+                futures = {
+                    src: pool.submit(normalize_image, src, dst_dir, box, self.dpi, self.quality)
+                    for src, box in pending.items()
+                }
+                for src, future in futures.items():
+                    try:
+                        normalized[src] = future.result()
+                    except BrokenProcessPool:
+                        raise
+                    except Exception as e:
+                        logger.warning(f"ImageNormalizer: Failed to normalize {src}: {str(e)}")
+                return normalized
+            except Exception as e:
+                logger.error(f"ImageNormalizer: Process pool failed, normalizing remaining images in-process: {str(e)}")
+                _reset_pool()
+
+        for src, box in pending.items():
+            if src in normalized:
+                continue
+            try:
+                normalized[src] = normalize_image(src, dst_dir, box, self.dpi, self.quality)
+            except Exception as e:
+                logger.warning(f"ImageNormalizer: Failed to normalize {src}: {str(e)}")
+        return normalized
+
+    def _cache_key(self, src_path: str, box: Tuple[int, int]) -> str:
+        """
+        归一化结果的缓存键：源图片内容哈希、目标区域与编码参数。
+        远程图片每次渲染都下载到新的临时文件，按内容而不是路径计算，跨渲染仍能命中
+        """
+        try:
+            digest = hashlib.sha256()
+            with open(src_path, "rb") as f:
+                for block in iter(lambda: f.read(1024 * 1024), b""):
+                    digest.update(block)
+            source = digest.hexdigest()
+        except OSError:
+            source = os.path.abspath(src_path)
+        raw = f"{source}|{box[0]}x{box[1]}|{self.dpi}|{self.quality}"
+        return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+    @staticmethod
+    def _store(key: str, dst_path: str) -> str:
+        """将归一化结果写入缓存，缓存不可用时返回临时文件"""
+        if not normalized_image_cache.enabled:
+            return dst_path
+        with open(dst_path, "rb") as f:
+            data = f.read()
+        return normalized_image_cache.put(key, data, os.path.splitext(dst_path)[1])
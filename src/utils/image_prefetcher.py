@@ -0,0 +1,98 @@
+import os
+import shutil
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Iterable, Optional
+from urllib.parse import urlparse
+import requests
+from requests.adapters import HTTPAdapter
+from src.utils.resilience import resilience
+from src.utils.logger import logger
+
+# 已知的外部占位图服务 (旧会话中可能残留)，渲染时直接跳过
+PLACEHOLDER_HOSTS = ("placehold.co", "placeholder.com")
+
+def is_placeholder_url(image_source: str) -> bool:
+    """是否为占位图服务的 URL"""
+    return image_source.startswith(("http://", "https://")) and any(host in image_source for host in PLACEHOLDER_HOSTS)
+
+class ImagePrefetcher:
+    """
+    图片预取器：在构建幻灯片之前并行下载所有远程图片到临时目录。
+
+    - 对图片来源去重，跳过占位图与本地文件
+    - 使用共享连接池的 Session 并行下载，流式写入临时文件
+    - 作为上下文管理器使用，退出时清理临时目录
+    """
+
+    CHUNK_SIZE = 64 * 1024
+
+    def __init__(self, max_workers: Optional[int] = None, timeout: float = 10):
+        self.max_workers = max(1, max_workers or int(os.getenv("IMAGE_PREFETCH_WORKERS", "8")))
+        self.timeout = timeout
+        self.temp_dir = None
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=self.max_workers, pool_maxsize=self.max_workers)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.cleanup()
+
+    def prefetch(self, sources: Iterable[Optional[str]]) -> Dict[str, Optional[str]]:
+        """
+        并行下载远程图片
+        :return: URL -> 本地临时文件路径，下载失败时为 None
+        """
+        urls = []
+        for source in sources:
+            if not source or not source.startswith(("http://", "https://")):
+                continue
+            if is_placeholder_url(source) or source in urls:
+                continue
+            urls.append(source)
+
+        if not urls:
+            return {}
+
+        self.ensure_temp_dir()
+
+        logger.info(f"ImagePrefetcher: Downloading {len(urls)} images with {self.max_workers} workers")
+        with ThreadPoolExecutor(max_workers=min(self.max_workers, len(urls))) as executor:
+            paths = list(executor.map(self._download, urls))
+        return dict(zip(urls, paths))
+
+    def ensure_temp_dir(self) -> str:
+        """创建 (如尚未创建) 并返回本次渲染使用的临时目录"""
+        if self.temp_dir is None:
+            self.temp_dir = tempfile.mkdtemp(prefix="ppt_images_")
+        return self.temp_dir
+
+    def _download(self, url: str) -> Optional[str]:
+        """流式下载单张图片到临时文件"""
+        def call():
+            with self.session.get(url, timeout=self.timeout, stream=True) as response:
+                response.raise_for_status()
+                fd, path = tempfile.mkstemp(dir=self.temp_dir)
+                with os.fdopen(fd, "wb") as f:
+                    for chunk in response.iter_content(chunk_size=self.CHUNK_SIZE):
+                        f.write(chunk)
+            return path
+
+        try:
+            path = resilience.call(f"download:{urlparse(url).netloc}", call)
+            logger.debug(f"ImagePrefetcher: Downloaded {url} -> {path}")
+            return path
+        except Exception as e:
+            logger.error(f"ImagePrefetcher: Failed to download {url}: {str(e)}")
+            return None
+
+    def cleanup(self):
+        """删除临时目录"""
+        if self.temp_dir:
+            shutil.rmtree(self.temp_dir, ignore_errors=True)
+            self.temp_dir = None
+        self.session.close()
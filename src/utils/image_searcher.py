@@ -2,6 +2,8 @@ import os
 import requests
 from src.utils.logger import logger
 from src.utils.unsplash_searcher import UnsplashSearcher
+from src.utils.placeholder_image import PlaceholderImage
+from src.utils.resilience import resilience
 from typing import List, Optional
 
 class ImageSearcher:
@@ -9,7 +11,7 @@ class ImageSearcher:
     图像搜索工具类，支持多种图片搜索服务：
     1. Unsplash API (免费，无速率限制)
     2. Bing Image Search (需要 API Key)
-    3. 占位图 (fallback)
+    3. 本地渲染的占位图 (fallback)
     """
 
     @staticmethod
@@ -35,9 +37,9 @@ class ImageSearcher:
                     logger.info(f"ImageSearcher: Using Bing results for '{query}'")
                     return bing_results
 
-        # 如果禁用搜索引擎或所有搜索服务都失败，使用占位图
+        # 如果禁用搜索引擎或所有搜索服务都失败，使用本地渲染的占位图
         logger.info(f"Image search completed. Using placeholder for '{query}'")
-        return [f"https://placehold.co/600x400?text={query.replace(' ', '+')}"]
+        return [PlaceholderImage.render(query)]
 
     @staticmethod
     def _search_bing(query: str, api_key: str, count: int) -> List[str]:
@@ -46,10 +48,13 @@ class ImageSearcher:
         headers = {"Ocp-Apim-Subscription-Key": api_key}
         params = {"q": query, "count": count, "imageType": "Photo", "safeSearch": "Strict"}
         
-        try:
+        def call():
             response = requests.get(endpoint, headers=headers, params=params, timeout=10)
             response.raise_for_status()
-            search_results = response.json()
+            return response
+
+        try:
+            search_results = resilience.call("bing", call).json()
             return [img["contentUrl"] for img in search_results.get("value", [])[:count]]
         except Exception as e:
             logger.error(f"Bing search failed for '{query}': {str(e)}")
@@ -0,0 +1,154 @@
+import os
+import re
+import time
+from typing import List
+from pydantic import BaseModel, Field
+from src.utils.chain_registry import ChainRegistry
+from src.utils.llm_cache import LLMCache
+from src.utils.llm_factory import LLMFactory
+from src.utils.prompt_manager import read_prompt
+from src.utils.logger import logger
+
+# 用户消息模板 (块摘要不包含块序号，同一内容在文档中的位置变化时仍可复用缓存)
+MAP_USER_TEMPLATE = "以下是一份长文档中的一个片段，请浓缩其内容：\n\n{chunk}"
+REDUCE_USER_TEMPLATE = "以下是一份长文档各部分的浓缩摘要，请将它们合并为一份连贯、无重复的完整摘要：\n\n{summaries}"
+
+class CondensedText(BaseModel):
+    """文本浓缩的结构化输出"""
+    summary: str = Field(description="浓缩后的文本")
+
+# 块摘要缓存：按模型、system prompt 与块内容的哈希复用，不受 LLM_CACHE_ENABLED 影响
+chunk_cache = LLMCache(
+    enabled=os.getenv("CONDENSE_CACHE_ENABLED", "true").lower() == "true",
+    path=os.getenv("CONDENSE_CACHE_PATH", "data/condense_cache.sqlite")
+)
+
+def estimate_tokens(text: str) -> int:
+    """粗略估算 token 数：中日韩字符按 1 个 token，其余按 4 个字符 1 个 token"""
+    cjk = len(re.findall(r"[\u3000-\u9fff\uac00-\ud7af\uff00-\uffef]", text))
+    return cjk + (len(text) - cjk) // 4
+
+def truncate_tokens(text: str, max_tokens: int) -> str:
+    """截断文本，使估算 token 数不超过上限"""
+    while estimate_tokens(text) > max_tokens:
+        text = text[:len(text) * max_tokens // estimate_tokens(text)]
+    return text
+
+class InputCondenser:
+    """
+    长输入浓缩：docx 或语音转录文本超过阈值时，按 token 上限切块，
+    用较便宜的模型并发摘要 (map)，再合并为一份摘要 (reduce)。
+    每次 reduce 的输入不超过阈值，最终结果截断到阈值以内，传给 planner 的输入大小有硬上限。
+    块摘要按块内容缓存 (chunk_cache)，重复上传或在文档中插入段落时未变化的块不再重复调用。
+    """
+
+    @staticmethod
+    def split(text: str, chunk_tokens: int) -> List[str]:
+        """按段落切块，单个段落超过上限时再按字符切分"""
+        chunks, current, current_tokens = [], [], 0
+        for paragraph in text.split("\n"):
+            if not paragraph.strip():
+                continue
+            tokens = estimate_tokens(paragraph)
+            if tokens > chunk_tokens:
+                # 超长段落按比例切分为多个片段
+                step = max(1, len(paragraph) * chunk_tokens // tokens)
+                pieces = [paragraph[i:i + step] for i in range(0, len(paragraph), step)]
+            else:
+                pieces = [paragraph]
+
+            for piece in pieces:
+                piece_tokens = estimate_tokens(piece)
+                if current and current_tokens + piece_tokens > chunk_tokens:
+                    chunks.append("\n".join(current))
+                    current, current_tokens = [], 0
+                current.append(piece)
+                current_tokens += piece_tokens
+
+        if current:
+            chunks.append("\n".join(current))
+        return chunks
+
+    @staticmethod
+    def _summarize_chunks(map_chain, chunks: List[str], max_concurrency: int) -> List[str]:
+        """map：并发摘要各块，命中块缓存的不再调用模型；单块失败时保留原文截断，避免信息整体丢失"""
+        llm = LLMFactory.get_model("condenser")
+        system_prompt = read_prompt("condenser")
+        keys = [LLMCache.make_key(llm.model_name, llm.temperature, system_prompt, chunk) for chunk in chunks]
+        summaries = [None] * len(chunks)
+        pending = []
+        for i, key in enumerate(keys):
+            cached = chunk_cache.get(key) if chunk_cache.enabled else None
+            if cached:
+                summaries[i] = CondensedText.model_validate_json(cached[0]).summary
+            else:
+                pending.append(i)
+        if len(pending) < len(chunks):
+            logger.info(f"InputCondenser: Reused {len(chunks) - len(pending)}/{len(chunks)} cached chunk summaries")
+
+        start = time.monotonic()
+        results = map_chain.batch(
+            [{"chunk": chunks[i]} for i in pending], config={"max_concurrency": max_concurrency}, return_exceptions=True
+        )
+        latency = time.monotonic() - start
+        for i, result in zip(pending, results):
+            if isinstance(result, CondensedText):
+                summaries[i] = result.summary
+                if chunk_cache.enabled:
+                    chunk_cache.put(keys[i], result.model_dump_json(), latency)
+            else:
+                logger.error(f"InputCondenser: Failed to summarize chunk: {result}")
+                summaries[i] = chunks[i][:len(chunks[i]) // 4]
+        return summaries
+
+    @staticmethod
+    def _reduce(reduce_chain, text: str, threshold: int, max_concurrency: int) -> str:
+        """reduce：摘要按阈值分组合并 (每次调用的输入都放得进上下文)，分组多于一个时再合并一轮，最多 3 轮"""
+        for _ in range(3):
+            groups = InputCondenser.split(text, threshold)
+            results = reduce_chain.batch(
+                [{"summaries": group} for group in groups], config={"max_concurrency": max_concurrency}, return_exceptions=True
+            )
+            merged = []
+            for group, result in zip(groups, results):
+                if isinstance(result, CondensedText):
+                    merged.append(result.summary)
+                else:
+                    logger.error(f"InputCondenser: Reduce step failed, using joined summaries: {result}")
+                    merged.append(group)
+            text = "\n\n".join(merged)
+            if len(groups) == 1:
+                break
+        return text
+
+    @staticmethod
+    def condense(text: str) -> str:
+        """输入不超过 CONDENSE_THRESHOLD_TOKENS 时原样返回，否则返回 map-reduce 浓缩后的文本 (不超过阈值)"""
+        threshold = int(os.getenv("CONDENSE_THRESHOLD_TOKENS", "6000"))
+        if not text or estimate_tokens(text) <= threshold:
+            return text
+
+        chunk_tokens = int(os.getenv("CONDENSE_CHUNK_TOKENS", "3000"))
+        max_concurrency = int(os.getenv("CONDENSE_MAX_CONCURRENCY", "8"))
+        map_chain = ChainRegistry.get_chain("condenser_map", "condenser", "condenser", MAP_USER_TEMPLATE, CondensedText)
+        reduce_chain = ChainRegistry.get_chain("condenser_reduce", "condenser", "condenser", REDUCE_USER_TEMPLATE, CondensedText)
+
+        original_tokens = estimate_tokens(text)
+        # 摘要合并后仍超过阈值时继续下一轮 map，最多 3 轮
+        for round_index in range(1, 4):
+            chunks = InputCondenser.split(text, chunk_tokens)
+            logger.info(f"InputCondenser: Round {round_index}, summarizing {len(chunks)} chunks (~{estimate_tokens(text)} tokens)")
+            summaries = InputCondenser._summarize_chunks(map_chain, chunks, max_concurrency)
+            text = "\n\n".join(summaries)
+            if estimate_tokens(text) <= threshold:
+                break
+
+        if len(summaries) > 1:
+            text = InputCondenser._reduce(reduce_chain, text, threshold, max_concurrency)
+
+        if estimate_tokens(text) > threshold:
+            logger.warning(f"InputCondenser: Condensed text still ~{estimate_tokens(text)} tokens, truncating to {threshold}")
+            text = truncate_tokens(text, threshold)
+
+        logger.info(f"InputCondenser: Condensed input from ~{original_tokens} to ~{estimate_tokens(text)} tokens")
+        return text
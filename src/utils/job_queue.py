@@ -0,0 +1,281 @@
+import atexit
+import importlib
+import json
+import multiprocessing
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from typing import Dict, Optional
+from src.utils.logger import logger
+
+class JobQueue:
+    """
+    基于 SQLite 的持久化任务队列：Web UI 进程入队，工作进程领取执行。
+    任务状态: queued -> running -> done / failed。
+    工作进程定期更新心跳，心跳超时 (进程崩溃) 的任务会被重新入队，最多尝试 JOB_MAX_ATTEMPTS 次。
+    已结束 (done / failed) 超过 JOB_RETENTION_HOURS 的任务在领取时定期删除。
+    """
+
+    # 两次清理已结束任务之间的最短间隔 (秒)
+    PRUNE_INTERVAL = 600
+
+    QUEUED = "queued"
+    RUNNING = "running"
+    DONE = "done"
+    FAILED = "failed"
+
+    def __init__(self, path: Optional[str] = None):
+        self.path = path or os.getenv("JOB_QUEUE_PATH", "data/jobs.sqlite")
+        self.stale_seconds = float(os.getenv("JOB_STALE_SECONDS", "600"))
+        self.max_attempts = int(os.getenv("JOB_MAX_ATTEMPTS", "3"))
+        self.retention = float(os.getenv("JOB_RETENTION_HOURS", "24")) * 3600
+        self._last_prune = 0.0
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(self.path, check_same_thread=False, timeout=30, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS jobs ("
+            "id TEXT PRIMARY KEY, kind TEXT NOT NULL, payload TEXT NOT NULL, status TEXT NOT NULL, "
+            "result TEXT, error TEXT, attempts INTEGER NOT NULL DEFAULT 0, worker TEXT, "
+            "created_at REAL NOT NULL, updated_at REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_jobs_status ON jobs (status, created_at)")
+
+    def enqueue(self, kind: str, payload: Dict) -> str:
+        """入队并返回任务 ID"""
+        job_id = str(uuid.uuid4())
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT INTO jobs (id, kind, payload, status, created_at, updated_at) VALUES (?, ?, ?, ?, ?, ?)",
+                (job_id, kind, json.dumps(payload, ensure_ascii=False), self.QUEUED, now, now)
+            )
+        logger.info(f"JobQueue: Enqueued {kind} job {job_id}")
+        return job_id
+
+    def claim(self, worker: str) -> Optional[Dict]:
+        """领取最早的待执行任务 (原子操作)，没有任务时返回 None"""
+        now = time.time()
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                # 心跳超时的任务重新入队或标记失败
+                self._conn.execute(
+                    "UPDATE jobs SET status = CASE WHEN attempts >= ? THEN ? ELSE ? END, "
+                    "error = 'worker lost', updated_at = ? WHERE status = ? AND updated_at < ?",
+                    (self.max_attempts, self.FAILED, self.QUEUED, now, self.RUNNING, now - self.stale_seconds)
+                )
+                row = self._conn.execute(
+                    "SELECT id, kind, payload FROM jobs WHERE status = ? ORDER BY created_at LIMIT 1", (self.QUEUED,)
+                ).fetchone()
+                if row:
+                    self._conn.execute(
+                        "UPDATE jobs SET status = ?, worker = ?, attempts = attempts + 1, updated_at = ? WHERE id = ?",
+                        (self.RUNNING, worker, now, row[0])
+                    )
+                elif self.retention > 0 and now - self._last_prune > self.PRUNE_INTERVAL:
+                    # 空闲时清理已结束的旧任务
+                    self._last_prune = now
+                    self._conn.execute(
+                        "DELETE FROM jobs WHERE status IN (?, ?) AND updated_at < ?",
+                        (self.DONE, self.FAILED, now - self.retention)
+                    )
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+        if not row:
+            return None
+        return {"id": row[0], "kind": row[1], "payload": json.loads(row[2])}
+
+    def heartbeat(self, job_id: str):
+        with self._lock:
+            self._conn.execute("UPDATE jobs SET updated_at = ? WHERE id = ? AND status = ?", (time.time(), job_id, self.RUNNING))
+
+    def complete(self, job_id: str, result: Dict):
+        with self._lock:
+            self._conn.execute(
+                "UPDATE jobs SET status = ?, result = ?, updated_at = ? WHERE id = ?",
+                (self.DONE, json.dumps(result, ensure_ascii=False), time.time(), job_id)
+            )
+
+    def fail(self, job_id: str, error: str):
+        with self._lock:
+            self._conn.execute(
+                "UPDATE jobs SET status = ?, error = ?, updated_at = ? WHERE id = ?",
+                (self.FAILED, error, time.time(), job_id)
+            )
+
+    def get(self, job_id: str) -> Optional[Dict]:
+        """查询任务状态，返回 {id, kind, status, result, error}"""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT id, kind, status, result, error FROM jobs WHERE id = ?", (job_id,)
+            ).fetchone()
+        if not row:
+            return None
+        return {
+            "id": row[0],
+            "kind": row[1],
+            "status": row[2],
+            "result": json.loads(row[3]) if row[3] else None,
+            "error": row[4]
+        }
+
+    def pending_count(self) -> int:
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM jobs WHERE status = ?", (self.QUEUED,)).fetchone()[0]
+
+def _prewarm():
+    """工作进程预热：提前导入 python-pptx / Pillow / 工作流节点并分析默认模板"""
+    for module in ("PIL.Image", "src.nodes.visual_agent", "src.utils.ppt_generator"):
+        importlib.import_module(module)
+    from src.utils.layout_manager import LayoutManager
+    LayoutManager.get_template().new_presentation()
+
+def _run_render(payload: Dict) -> Dict:
+    """渲染任务：生成配图并渲染 .pptx，返回更新后的幻灯片与文件路径"""
+    from src.models.state import PPTOutline, SlideContent
+    from src.nodes.visual_agent import visual_agent_node
+    from src.utils.ppt_generator import ppt_generator_node
+
+    state = {
+        "input_text": "",
+        "input_files": [],
+        "outline": PPTOutline(**payload["outline"]),
+        "slides": [SlideContent(**s) for s in payload["slides"]],
+        "current_step": "image_generation",
+        "is_approved": True,
+        "error": None,
+        "generated_file": None,
+        "output_path": payload.get("output_path"),
+        "template_path": payload.get("template_path")
+    }
+    config = {"configurable": {"thread_id": payload.get("thread_id")}}
+    state = visual_agent_node(state, config)
+    state = ppt_generator_node(state)
+    if state.get("error"):
+        raise RuntimeError(state["error"])
+    return {
+        "generated_file": state.get("generated_file"),
+        "slides": [s.model_dump() for s in state["slides"]],
+        "checkpointed": _write_checkpoint(payload.get("thread_id"), state)
+    }
+
+def _write_checkpoint(thread_id: Optional[str], state: Dict) -> bool:
+    """
+    以 renderer 的身份把渲染结果写回会话检查点，Web 客户端断开或刷新页面时结果仍会保存。
+    只有 SQLite 检查点能跨进程共享；内存检查点或写入失败时返回 False，由 Web UI 写回
+    """
+    from src.utils.checkpointer import SQLiteCheckpointer
+    from src.workflow.graph import app
+
+    if not thread_id or not isinstance(app.checkpointer, SQLiteCheckpointer):
+        return False
+    try:
+        app.update_state({"configurable": {"thread_id": thread_id}}, {
+            "slides": state["slides"],
+            "generated_file": state.get("generated_file"),
+            "current_step": "completed"
+        }, as_node="renderer")
+        return True
+    except Exception as e:
+        logger.error(f"JobWorker: Failed to write result to checkpoint of {thread_id}: {str(e)}")
+        return False
+
+# 任务类型 -> 处理函数
+HANDLERS = {
+    "render": _run_render
+}
+
+def _worker_main(worker_id: str, parent_pid: Optional[int] = None):
+    """工作进程主循环 (parent_pid 所在的父进程退出后不再领取新任务)"""
+    queue = JobQueue()
+    poll_interval = float(os.getenv("JOB_POLL_INTERVAL", "0.5"))
+    heartbeat_interval = max(1.0, queue.stale_seconds / 4)
+    _prewarm()
+    logger.info(f"JobWorker {worker_id}: Ready")
+
+    while True:
+        if parent_pid and os.getppid() != parent_pid:
+            logger.info(f"JobWorker {worker_id}: Parent process exited, stopping")
+            return
+        job = queue.claim(worker_id)
+        if not job:
+            time.sleep(poll_interval)
+            continue
+
+        logger.info(f"JobWorker {worker_id}: Running {job['kind']} job {job['id']}")
+        start = time.monotonic()
+        # 执行期间定期更新心跳，表明进程仍然存活
+        finished = threading.Event()
+
+        def beat(job_id=job["id"]):
+            while not finished.wait(heartbeat_interval):
+                queue.heartbeat(job_id)
+
+        threading.Thread(target=beat, daemon=True).start()
+        try:
+            result = HANDLERS[job["kind"]](job["payload"])
+            queue.complete(job["id"], result)
+            logger.info(f"JobWorker {worker_id}: Finished job {job['id']} in {time.monotonic() - start:.1f}s")
+        except Exception as e:
+            logger.exception(f"JobWorker {worker_id}: Job {job['id']} failed")
+            queue.fail(job["id"], str(e))
+        finally:
+            finished.set()
+
+class JobWorkerPool:
+    """
+    预热的工作进程池：以 spawn 方式启动 JOB_WORKERS 个进程，各自从队列领取任务。
+    工作进程独立于 Web 请求运行，客户端断开或请求超时不会中断渲染。
+
+    工作进程不设为 daemon：渲染时还要启动图片归一化与分片渲染的子进程，daemon 进程不允许创建子进程。
+    进程池通过 stop() (启动时注册到 atexit) 结束工作进程；父进程被强制结束时，工作进程检测到后自行退出。
+    """
+
+    def __init__(self, num_workers: Optional[int] = None):
+        # JOB_WORKERS=0 时 Web UI 不启动内置工作进程，由独立的 python main.py worker 处理任务
+        self.num_workers = num_workers if num_workers is not None else int(os.getenv("JOB_WORKERS", "2"))
+        self.processes = []
+
+    def start(self):
+        if self.processes or self.num_workers <= 0:
+            return
+        context = multiprocessing.get_context("spawn")
+        for i in range(self.num_workers):
+            process = context.Process(target=_worker_main, args=(f"worker-{os.getpid()}-{i}", os.getpid()))
+            process.start()
+            self.processes.append(process)
+        atexit.register(self.stop)
+        logger.info(f"JobWorkerPool: Started {self.num_workers} worker processes")
+
+    def join(self):
+        for process in self.processes:
+            process.join()
+
+    def stop(self):
+        for process in self.processes:
+            process.terminate()
+        for process in self.processes:
+            process.join(timeout=5)
+            if process.is_alive():
+                process.kill()
+        self.processes = []
+
+def is_job_queue_enabled() -> bool:
+    return os.getenv("JOB_QUEUE_ENABLED", "false").lower() == "true"
+
+_job_queue = None
+
+def get_job_queue() -> JobQueue:
+    """进程内共享的队列实例 (延迟创建，未启用时不创建数据库文件)"""
+    global _job_queue
+    if _job_queue is None:
+        _job_queue = JobQueue()
+    return _job_queue
@@ -1,11 +1,153 @@
+import hashlib
+import os
+import threading
+import zipfile
+from io import BytesIO
+from typing import Dict, List, Optional, Tuple
+import pptx
+from pptx import Presentation
 from pptx.enum.shapes import PP_PLACEHOLDER
+from pptx.oxml.ns import qn
 from src.utils.logger import logger
 
+# 页眉页脚类占位符，不参与版式识别
+_IGNORED_PLACEHOLDERS = {PP_PLACEHOLDER.DATE, PP_PLACEHOLDER.FOOTER, PP_PLACEHOLDER.SLIDE_NUMBER}
+
+def _classify_layout(types: List[PP_PLACEHOLDER]) -> str:
+    """根据版式中的占位符类型推断版式种类"""
+    types = [t for t in types if t not in _IGNORED_PLACEHOLDERS]
+    if PP_PLACEHOLDER.CENTER_TITLE in types or PP_PLACEHOLDER.SUBTITLE in types:
+        return "title_slide"
+    if not types:
+        return "blank"
+    if PP_PLACEHOLDER.PICTURE in types:
+        return "picture_caption"
+    objects = types.count(PP_PLACEHOLDER.OBJECT)
+    bodies = types.count(PP_PLACEHOLDER.BODY)
+    if objects + bodies == 0:
+        return "title_only"
+    if objects + bodies >= 4:
+        return "comparison"
+    if objects >= 2:
+        return "two_column"
+    if objects and bodies:
+        return "content_caption"
+    if objects:
+        return "title_content"
+    return "section_header"
+
+class TemplateProfile:
+    """
+    模板分析结果 (每个模板每个进程只分析一次)：
+    - data: 去除示例页后的模板字节，每次渲染直接从内存创建 Presentation，不再读取磁盘
+    - digest: 模板内容哈希，用于整体渲染缓存
+    - placeholders: 版式索引 -> {占位符角色: 占位符 idx}，渲染时按 idx 直接取占位符
+    - kinds: 版式种类 -> 模板中第一个该种类的版式索引
+    - geometry: 版式索引 -> {占位符角色: (left, top, width, height) EMU}，用于图片归一化、正文自动缩放与缩略图
+    - text_styles: 版式索引 -> {文本角色: (一级段落字号 (磅), 左缩进 EMU)}，版式中的列表样式覆盖母版
+    """
+
+    def __init__(self, data: bytes, name: str):
+        self.data = data
+        self.name = name
+        self.digest = hashlib.sha256(data).hexdigest()
+        prs = Presentation(BytesIO(data))
+        self.slide_width = prs.slide_width
+        self.slide_height = prs.slide_height
+        self.placeholders: List[Dict[str, int]] = []
+        self.geometry: List[Dict[str, Tuple[int, int, int, int]]] = []
+        self.text_styles: List[Dict[str, Tuple[float, int]]] = []
+        self.kinds: Dict[str, int] = {}
+        tx_styles = prs.slide_master.element.find(qn("p:txStyles"))
+        body_style = self._level1_style(tx_styles.find(qn("p:bodyStyle")) if tx_styles is not None else None, (18.0, 0))
+        self.master_styles = {
+            "title": self._level1_style(tx_styles.find(qn("p:titleStyle")) if tx_styles is not None else None, (44.0, 0)),
+            "subtitle": body_style,
+            "body": body_style
+        }
+
+        for index, layout in enumerate(prs.slide_layouts):
+            roles, geometry, styles = {}, {}, {}
+            types = []
+            for shape in layout.placeholders:
+                ph_type = shape.placeholder_format.type
+                types.append(ph_type)
+                role = LayoutManager.PLACEHOLDER_ROLES.get(ph_type)
+                if role and role not in roles:
+                    roles[role] = shape.placeholder_format.idx
+                    geometry[role] = (shape.left, shape.top, shape.width, shape.height)
+                    if role in self.master_styles and shape.has_text_frame:
+                        styles[role] = self._level1_style(
+                            shape._element.txBody.find(qn("a:lstStyle")), self.master_styles[role]
+                        )
+            self.placeholders.append(roles)
+            self.geometry.append(geometry)
+            self.text_styles.append(styles)
+            self.kinds.setdefault(_classify_layout(types), index)
+
+        logger.info(f"LayoutManager: Analyzed template {name}: {len(self.placeholders)} layouts, kinds {self.kinds}")
+
+    @staticmethod
+    def _level1_style(list_style, default: Tuple[float, int]) -> Tuple[float, int]:
+        """读取列表样式中一级段落的字号 (磅) 与左缩进 (EMU)，未定义的项沿用 default (上一级样式)"""
+        font_size, indent = default
+        lvl1 = list_style.find(qn("a:lvl1pPr")) if list_style is not None else None
+        if lvl1 is not None:
+            indent = int(lvl1.get("marL", indent))
+            def_rpr = lvl1.find(qn("a:defRPr"))
+            if def_rpr is not None and def_rpr.get("sz"):
+                font_size = int(def_rpr.get("sz")) / 100
+        return font_size, indent
+
+    def new_presentation(self):
+        return Presentation(BytesIO(self.data))
+
+    def layout_index(self, layout_name: str) -> int:
+        """按偏好顺序选择模板中存在的版式，都不存在时退回第一个带标题的版式"""
+        preferences = LayoutManager.LAYOUT_PREFERENCES.get(layout_name, LayoutManager.LAYOUT_PREFERENCES["default"])
+        for kind in preferences:
+            if kind in self.kinds:
+                return self.kinds[kind]
+        for index, roles in enumerate(self.placeholders):
+            if "title" in roles:
+                return index
+        return 0
+
+    def picture_box(self, layout_idx: int) -> Optional[Tuple[int, int]]:
+        """版式中图片占位符的尺寸 (宽, 高) EMU，没有图片占位符时返回 None"""
+        rect = self.geometry[layout_idx].get("picture")
+        return rect[2:] if rect else None
+
+    def body_box(self, layout_idx: int) -> Optional[Tuple[int, int]]:
+        """版式中正文占位符的尺寸 (宽, 高) EMU，没有正文占位符时返回 None"""
+        rect = self.geometry[layout_idx].get("body")
+        return rect[2:] if rect else None
+
+    def text_style(self, layout_idx: int, role: str) -> Tuple[float, int]:
+        """版式中文本占位符 ('title', 'subtitle', 'body') 一级段落的默认字号 (磅) 与左缩进 (EMU)"""
+        return self.text_styles[layout_idx].get(role, self.master_styles[role])
+
+    def get_placeholder(self, slide, layout_idx: int, placeholder_type: str):
+        """
+        按预先计算的 idx 直接获取幻灯片中的占位符
+        placeholder_type: 'title', 'subtitle', 'body', 'picture'
+        """
+        idx = self.placeholders[layout_idx].get(placeholder_type)
+        if idx is None:
+            return None
+        try:
+            return slide.placeholders[idx]
+        except KeyError:
+            return None
+
 class LayoutManager:
     """
-    PPT 版式管理器：负责将系统建议的版式类型映射为 python-pptx 的内置版式。
-    
-    默认版式索引参考 (Standard PPT Layouts):
+    PPT 版式管理器：负责将系统建议的版式类型映射为模板中的版式。
+
+    模板 (默认模板或 PPT_TEMPLATE 指定的 .potx/.pptx) 首次使用时分析一次，
+    根据占位符组合自动识别每个版式的种类，之后渲染直接查表。
+
+    默认模板识别结果 (Standard PPT Layouts):
     0: Title (标题页)
     1: Title and Content (标题 + 内容)
     2: Section Header (章节页)
@@ -16,39 +158,80 @@ class LayoutManager:
     7: Content with Caption (内容 + 说明)
     8: Picture with Caption (图片 + 说明)
     """
-    
-    # 映射表：抽象版式名称 -> pptx 索引
-    LAYOUT_MAPPING = {
-        "title_slide": 0,      # Title - 只有标题
-        "title_content": 8,    # Picture with Caption - 有标题、内容和图片占位符
-        "section_header": 2,   # Section Header
-        "two_column": 3,       # Two Content
-        "comparison": 4,       # Comparison
-        "title_only": 5,       # Title Only
-        "blank": 6,            # Blank
-        "content_caption": 7,  # Content with Caption
-        "picture_caption": 8,  # Picture with Caption - 有图片占位符
-        "default": 8           # 默认使用有图片的布局
+
+    # 抽象版式名称 -> 按优先级排列的版式种类 (模板缺少某种版式时依次退回)
+    LAYOUT_PREFERENCES = {
+        "title_slide": ["title_slide", "title_only"],
+        "title_content": ["picture_caption", "title_content"],  # 优先使用有图片占位符的布局
+        "section_header": ["section_header", "title_only", "title_content"],
+        "two_column": ["two_column", "comparison", "title_content"],
+        "comparison": ["comparison", "two_column", "title_content"],
+        "title_only": ["title_only", "section_header"],
+        "blank": ["blank", "title_only"],
+        "content_caption": ["content_caption", "picture_caption", "title_content"],
+        "picture_caption": ["picture_caption", "content_caption", "title_content"],
+        "default": ["picture_caption", "title_content"]  # 默认使用有图片的布局
     }
 
+    # 占位符类型 -> 渲染时使用的角色
+    PLACEHOLDER_ROLES = {
+        PP_PLACEHOLDER.TITLE: "title",
+        PP_PLACEHOLDER.CENTER_TITLE: "title",
+        PP_PLACEHOLDER.SUBTITLE: "subtitle",
+        PP_PLACEHOLDER.BODY: "body",
+        PP_PLACEHOLDER.OBJECT: "body",
+        PP_PLACEHOLDER.PICTURE: "picture"
+    }
+
+    _templates: Dict[str, TemplateProfile] = {}
+    _lock = threading.Lock()
+
     @staticmethod
-    def get_layout_index(layout_name: str) -> int:
-        """根据名称获取版式索引"""
-        layout_idx = LayoutManager.LAYOUT_MAPPING.get(layout_name, 8)  # 默认使用有图片的布局
-        # 确保索引在有效范围内 (0-8)
-        return max(0, min(layout_idx, 8))
+    def default_template_path() -> str:
+        return os.path.join(os.path.dirname(pptx.__file__), "templates", "default.pptx")
 
     @staticmethod
-    def get_placeholder(slide, placeholder_type):
-        """
-        根据类型获取幻灯片中的占位符
-        placeholder_type: 'title', 'body', 'picture'
-        """
-        for shape in slide.placeholders:
-            if placeholder_type == 'title' and shape.placeholder_format.type == PP_PLACEHOLDER.TITLE:
-                return shape
-            if placeholder_type == 'body' and (shape.placeholder_format.type == PP_PLACEHOLDER.BODY or shape.placeholder_format.type == PP_PLACEHOLDER.OBJECT):
-                return shape
-            if placeholder_type == 'picture' and shape.placeholder_format.type == PP_PLACEHOLDER.PICTURE:
-                return shape
-        return None
+    def get_template(template_path: Optional[str] = None) -> TemplateProfile:
+        """获取模板分析结果 (进程内缓存)，未指定时使用 PPT_TEMPLATE 或 python-pptx 默认模板"""
+        path = template_path or os.getenv("PPT_TEMPLATE") or LayoutManager.default_template_path()
+        with LayoutManager._lock:
+            profile = LayoutManager._templates.get(path)
+            if profile is None:
+                profile = TemplateProfile(LayoutManager._load_template_bytes(path), os.path.basename(path))
+                LayoutManager._templates[path] = profile
+            return profile
+
+    @staticmethod
+    def _load_template_bytes(path: str) -> bytes:
+        """读取模板文件：.potx 的内容类型改写为演示文稿，并移除模板自带的示例页"""
+        with open(path, "rb") as f:
+            data = f.read()
+
+        # python-pptx 只接受演示文稿内容类型，.potx 需要改写 [Content_Types].xml
+        source = zipfile.ZipFile(BytesIO(data))
+        content_types = source.read("[Content_Types].xml")
+        if b"presentationml.template.main+xml" in content_types:
+            buffer = BytesIO()
+            with zipfile.ZipFile(buffer, "w", zipfile.ZIP_DEFLATED) as target:
+                for item in source.infolist():
+                    content = source.read(item.filename)
+                    if item.filename == "[Content_Types].xml":
+                        content = content.replace(b"presentationml.template.main+xml", b"presentationml.presentation.main+xml")
+                    target.writestr(item, content)
+            data = buffer.getvalue()
+
+        prs = Presentation(BytesIO(data))
+        if len(prs.slides):
+            slide_ids = prs.slides._sldIdLst
+            for slide_id in list(slide_ids):
+                prs.part.drop_rel(slide_id.rId)
+                slide_ids.remove(slide_id)
+            buffer = BytesIO()
+            prs.save(buffer)
+            data = buffer.getvalue()
+        return data
+
+    @staticmethod
+    def get_layout_index(layout_name: str, template_path: Optional[str] = None) -> int:
+        """根据名称获取版式索引"""
+        return LayoutManager.get_template(template_path).layout_index(layout_name)
@@ -0,0 +1,221 @@
+import asyncio
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Optional, Tuple, Type
+from pydantic import BaseModel
+from langchain_core.runnables import RunnableConfig, RunnableLambda
+from src.utils.llm_hedging import HEDGE_OUTCOME_KEY
+from src.utils.logger import logger
+
+class SQLiteCacheBackend:
+    """LLM 响应缓存的 SQLite 持久化后端"""
+
+    def __init__(self, path: str):
+        self.path = path
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS llm_cache ("
+            "key TEXT PRIMARY KEY, value TEXT NOT NULL, latency REAL NOT NULL, created_at REAL NOT NULL)"
+        )
+        self._conn.commit()
+
+    def get(self, key: str) -> Optional[Tuple[str, float, float]]:
+        """返回 (value, latency, created_at)，不存在时返回 None"""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT value, latency, created_at FROM llm_cache WHERE key = ?", (key,)
+            ).fetchone()
+        return row
+
+    def put(self, key: str, value: str, latency: float):
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO llm_cache (key, value, latency, created_at) VALUES (?, ?, ?, ?)",
+                (key, value, latency, time.time())
+            )
+            self._conn.commit()
+
+    def delete(self, key: str):
+        with self._lock:
+            self._conn.execute("DELETE FROM llm_cache WHERE key = ?", (key,))
+            self._conn.commit()
+
+class LLMCache:
+    """
+    LLM 精确匹配响应缓存：内存 LRU 前置 + 可替换的持久化后端 (默认 SQLite)。
+
+    缓存键由模型名、temperature、system prompt 哈希与渲染后的用户消息组成，
+    值为结构化输出的 JSON。支持 TTL 与按节点关闭 (LLM_CACHE_DISABLED_NODES)。
+    默认只缓存确定性调用 (temperature 为 0)：采样生成时用户重试是为了得到不同的结果，
+    LLM_CACHE_NONDETERMINISTIC=true 时也缓存 temperature 大于 0 的调用。
+    """
+
+    def __init__(self, backend=None, memory_size: Optional[int] = None, ttl: Optional[float] = None,
+                 enabled: Optional[bool] = None, path: Optional[str] = None):
+        """
+        :param enabled: 是否启用，为空时由 LLM_CACHE_ENABLED 决定
+        :param path: SQLite 文件路径，为空时使用 LLM_CACHE_PATH
+        """
+        self.enabled = enabled if enabled is not None else os.getenv("LLM_CACHE_ENABLED", "true").lower() == "true"
+        self.path = path
+        self.disabled_nodes = {n.strip() for n in os.getenv("LLM_CACHE_DISABLED_NODES", "").split(",") if n.strip()}
+        self.nondeterministic = os.getenv("LLM_CACHE_NONDETERMINISTIC", "false").lower() == "true"
+        self.memory_size = memory_size or int(os.getenv("LLM_CACHE_MEMORY_SIZE", "256"))
+        self.ttl = ttl if ttl is not None else float(os.getenv("LLM_CACHE_TTL", "604800"))
+        self._backend = backend
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.saved_seconds = 0.0
+
+    @property
+    def backend(self):
+        # 延迟创建，避免未使用缓存时创建数据库文件；加锁保证多线程下只创建一个连接
+        with self._lock:
+            if self._backend is None:
+                self._backend = SQLiteCacheBackend(self.path or os.getenv("LLM_CACHE_PATH", "data/llm_cache.sqlite"))
+            return self._backend
+
+    def is_enabled_for(self, node_name: str) -> bool:
+        return self.enabled and node_name not in self.disabled_nodes
+
+    @staticmethod
+    def make_key(model: str, temperature, system_prompt: str, user_message: str) -> str:
+        system_hash = hashlib.sha256(system_prompt.encode("utf-8")).hexdigest()
+        raw = "\x1f".join([str(model), str(temperature), system_hash, user_message])
+        return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+    def _is_expired(self, created_at: float) -> bool:
+        return self.ttl > 0 and time.time() - created_at > self.ttl
+
+    def get(self, key: str) -> Optional[Tuple[str, float]]:
+        """查询缓存，返回 (value, 原始调用耗时)"""
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None:
+                self._memory.move_to_end(key)
+        if entry is None:
+            entry = self.backend.get(key)
+            if entry is not None:
+                self._remember(key, entry)
+
+        if entry is None:
+            return None
+        value, latency, created_at = entry
+        if self._is_expired(created_at):
+            with self._lock:
+                self._memory.pop(key, None)
+            self.backend.delete(key)
+            return None
+        return value, latency
+
+    def put(self, key: str, value: str, latency: float):
+        self._remember(key, (value, latency, time.time()))
+        self.backend.put(key, value, latency)
+
+    def _remember(self, key: str, entry):
+        with self._lock:
+            self._memory[key] = entry
+            self._memory.move_to_end(key)
+            while len(self._memory) > self.memory_size:
+                self._memory.popitem(last=False)
+
+    def _record(self, node_name: str, hit: bool, latency: float = 0.0):
+        with self._lock:
+            if hit:
+                self.hits += 1
+                self.saved_seconds += latency
+            else:
+                self.misses += 1
+            total = self.hits + self.misses
+            hit_rate = self.hits / total if total else 0.0
+            saved = self.saved_seconds
+        if hit:
+            logger.info(f"LLMCache: Hit for {node_name} (saved {latency:.1f}s, hit rate {hit_rate:.0%}, total saved {saved:.1f}s)")
+        else:
+            logger.info(f"LLMCache: Miss for {node_name} (hit rate {hit_rate:.0%})")
+
+    def wrap(self, node_name: str, prompt, llm, schema: Type[BaseModel], chain=None):
+        """
+        构建带缓存的 prompt | structured_llm 链，返回 Runnable (支持 invoke / batch 及其异步版本)
+        :param chain: 实际执行的链 (如带对冲的链)，为空时使用 prompt | structured_llm
+        """
+        chain = chain or prompt | llm.with_structured_output(schema)
+        model = getattr(llm, "model_name", None) or getattr(llm, "model", "")
+        temperature = getattr(llm, "temperature", None)
+        if temperature != 0 and not self.nondeterministic:
+            logger.info(f"LLMCache: Not caching {node_name} (temperature {temperature})")
+            return chain
+
+        def make_key(inputs: dict) -> str:
+            messages = prompt.format_messages(**inputs)
+            system_prompt = "\n".join(m.content for m in messages if m.type == "system")
+            user_message = "\n".join(m.content for m in messages if m.type != "system")
+            return self.make_key(model, temperature, system_prompt, user_message)
+
+        def with_outcome(config: RunnableConfig):
+            # 传入对冲结果字典，备用模型胜出时不以主模型的键缓存
+            outcome = {}
+            configurable = {**(config.get("configurable") or {}), HEDGE_OUTCOME_KEY: outcome}
+            return {**config, "configurable": configurable}, outcome
+
+        def lookup(key: str):
+            cached = self.get(key)
+            if cached is None:
+                return None
+            value, latency = cached
+            self._record(node_name, True, latency)
+            return schema.model_validate_json(value)
+
+        def store(key: str, result, latency: float, outcome: dict):
+            self._record(node_name, False)
+            if outcome.get("fallback"):
+                logger.info(f"LLMCache: Not caching {node_name} result answered by the fallback model")
+                return
+            if isinstance(result, schema):
+                self.put(key, result.model_dump_json(), latency)
+
+        def invoke(inputs: dict, config: RunnableConfig):
+            if not self.is_enabled_for(node_name):
+                return chain.invoke(inputs, config=config)
+
+            key = make_key(inputs)
+            cached = lookup(key)
+            if cached is not None:
+                return cached
+
+            config, outcome = with_outcome(config)
+            start = time.monotonic()
+            result = chain.invoke(inputs, config=config)
+            store(key, result, time.monotonic() - start, outcome)
+            return result
+
+        async def ainvoke(inputs: dict, config: RunnableConfig):
+            if not self.is_enabled_for(node_name):
+                return await chain.ainvoke(inputs, config=config)
+
+            # SQLite 读写是阻塞调用，放到线程中执行，避免阻塞事件循环 (连接由后端的锁串行访问)
+            key = make_key(inputs)
+            cached = await asyncio.to_thread(lookup, key)
+            if cached is not None:
+                return cached
+
+            config, outcome = with_outcome(config)
+            start = time.monotonic()
+            result = await chain.ainvoke(inputs, config=config)
+            await asyncio.to_thread(store, key, result, time.monotonic() - start, outcome)
+            return result
+
+        return RunnableLambda(invoke, afunc=ainvoke, name=f"{node_name}_cached_chain")
+
+# 全局缓存实例
+llm_cache = LLMCache()
@@ -1,35 +1,154 @@
+import importlib.util
 import os
+import threading
+import httpx
 from dotenv import load_dotenv
 from langchain_openai import ChatOpenAI
+from src.utils.logger import logger
 
 load_dotenv()
 
 class LLMFactory:
     """
     模型工厂：通过 OpenAI 兼容协议连接 LLM 服务 (支持阿里云、DeepSeek 等)
+
+    模型实例与底层 HTTP 连接池在进程内复用：所有节点与会话共享同一个 keep-alive 的
+    httpx.Client，避免每次调用都重新建立 TCP/TLS 连接。
     """
-    
+
+    _models = {}
+    _http_client = None
+    _async_http_client = None
+    _lock = threading.Lock()
+
+    @staticmethod
+    def _http2_enabled() -> bool:
+        http2 = os.getenv("LLM_HTTP2", "false").lower() == "true"
+        if http2 and importlib.util.find_spec("h2") is None:
+            logger.warning("LLMFactory: LLM_HTTP2 is enabled but package 'h2' is not installed, falling back to HTTP/1.1")
+            return False
+        return http2
+
+    @staticmethod
+    def _get_http_client() -> httpx.Client:
+        """创建 (仅一次) 进程共享的 HTTP 连接池"""
+        if LLMFactory._http_client is None:
+            http2 = LLMFactory._http2_enabled()
+            limits = httpx.Limits(
+                max_connections=int(os.getenv("LLM_POOL_MAX_CONNECTIONS", "20")),
+                max_keepalive_connections=int(os.getenv("LLM_POOL_MAX_KEEPALIVE", "10")),
+                keepalive_expiry=float(os.getenv("LLM_KEEPALIVE_EXPIRY", "60"))
+            )
+            timeout = httpx.Timeout(
+                float(os.getenv("LLM_TIMEOUT", "120")),
+                connect=float(os.getenv("LLM_CONNECT_TIMEOUT", "10"))
+            )
+            LLMFactory._http_client = httpx.Client(limits=limits, timeout=timeout, http2=http2)
+            logger.info(f"LLMFactory: Created shared HTTP client (max connections: {limits.max_connections}, http2: {http2})")
+        return LLMFactory._http_client
+
+    @staticmethod
+    def _get_async_http_client() -> httpx.AsyncClient:
+        """创建 (仅一次) 进程共享的异步 HTTP 连接池，供 ainvoke 路径 (Web UI 事件循环) 使用"""
+        if LLMFactory._async_http_client is None:
+            client = LLMFactory._get_http_client()
+            LLMFactory._async_http_client = httpx.AsyncClient(
+                limits=httpx.Limits(
+                    max_connections=int(os.getenv("LLM_POOL_MAX_CONNECTIONS", "20")),
+                    max_keepalive_connections=int(os.getenv("LLM_POOL_MAX_KEEPALIVE", "10")),
+                    keepalive_expiry=float(os.getenv("LLM_KEEPALIVE_EXPIRY", "60"))
+                ),
+                timeout=client.timeout,
+                http2=LLMFactory._http2_enabled()
+            )
+        return LLMFactory._async_http_client
+
     @staticmethod
     def get_model(node_name: str):
         """
-        根据节点名称获取对应的模型
-        :param node_name: planner, generator, or image_advisor
+        根据节点名称获取对应的模型 (同一节点在进程内复用同一个实例)
+        :param node_name: planner, generator, image_advisor, or condenser
         """
+        model = LLMFactory._models.get(node_name)
+        if model is not None:
+            return model
+
+        with LLMFactory._lock:
+            if node_name in LLMFactory._models:
+                return LLMFactory._models[node_name]
+
+            # 映射不同节点的模型名称
+            model_configs = {
+                "planner": os.getenv("PLANNER_MODEL", "qwen-max"),
+                "generator": os.getenv("GENERATOR_MODEL", "qwen-plus"),
+                "image_advisor": os.getenv("IMAGE_ADVISOR_MODEL", "qwen-plus"),
+                "condenser": os.getenv("CONDENSER_MODEL", "qwen-turbo")
+            }
+
+            model_name = model_configs.get(node_name, "qwen-plus")
+            return LLMFactory._create_model(node_name, model_name)
+
+    @staticmethod
+    def get_fallback_model(node_name: str):
+        """
+        获取节点的备用模型 (用于请求对冲)，由 <NODE>_FALLBACK_MODEL 配置，未配置时返回 None
+        :param node_name: planner, generator, image_advisor, or condenser
+        """
+        model_name = os.getenv(f"{node_name.upper()}_FALLBACK_MODEL")
+        if not model_name:
+            return None
+
+        key = f"{node_name}:fallback"
+        model = LLMFactory._models.get(key)
+        if model is not None:
+            return model
+
+        with LLMFactory._lock:
+            if key in LLMFactory._models:
+                return LLMFactory._models[key]
+            return LLMFactory._create_model(key, model_name)
+
+    @staticmethod
+    def _create_model(key: str, model_name: str):
+        """创建模型实例并登记 (调用方需持有 _lock)"""
         api_key = os.getenv("LLM_API_KEY") or os.getenv("DASHSCOPE_API_KEY")
         api_base = os.getenv("LLM_API_BASE") or "https://dashscope.aliyuncs.com/compatible-mode/v1"
-        
-        # 映射不同节点的模型名称
-        model_configs = {
-            "planner": os.getenv("PLANNER_MODEL", "qwen-max"),
-            "generator": os.getenv("GENERATOR_MODEL", "qwen-plus"),
-            "image_advisor": os.getenv("IMAGE_ADVISOR_MODEL", "qwen-plus")
-        }
-        
-        model_name = model_configs.get(node_name, "qwen-plus")
-        
-        return ChatOpenAI(
+
+        model = ChatOpenAI(
             model=model_name,
             api_key=api_key,
             base_url=api_base,
-            temperature=0.7
+            temperature=0.7,
+            # 重试由 resilience 统一处理 (见 ChainRegistry)，关闭 SDK 自带的重试
+            max_retries=0,
+            http_client=LLMFactory._get_http_client(),
+            http_async_client=LLMFactory._get_async_http_client()
         )
+        LLMFactory._models[key] = model
+        logger.info(f"LLMFactory: Created model client for {key}: {model_name}")
+        return model
+
+    @staticmethod
+    def warm_up(node_names=("planner", "generator", "image_advisor")):
+        """
+        启动时预热：提前创建各节点的模型实例，并向 API 发起一次轻量请求以建立连接。
+        在后台线程中执行，不阻塞启动。LLM_WARMUP=false 时跳过。
+        """
+        if os.getenv("LLM_WARMUP", "true").lower() != "true":
+            return
+
+        def _warm():
+            try:
+                for node_name in node_names:
+                    LLMFactory.get_model(node_name)
+                api_base = os.getenv("LLM_API_BASE") or "https://dashscope.aliyuncs.com/compatible-mode/v1"
+                api_key = os.getenv("LLM_API_KEY") or os.getenv("DASHSCOPE_API_KEY")
+                LLMFactory._get_http_client().get(
+                    f"{api_base.rstrip('/')}/models",
+                    headers={"Authorization": f"Bearer {api_key}"}
+                )
+                logger.info("LLMFactory: Connection pool warmed up")
+            except Exception as e:
+                logger.warning(f"LLMFactory: Warm-up failed: {str(e)}")
+
+        threading.Thread(target=_warm, daemon=True).start()
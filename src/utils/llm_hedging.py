@@ -0,0 +1,200 @@
+import asyncio
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from typing import Dict, Optional
+from langchain_core.runnables import RunnableConfig, RunnableLambda
+from src.utils.logger import logger
+
+# config["configurable"] 中的可选字典：备用模型的对冲请求胜出时写入 {"fallback": True}，
+# 供外层 (如 LLMCache) 判断结果是否来自主模型
+HEDGE_OUTCOME_KEY = "llm_hedge_outcome"
+
+class LatencyHistogram:
+    """滑动窗口内的调用耗时样本，用于计算分位数"""
+
+    def __init__(self, window: int):
+        self._samples = deque(maxlen=window)
+        self._lock = threading.Lock()
+
+    def add(self, latency: float):
+        with self._lock:
+            self._samples.append(latency)
+
+    def __len__(self):
+        return len(self._samples)
+
+    def percentile(self, p: float) -> Optional[float]:
+        with self._lock:
+            samples = sorted(self._samples)
+        if not samples:
+            return None
+        index = min(len(samples) - 1, int(round(p / 100 * (len(samples) - 1))))
+        return samples[index]
+
+class LLMHedger:
+    """
+    LLM 请求对冲 (hedged requests)：调用超过该节点历史耗时的 P 分位数仍未返回时，
+    再发送一次相同请求 (配置了 <NODE>_FALLBACK_MODEL 时发往备用模型)，取先完成的结果。
+
+    只有最慢的 (100-P)% 请求会触发对冲，额外成本有上限。
+    样本数不足 LLM_HEDGE_MIN_SAMPLES 时不对冲。
+    """
+
+    def __init__(self):
+        self.enabled = os.getenv("LLM_HEDGE_ENABLED", "false").lower() == "true"
+        self.nodes = {n.strip() for n in os.getenv("LLM_HEDGE_NODES", "").split(",") if n.strip()}
+        self.percentile = float(os.getenv("LLM_HEDGE_PERCENTILE", "95"))
+        self.min_samples = int(os.getenv("LLM_HEDGE_MIN_SAMPLES", "20"))
+        self.min_delay = float(os.getenv("LLM_HEDGE_MIN_DELAY", "1"))
+        self.window = int(os.getenv("LLM_HEDGE_WINDOW", "200"))
+        self._histograms: Dict[str, LatencyHistogram] = {}
+        self._executor = None
+        self._lock = threading.Lock()
+        self.hedged = 0
+        self.hedge_wins = 0
+
+    def is_enabled_for(self, node_name: str) -> bool:
+        return self.enabled and (not self.nodes or node_name in self.nodes)
+
+    def histogram(self, node_name: str) -> LatencyHistogram:
+        with self._lock:
+            if node_name not in self._histograms:
+                self._histograms[node_name] = LatencyHistogram(self.window)
+            return self._histograms[node_name]
+
+    def _get_executor(self) -> ThreadPoolExecutor:
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(
+                    max_workers=int(os.getenv("LLM_HEDGE_WORKERS", "32")),
+                    thread_name_prefix="llm-hedge"
+                )
+            return self._executor
+
+    def threshold(self, node_name: str) -> Optional[float]:
+        """当前节点的对冲等待时间，样本不足时返回 None"""
+        histogram = self.histogram(node_name)
+        if len(histogram) < self.min_samples:
+            return None
+        return max(self.min_delay, histogram.percentile(self.percentile))
+
+    def wrap(self, node_name: str, primary, fallback=None):
+        """
+        构建带对冲的链，返回 Runnable (支持 invoke / batch 及其异步版本)
+        :param primary: 主链
+        :param fallback: 备用模型的链，为空时对冲请求仍发往主链
+        """
+        if not self.is_enabled_for(node_name):
+            return primary
+        hedge_chain = fallback or primary
+        histogram = self.histogram(node_name)
+
+        def hedge_won(config):
+            with self._lock:
+                self.hedge_wins += 1
+            logger.info(f"LLMHedger: Hedged request won for {node_name} (hedged {self.hedged}, won {self.hedge_wins})")
+            outcome = (config.get("configurable") or {}).get(HEDGE_OUTCOME_KEY)
+            if fallback is not None and outcome is not None:
+                outcome["fallback"] = True
+
+        def timed(chain, inputs, config):
+            start = time.monotonic()
+            result = chain.invoke(inputs, config=config)
+            return result, time.monotonic() - start
+
+        def invoke(inputs: dict, config: RunnableConfig):
+            threshold = self.threshold(node_name)
+            if threshold is None:
+                result, latency = timed(primary, inputs, config)
+                histogram.add(latency)
+                return result
+
+            executor = self._get_executor()
+            primary_future = executor.submit(timed, primary, inputs, config)
+            # 无论胜负都记录主请求的真实耗时，保证直方图反映原始分布
+            primary_future.add_done_callback(
+                lambda f: histogram.add(f.result()[1]) if f.exception() is None else None
+            )
+            done, _ = wait([primary_future], timeout=threshold)
+            if done:
+                return primary_future.result()[0]
+
+            with self._lock:
+                self.hedged += 1
+            logger.warning(f"LLMHedger: {node_name} exceeded P{self.percentile:g} ({threshold:.1f}s), sending hedged request{' to fallback model' if fallback else ''}")
+            # 对冲请求不挂载回调，避免与主请求的流式输出交错
+            hedge_config = {k: v for k, v in config.items() if k != "callbacks"}
+            hedge_future = executor.submit(timed, hedge_chain, inputs, hedge_config)
+
+            pending = {primary_future, hedge_future}
+            error = None
+            while pending:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    if future.exception() is not None:
+                        error = future.exception()
+                        continue
+                    # 同步 HTTP 请求无法中途取消，落败的请求在后台自然结束
+                    if future is hedge_future:
+                        hedge_won(config)
+                    return future.result()[0]
+            raise error
+
+        async def atimed(chain, inputs, config):
+            start = time.monotonic()
+            result = await chain.ainvoke(inputs, config=config)
+            return result, time.monotonic() - start
+
+        async def ainvoke(inputs: dict, config: RunnableConfig):
+            threshold = self.threshold(node_name)
+            if threshold is None:
+                result, latency = await atimed(primary, inputs, config)
+                histogram.add(latency)
+                return result
+
+            started = time.monotonic()
+            primary_task = asyncio.ensure_future(atimed(primary, inputs, config))
+
+            def record(task):
+                # 被取消的主请求按已等待的时长记录 (实际耗时的下界)
+                if task.cancelled():
+                    histogram.add(time.monotonic() - started)
+                elif task.exception() is None:
+                    histogram.add(task.result()[1])
+
+            primary_task.add_done_callback(record)
+            done, _ = await asyncio.wait({primary_task}, timeout=threshold)
+            if done:
+                return primary_task.result()[0]
+
+            with self._lock:
+                self.hedged += 1
+            logger.warning(f"LLMHedger: {node_name} exceeded P{self.percentile:g} ({threshold:.1f}s), sending hedged request{' to fallback model' if fallback else ''}")
+            hedge_config = {k: v for k, v in config.items() if k != "callbacks"}
+            hedge_task = asyncio.ensure_future(atimed(hedge_chain, inputs, hedge_config))
+
+            pending = {primary_task, hedge_task}
+            error = None
+            try:
+                while pending:
+                    done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                    for task in done:
+                        if task.exception() is not None:
+                            error = task.exception()
+                            continue
+                        if task is hedge_task:
+                            hedge_won(config)
+                        return task.result()[0]
+                raise error
+            finally:
+                # 异步路径可以直接取消落败的请求
+                for task in pending:
+                    task.cancel()
+
+        return RunnableLambda(invoke, afunc=ainvoke, name=f"{node_name}_hedged_chain")
+
+# 全局对冲实例
+llm_hedger = LLMHedger()
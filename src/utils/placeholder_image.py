@@ -0,0 +1,114 @@
+import hashlib
+import os
+import tempfile
+from typing import List
+from PIL import Image, ImageDraw, ImageFont
+from src.utils.logger import logger
+
+class PlaceholderImage:
+    """
+    本地占位图生成器：图片生成或搜索失败时，用 Pillow 根据幻灯片标题/关键词
+    渲染一张主题卡片，按文本缓存到本地，不依赖任何外部占位图服务。
+    """
+
+    WIDTH = 1280
+    HEIGHT = 720
+
+    # (背景色, 强调色, 文字色)
+    PALETTE = [
+        ((30, 58, 95), (86, 156, 214), (255, 255, 255)),
+        ((44, 62, 80), (26, 188, 156), (255, 255, 255)),
+        ((52, 48, 78), (155, 89, 182), (255, 255, 255)),
+        ((38, 70, 83), (233, 196, 106), (255, 255, 255)),
+        ((60, 60, 60), (231, 111, 81), (255, 255, 255))
+    ]
+
+    # 常见的中文字体路径，找不到时退回 Pillow 默认字体
+    FONT_CANDIDATES = [
+        "/System/Library/Fonts/PingFang.ttc",
+        "/System/Library/Fonts/STHeiti Medium.ttc",
+        "C:/Windows/Fonts/msyh.ttc",
+        "C:/Windows/Fonts/simhei.ttf",
+        "/usr/share/fonts/opentype/noto/NotoSansCJK-Regular.ttc",
+        "/usr/share/fonts/noto-cjk/NotoSansCJK-Regular.ttc",
+        "/usr/share/fonts/truetype/wqy/wqy-microhei.ttc",
+        "/usr/share/fonts/truetype/dejavu/DejaVuSans.ttf"
+    ]
+
+    @staticmethod
+    def _load_font(size: int):
+        candidates = [os.getenv("PLACEHOLDER_FONT")] + PlaceholderImage.FONT_CANDIDATES
+        for path in candidates:
+            if path and os.path.exists(path):
+                try:
+                    return ImageFont.truetype(path, size)
+                except OSError:
+                    continue
+        try:
+            return ImageFont.load_default(size=size)
+        except TypeError:
+            # Pillow < 10.1 的默认字体不支持指定字号
+            return ImageFont.load_default()
+
+    @staticmethod
+    def _wrap(draw, text: str, font, max_width: int, max_lines: int = 4) -> List[str]:
+        """按像素宽度折行，兼容中英文 (英文按单词，中文按字符)"""
+        lines, current = [], ""
+        tokens = []
+        for word in text.split(" "):
+            tokens.extend(list(word) if not word.isascii() else [word])
+            tokens.append(" ")
+        for token in tokens[:-1]:
+            candidate = current + token
+            if current and draw.textlength(candidate, font=font) > max_width:
+                lines.append(current.strip())
+                current = token.lstrip()
+            else:
+                current = candidate
+        if current.strip():
+            lines.append(current.strip())
+
+        if len(lines) > max_lines:
+            lines = lines[:max_lines]
+            lines[-1] = lines[-1][:-1] + "…"
+        return lines
+
+    @staticmethod
+    def is_placeholder(path: str) -> bool:
+        """是否为本地渲染的占位卡片"""
+        cache_dir = os.path.abspath(os.getenv("PLACEHOLDER_DIR", "data/placeholders"))
+        return bool(path) and os.path.dirname(os.path.abspath(path)) == cache_dir
+
+    @staticmethod
+    def render(text: str) -> str:
+        """渲染 (或从缓存读取) 占位卡片，返回本地文件路径"""
+        text = " ".join((text or "").split()) or "Image"
+        cache_dir = os.getenv("PLACEHOLDER_DIR", "data/placeholders")
+        digest = hashlib.sha256(f"{PlaceholderImage.WIDTH}x{PlaceholderImage.HEIGHT}:{text}".encode("utf-8")).hexdigest()
+        path = os.path.join(cache_dir, f"{digest[:24]}.png")
+        if os.path.exists(path):
+            return path
+
+        background, accent, foreground = PlaceholderImage.PALETTE[int(digest[:8], 16) % len(PlaceholderImage.PALETTE)]
+        img = Image.new("RGB", (PlaceholderImage.WIDTH, PlaceholderImage.HEIGHT), background)
+        draw = ImageDraw.Draw(img)
+
+        # 左侧强调色条与底部装饰线
+        margin = PlaceholderImage.WIDTH // 16
+        draw.rectangle([0, 0, margin // 3, PlaceholderImage.HEIGHT], fill=accent)
+        draw.rectangle([margin, PlaceholderImage.HEIGHT - margin, PlaceholderImage.WIDTH - margin, PlaceholderImage.HEIGHT - margin + 6], fill=accent)
+
+        font = PlaceholderImage._load_font(PlaceholderImage.HEIGHT // 12)
+        lines = PlaceholderImage._wrap(draw, text, font, PlaceholderImage.WIDTH - 2 * margin)
+        line_height = int(PlaceholderImage.HEIGHT // 12 * 1.4)
+        top = (PlaceholderImage.HEIGHT - line_height * len(lines)) // 2
+        for i, line in enumerate(lines):
+            draw.text((margin, top + i * line_height), line, font=font, fill=foreground)
+
+        os.makedirs(cache_dir, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=cache_dir, suffix=".tmp")
+        with os.fdopen(fd, "wb") as f:
+            img.save(f, format="PNG", optimize=True)
+        os.replace(tmp_path, path)
+        logger.info(f"PlaceholderImage: Rendered placeholder for '{text[:30]}' -> {path}")
+        return path
@@ -1,22 +1,42 @@
+import asyncio
+import hashlib
+import multiprocessing
 import os
-import requests
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 from io import BytesIO
-from pptx import Presentation
-from pptx.util import Inches, Cm
+from typing import Optional, Tuple
+from pptx.util import Inches, Cm, Pt
 from PIL import Image
 from src.models.state import PPTState, PPTOutline, SlideContent
 from src.utils.layout_manager import LayoutManager
+from src.utils.image_prefetcher import ImagePrefetcher, is_placeholder_url
+from src.utils.image_normalizer import ImageNormalizer, in_child_process
+from src.utils.render_cache import render_cache, normalized_image_cache, source_image_key
+from src.utils.text_fit import text_fitter
+from src.utils.pptx_stream_writer import StreamingPptxWriter, export_slides
 from src.utils.logger import logger
 
 class PPTGenerator:
     """
     PPT 生成器：根据 PPTState 中的数据渲染并导出 .pptx 文件
     """
-    
+
+    # 非占位符图片的最大显示尺寸
+    FORCE_IMAGE_MAX_WIDTH = Cm(8)
+    FORCE_IMAGE_MAX_HEIGHT = Cm(6)
+
     def __init__(self, output_dir: str = "data/outputs"):
         self.output_dir = output_dir
         if not os.path.exists(self.output_dir):
             os.makedirs(self.output_dir)
+        # 预取阶段下载的远程图片: URL -> 本地临时文件 (下载失败为 None)
+        self._local_images = {}
+        # 归一化后的图片: 本地路径 -> 缩放压缩后的临时文件
+        self._normalized_images = {}
+        # 已插入的图片: sha1 -> 内容相同的本地文件 (流式导出时直接从文件写入压缩包)
+        self._image_files = {}
+        # 当前渲染使用的模板分析结果
+        self._template = None
 
     def generate(self, state: PPTState) -> str:
         """
@@ -31,60 +51,167 @@ class PPTGenerator:
         if not outline:
             raise ValueError("No outline found in state for PPT generation.")
 
-        prs = Presentation()
-
-        # 检查是否有标题页数据
-        title_slide_data = None
-        content_slides_data = slides_data
-
-        if slides_data and len(slides_data) > 0 and getattr(slides_data[0], 'layout_type', None) == 'title_slide':
-            title_slide_data = slides_data[0]
-            content_slides_data = slides_data[1:]  # 剩余的是内容页
-            logger.info("PPT Generator: Found title slide data from generator")
-
-        # 1. 创建标题页
-        if title_slide_data:
-            # 使用generator生成的标题页数据
-            cover_image = getattr(title_slide_data, 'image_path', None)
-            self._add_title_slide(prs, title_slide_data.title, cover_image)
-            # 如果标题页有bullet_points，也添加到标题页
-            if hasattr(title_slide_data, 'bullet_points') and title_slide_data.bullet_points:
-                # 这里可以扩展_add_title_slide方法来添加副标题
-                logger.info(f"PPT Generator: Title slide subtitle: {title_slide_data.bullet_points}")
-        else:
-            # 回退到原来的逻辑
-            cover_image = None
-            if slides_data and hasattr(slides_data[0], 'image_path') and slides_data[0].image_path:
-                cover_image = slides_data[0].image_path
-            self._add_title_slide(prs, outline.title, cover_image)
-
-        logger.info("PPT Generator: Title slide added")
-
-        # 2. 逐页创建内容幻灯片
-        for slide_data in content_slides_data:
-            self._add_content_slide(prs, slide_data)
-            
-        # 3. 保存文件
-        safe_title = "".join([c for c in outline.title if c.isalnum() or c in (' ', '_')]).rstrip()
-        filename = f"{safe_title or 'presentation'}.pptx"
-        file_path = os.path.join(self.output_dir, filename)
-        
-        prs.save(file_path)
-        logger.info(f"PPT successfully generated at: {file_path}")
-        logger.info(f"PPT contains {len(prs.slides)} slides")
-        for i, slide in enumerate(prs.slides):
-            logger.info(f"Slide {i+1}: {slide.slide_layout.name}")
+        # 内容、模板与渲染参数都未变化时直接返回上次渲染的文件
+        self._template = LayoutManager.get_template(state.get("template_path"))
+        file_path = self._output_path(state, outline)
+        normalizer = ImageNormalizer()
+        deck_hash = render_cache.deck_hash(
+            outline, slides_data, self._template.digest,
+            (normalizer.enabled, normalizer.dpi, normalizer.quality) + text_fitter.settings()
+        )
+        if render_cache.reuse_deck(deck_hash, file_path):
+            return file_path
+
+        # 0. 预取阶段：并行下载所有远程图片，渲染时只读取本地文件
+        with ImagePrefetcher() as prefetcher:
+            self._local_images = prefetcher.prefetch(getattr(s, 'image_path', None) for s in slides_data)
+
+            # 模板字节与版式分析结果在进程内缓存，每次渲染只从内存创建 Presentation
+            prs = self._template.new_presentation()
+
+            # 检查是否有标题页数据
+            title_slide_data = None
+            content_slides_data = slides_data
+
+            if slides_data and len(slides_data) > 0 and getattr(slides_data[0], 'layout_type', None) == 'title_slide':
+                title_slide_data = slides_data[0]
+                content_slides_data = slides_data[1:]  # 剩余的是内容页
+                logger.info("PPT Generator: Found title slide data from generator")
+
+            # 0.5 归一化阶段：在进程池中把图片缩放到目标显示区域并重新压缩
+            image_boxes = self._collect_image_boxes(prs, slides_data, title_slide_data)
+            self._normalized_images = normalizer.normalize_all(image_boxes, prefetcher.ensure_temp_dir())
+            self._persist_remote_images()
+
+            # 大型演示文稿使用流式导出：每页完成后立即写入文件并释放图片字节
+            # 分片渲染的结果直接合并到压缩包，同样需要流式导出
+            shard_workers = self._shard_workers(len(content_slides_data))
+            writer = StreamingPptxWriter(file_path, self._image_files) if shard_workers or self._use_streaming(len(slides_data)) else None
+            try:
+                # 1. 创建标题页
+                if title_slide_data:
+                    # 使用generator生成的标题页数据
+                    cover_image = getattr(title_slide_data, 'image_path', None)
+                    slide = self._add_title_slide(prs, title_slide_data.title, cover_image)
+                    # 如果标题页有bullet_points，也添加到标题页
+                    if hasattr(title_slide_data, 'bullet_points') and title_slide_data.bullet_points:
+                        # 这里可以扩展_add_title_slide方法来添加副标题
+                        logger.info(f"PPT Generator: Title slide subtitle: {title_slide_data.bullet_points}")
+                else:
+                    # 回退到原来的逻辑
+                    cover_image = None
+                    if slides_data and hasattr(slides_data[0], 'image_path') and slides_data[0].image_path:
+                        cover_image = slides_data[0].image_path
+                    slide = self._add_title_slide(prs, outline.title, cover_image)
+                if writer:
+                    writer.flush_slide(slide)
+
+                logger.info("PPT Generator: Title slide added")
+
+                # 2. 逐页创建内容幻灯片 (页数很多时分片到多个进程并行创建)
+                if shard_workers:
+                    self._render_sharded(prs, writer, content_slides_data, state.get("template_path"), shard_workers)
+                else:
+                    for slide_data in content_slides_data:
+                        slide = self._add_content_slide(prs, slide_data)
+                        if writer:
+                            writer.flush_slide(slide)
+
+                # 3. 保存文件
+                if writer:
+                    writer.close(prs)
+                else:
+                    prs.save(file_path)
+            except Exception:
+                if writer:
+                    writer.abort()
+                raise
+            render_cache.put_deck(deck_hash, file_path)
+            logger.info(f"PPT successfully generated at: {file_path}")
+            logger.info(f"PPT contains {len(prs.slides)} slides")
+            for i, slide in enumerate(prs.slides):
+                logger.info(f"Slide {i+1}: {slide.slide_layout.name}")
+
+        return file_path
+
+    @staticmethod
+    def _use_streaming(slide_count: int) -> bool:
+        """幻灯片数达到 PPT_STREAM_MIN_SLIDES 时使用流式导出"""
+        if os.getenv("PPT_STREAMING_EXPORT", "true").lower() != "true":
+            return False
+        return slide_count >= int(os.getenv("PPT_STREAM_MIN_SLIDES", "50"))
+
+    @staticmethod
+    def _shard_workers(slide_count: int) -> int:
+        """内容页数达到 PPT_SHARD_MIN_SLIDES 时分片渲染使用的进程数，不分片时返回 0"""
+        if os.getenv("PPT_SHARDED_RENDER", "false").lower() != "true":
+            return 0
+        # 批量渲染、任务队列等工作进程本身已按 CPU 并行，不再分片
+        if in_child_process():
+            return 0
+        if slide_count < int(os.getenv("PPT_SHARD_MIN_SLIDES", "200")):
+            return 0
+        workers = int(os.getenv("PPT_SHARD_WORKERS", "0")) or os.cpu_count() or 1
+        return workers if workers > 1 else 0
+
+    def _render_sharded(self, prs, writer: StreamingPptxWriter, slides_data, template_path: Optional[str], workers: int):
+        """
+        分片渲染：内容幻灯片按连续区间分给工作进程，各自在独立的演示文稿中创建并导出，
+        主进程按顺序合并到同一个文件 (重新分配 rId、图片按 sha1 去重)。
+        进程池不可用或某个分片失败时，尚未合并的分片在当前进程内按顺序创建，不丢弃整次渲染。
+        """
+        # 分片数为进程数的两倍：合并前面的分片时后面的分片仍在渲染，也减少单个慢分片的拖尾
+        size = -(-len(slides_data) // (workers * 2))
+        chunks = [slides_data[i:i + size] for i in range(0, len(slides_data), size)]
+        logger.info(f"PPT Generator: Rendering {len(slides_data)} slides in {len(chunks)} shards on {workers} processes")
+        merged = 0
+        # 调用方可能是事件循环的工作线程，fork 多线程进程可能死锁，使用 spawn 启动
+        executor = ProcessPoolExecutor(max_workers=min(workers, len(chunks)), mp_context=multiprocessing.get_context("spawn"))
+        try:
+            futures = [
+                executor.submit(
+                    render_shard, template_path, chunk, self.output_dir, self._local_images, self._normalized_images
+                )
+                for chunk in chunks
+            ]
+        except Exception as e:
+            logger.error(f"PPT Generator: Failed to start shard processes, rendering in-process: {str(e)}")
+            futures = []
+        try:
+            for future in futures:
+                try:
+                    exported = future.result()
+                except Exception as e:
+                    # 进程池损坏 (BrokenProcessPool) 或分片内出错：剩余分片改在当前进程内创建
+                    logger.error(f"PPT Generator: Shard {merged + 1} failed, rendering remaining slides in-process: {str(e)}")
+                    break
+                writer.merge_slides(prs, exported)
+                merged += 1
+        finally:
+            executor.shutdown(wait=False, cancel_futures=True)
+
+        for chunk in chunks[merged:]:
+            for slide_data in chunk:
+                writer.flush_slide(self._add_content_slide(prs, slide_data))
+
+    def _output_path(self, state: PPTState, outline: PPTOutline) -> str:
+        """输出文件路径：优先使用 state 中指定的路径，否则按标题保存到输出目录"""
+        file_path = state.get("output_path")
+        if not file_path:
+            safe_title = "".join([c for c in outline.title if c.isalnum() or c in (' ', '_')]).rstrip()
+            filename = f"{safe_title or 'presentation'}.pptx"
+            file_path = os.path.join(self.output_dir, filename)
         return file_path
 
     def _add_title_slide(self, prs, title_text: str, cover_image: str = None):
         logger.info(f"Adding title slide with title: '{title_text}'")
 
-        layout = prs.slide_layouts[LayoutManager.get_layout_index("title_slide")]
-        slide = prs.slides.add_slide(layout)
-        logger.debug(f"Title slide created with layout index: {LayoutManager.get_layout_index('title_slide')}")
+        layout_idx = self._template.layout_index("title_slide")
+        slide = prs.slides.add_slide(prs.slide_layouts[layout_idx])
+        logger.debug(f"Title slide created with layout index: {layout_idx}")
 
         # 设置标题
-        title_ph = LayoutManager.get_placeholder(slide, 'title')
+        title_ph = self._template.get_placeholder(slide, layout_idx, 'title')
         if title_ph:
             title_ph.text = title_text
             logger.debug(f"Title text set: '{title_text}'")
@@ -96,65 +223,118 @@ class PPTGenerator:
             logger.info(f"Adding cover image to title slide: {cover_image}")
             # 标题页直接使用fallback方法添加图片，因为layout 0通常没有图片占位符
             self._add_image_force(slide, cover_image)
+        return slide
 
     def _add_content_slide(self, prs, data: SlideContent):
-        layout_idx = LayoutManager.get_layout_index(data.layout_type)
-        layout = prs.slide_layouts[layout_idx]
-        slide = prs.slides.add_slide(layout)
+        layout_idx = self._template.layout_index(data.layout_type)
+        slide = prs.slides.add_slide(prs.slide_layouts[layout_idx])
 
-        logger.debug(f"Content slide layout: {layout.name} (index: {layout_idx})")
-        logger.debug(f"Available placeholders: {[ph.placeholder_format.type for ph in slide.placeholders]}")
+        logger.debug(f"Content slide layout index: {layout_idx}, placeholders: {self._template.placeholders[layout_idx]}")
 
         # 填充标题
-        title_ph = LayoutManager.get_placeholder(slide, 'title')
+        title_ph = self._template.get_placeholder(slide, layout_idx, 'title')
         if title_ph:
             title_ph.text = data.title
         else:
             logger.warning(f"No title placeholder found in layout {layout_idx}")
 
         # 填充正文
-        body_ph = LayoutManager.get_placeholder(slide, 'body')
+        body_ph = self._template.get_placeholder(slide, layout_idx, 'body')
         if body_ph:
             tf = body_ph.text_frame
-            tf.clear() # 清除默认占位符文本
-            for point in data.bullet_points:
-                p = tf.add_paragraph()
+            tf.clear() # 清除默认占位符文本 (保留一个空段落，第一条要点直接写入)
+            for i, point in enumerate(data.bullet_points):
+                p = tf.paragraphs[0] if i == 0 else tf.add_paragraph()
                 p.text = point
                 p.level = 0
+
+            # 要点超出占位符时按估算结果缩小字号
+            max_size, indent = self._template.text_style(layout_idx, 'body')
+            font_size = text_fitter.fit_size(data.bullet_points, self._template.body_box(layout_idx), max_size, indent)
+            if font_size:
+                logger.debug(f"Body text shrunk to {font_size}pt to fit layout {layout_idx}")
+                for p in tf.paragraphs:
+                    for run in p.runs:
+                        run.font.size = Pt(font_size)
         else:
             logger.warning(f"No body placeholder found in layout {layout_idx}")
 
         # 填充图片 (如果有路径或 URL)
         if data.image_path:
             logger.debug(f"Adding image to content slide: {data.image_path}")
-            self._add_image(slide, data.image_path)
+            self._add_image(slide, layout_idx, data.image_path)
         else:
             logger.debug("No image_path for content slide")
-
-    def _add_image(self, slide, image_source: str):
+        return slide
+
+    def _resolve_local_path(self, image_source: str) -> Optional[str]:
+        """将图片来源解析为本地文件路径：远程图片使用预取阶段下载的文件，占位图返回 None"""
+        if is_placeholder_url(image_source):
+            return None
+
+        local_path = image_source
+        if image_source.startswith(('http://', 'https://')):
+            local_path = self._local_images.get(image_source)
+            if not local_path:
+                return None
+
+        return local_path if os.path.exists(local_path) else None
+
+    def _collect_image_boxes(self, prs, slides_data, title_slide_data) -> dict:
+        """收集每张本地图片需要覆盖的最大显示区域 (宽, 高) EMU"""
+        force_box = (self.FORCE_IMAGE_MAX_WIDTH, self.FORCE_IMAGE_MAX_HEIGHT)
+        boxes = {}
+        for slide_data in slides_data:
+            image_source = getattr(slide_data, 'image_path', None)
+            local_path = self._resolve_local_path(image_source) if image_source else None
+            if not local_path:
+                continue
+
+            box = force_box
+            if slide_data is not title_slide_data:
+                box = self._template.picture_box(self._template.layout_index(slide_data.layout_type)) or force_box
+
+            width, height = boxes.get(local_path, (0, 0))
+            boxes[local_path] = (max(width, box[0]), max(height, box[1]))
+        return boxes
+
+    def _persist_remote_images(self):
+        """远程图片的本地副本 (优先归一化后的文件) 按 URL 存入缓存，渲染结束清理临时目录后缩略图仍可读取"""
+        if not normalized_image_cache.enabled:
+            return
+        for url, local_path in self._local_images.items():
+            if not local_path or normalized_image_cache.get(source_image_key(url)):
+                continue
+            path = self._normalized_images.get(local_path, local_path)
+            try:
+                with open(path, 'rb') as f:
+                    normalized_image_cache.put(source_image_key(url), f.read(), os.path.splitext(path)[1])
+            except OSError as e:
+                logger.warning(f"PPT Generator: Failed to keep local copy of {url}: {str(e)}")
+
+    def _load_image(self, image_source: str) -> Optional[BytesIO]:
+        """读取图片字节：优先使用归一化后的文件，远程图片使用预取阶段下载的本地文件，占位图直接跳过"""
+        if is_placeholder_url(image_source):
+            logger.info("Skipping placeholder image insertion")
+            return None
+
+        local_path = self._resolve_local_path(image_source)
+        if not local_path:
+            logger.warning(f"Image source not found or not prefetched: {image_source}")
+            return None
+
+        path = self._normalized_images.get(local_path, local_path)
+        with open(path, 'rb') as f:
+            data = f.read()
+        self._image_files[hashlib.sha1(data).hexdigest()] = path
+        return BytesIO(data)
+
+    def _add_image(self, slide, layout_idx: int, image_source: str):
         """添加图片到幻灯片，支持本地路径或 URL"""
-        pic_ph = LayoutManager.get_placeholder(slide, 'picture')
+        pic_ph = self._template.get_placeholder(slide, layout_idx, 'picture')
 
         try:
-            image_data = None
-            if image_source.startswith(('http://', 'https://')):
-                # 处理远程图片
-                response = requests.get(image_source, timeout=10, stream=True)
-                response.raise_for_status()
-                image_data = BytesIO(response.content)
-
-                # 检查是否是占位图URL，如果是则跳过
-                if 'placehold.co' in image_source or 'placeholder.com' in image_source:
-                    logger.info("Skipping placeholder image insertion")
-                    return
-            elif os.path.exists(image_source):
-                # 处理本地图片
-                with open(image_source, 'rb') as f:
-                    image_data = BytesIO(f.read())
-            else:
-                logger.warning(f"Image source not found: {image_source}")
-                return
-
+            image_data = self._load_image(image_source)
             if not image_data:
                 return
 
@@ -174,21 +354,27 @@ class PPTGenerator:
             logger.error(f"Failed to add image to slide: {str(e)}")
             logger.debug(f"Image source: {image_source}")
 
+    @staticmethod
+    def force_image_rect(template, img_width: int, img_height: int) -> Tuple[int, int, int, int]:
+        """非占位符图片的位置与显示尺寸 (left, top, width, height) EMU：保持宽高比，最大 8cm x 6cm，居中偏右"""
+        max_width = PPTGenerator.FORCE_IMAGE_MAX_WIDTH
+        max_height = PPTGenerator.FORCE_IMAGE_MAX_HEIGHT
+        ratio = min(max_width / Cm(2.54 * img_width / 96), max_height / Cm(2.54 * img_height / 96))
+        display_width = int(Cm(2.54 * img_width / 96) * ratio)
+        display_height = int(Cm(2.54 * img_height / 96) * ratio)
+
+        left = (template.slide_width - display_width) // 2 + Cm(2)
+        top = (template.slide_height - display_height) // 2
+        return left, top, display_width, display_height
+
     def _add_image_force(self, slide, image_data_or_source: str):
         """强制添加图片到slide，使用fallback方法，不尝试占位符"""
         try:
             # 处理输入参数
             if isinstance(image_data_or_source, str):
                 # 如果是字符串，当作URL或文件路径处理
-                if image_data_or_source.startswith(('http://', 'https://')):
-                    response = requests.get(image_data_or_source, timeout=10, stream=True)
-                    response.raise_for_status()
-                    image_data = BytesIO(response.content)
-                elif os.path.exists(image_data_or_source):
-                    with open(image_data_or_source, 'rb') as f:
-                        image_data = BytesIO(f.read())
-                else:
-                    logger.warning(f"Image source not found: {image_data_or_source}")
+                image_data = self._load_image(image_data_or_source)
+                if not image_data:
                     return
             else:
                 # 假设已经是BytesIO对象
@@ -197,18 +383,7 @@ class PPTGenerator:
             # 获取图片尺寸
             image_data.seek(0)
             img = Image.open(image_data)
-            img_width, img_height = img.size
-
-            # 计算合适的显示尺寸 (保持宽高比，最大宽度8cm，最大高度6cm)
-            max_width = Cm(8)
-            max_height = Cm(6)
-            ratio = min(max_width / Cm(2.54 * img_width / 96), max_height / Cm(2.54 * img_height / 96))
-            display_width = int(Cm(2.54 * img_width / 96) * ratio)
-            display_height = int(Cm(2.54 * img_height / 96) * ratio)
-
-            # 图片位置 (居中偏右)
-            left = (slide.slide_width - display_width) // 2 + Cm(2)
-            top = (slide.slide_height - display_height) // 2
+            left, top, display_width, display_height = self.force_image_rect(self._template, *img.size)
 
             # 重新读取图片数据
             image_data.seek(0)
@@ -218,6 +393,19 @@ class PPTGenerator:
         except Exception as e:
             logger.error(f"Failed to add image as shape: {str(e)}")
 
+def render_shard(template_path: Optional[str], slides_data, output_dir: str, local_images: dict, normalized_images: dict) -> dict:
+    """
+    在工作进程中渲染一段内容幻灯片 (供 ProcessPoolExecutor 调用，需为模块级函数)
+    :return: export_slides 的导出结果，由主进程合并
+    """
+    generator = PPTGenerator(output_dir)
+    generator._template = LayoutManager.get_template(template_path)
+    generator._local_images = local_images
+    generator._normalized_images = normalized_images
+    prs = generator._template.new_presentation()
+    slides = [generator._add_content_slide(prs, slide_data) for slide_data in slides_data]
+    return export_slides(prs, slides, generator._image_files)
+
 def ppt_generator_node(state: PPTState) -> PPTState:
     """
     PPT 渲染节点：最终生成 .pptx 文件并记录路径
@@ -245,3 +433,21 @@ def ppt_generator_node(state: PPTState) -> PPTState:
             **state,
             "error": f"Error in PPT generator: {str(e)}"
         }
+
+# 渲染 (python-pptx 与 Pillow) 为 CPU 密集的阻塞操作，异步路径中放到独立的小线程池执行，
+# 避免阻塞事件循环，也不占用默认线程池
+_render_executor = None
+
+def _get_render_executor() -> ThreadPoolExecutor:
+    global _render_executor
+    if _render_executor is None:
+        _render_executor = ThreadPoolExecutor(
+            max_workers=int(os.getenv("RENDER_WORKERS", "2")),
+            thread_name_prefix="ppt-render"
+        )
+    return _render_executor
+
+async def appt_generator_node(state: PPTState) -> PPTState:
+    """PPT 渲染节点的异步版本 (Web UI 使用)"""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_get_render_executor(), ppt_generator_node, state)
@@ -0,0 +1,210 @@
+import os
+import re
+import tempfile
+import zipfile
+from typing import Dict, Optional, Set
+from pptx.opc.constants import CONTENT_TYPE as CT, RELATIONSHIP_TYPE as RT
+from pptx.parts.image import Image, ImagePart
+from pptx.parts.slide import SlidePart
+from pptx.opc.package import Part
+from pptx.opc.packuri import CONTENT_TYPES_URI, PACKAGE_URI, PackURI
+from pptx.opc.oxml import serialize_part_xml
+from pptx.opc.serialized import _ContentTypesItem
+from pptx.oxml.slide import CT_Slide
+from src.utils.logger import logger
+
+# 幻灯片 XML 中的关系引用 (r:embed="rId2"、r:id="rId3" 等)
+_RID_PATTERN = re.compile(rb'="(rId\d+)"')
+
+def export_slides(prs, slides, image_files: Optional[Dict[str, str]] = None) -> Dict:
+    """
+    导出幻灯片供其他进程合并 (分片渲染的工作进程使用)：
+    - slides: 每张幻灯片的 XML 与关系列表 (rId, 关系类型, 目标种类, 目标)，
+      目标为版式索引、media 中的序号或外部链接
+    - media: 分片内去重后的图片 (sha1, 内容类型, 扩展名, 源文件路径, 字节)，
+      图片在磁盘上有源文件 (image_files: sha1 -> 路径) 时只传路径，字节为空
+    """
+    image_files = image_files or {}
+    layout_indices = {layout.part.partname: i for i, layout in enumerate(prs.slide_layouts)}
+    media, media_indices, exported = [], {}, []
+    for slide in slides:
+        part = slide.part
+        rels = []
+        for rId, rel in part.rels.items():
+            if rel.is_external:
+                rels.append((rId, rel.reltype, "external", rel.target_ref))
+            elif rel.reltype == RT.SLIDE_LAYOUT:
+                rels.append((rId, rel.reltype, "layout", layout_indices[rel.target_part.partname]))
+            elif isinstance(rel.target_part, ImagePart):
+                image = rel.target_part
+                if image.partname not in media_indices:
+                    media_indices[image.partname] = len(media)
+                    path = image_files.get(image.sha1)
+                    media.append((image.sha1, image.content_type, image.partname.ext, path, None if path else image.blob))
+                rels.append((rId, rel.reltype, "image", media_indices[image.partname]))
+            else:
+                raise ValueError(f"Unsupported slide relationship for merging: {rel.reltype}")
+        exported.append((serialize_part_xml(part._element), rels))
+    return {"slides": exported, "media": media}
+
+class _FlushedImagePart(ImagePart):
+    """
+    已写入压缩包的图片部件：不持有图片字节，只保留去重用的 sha1 与磁盘上的源文件路径；
+    尺寸只在后续幻灯片复用同一图片 (占位符裁剪) 时需要，按需从源文件读取
+    """
+
+    @property
+    def _dpi(self):
+        return self._flushed_image.dpi
+
+    @property
+    def _px_size(self):
+        return self._flushed_image.size
+
+    @property
+    def _flushed_image(self) -> Image:
+        if self._image_info is None:
+            self._image_info = Image.from_file(self._source_path)
+        return self._image_info
+
+class StreamingPptxWriter:
+    """
+    流式 .pptx 导出：每完成一张幻灯片就把它的 XML 与新引用的图片写入压缩包，随后释放图片字节与幻灯片 XML 树，
+    峰值内存只与单张幻灯片相关，而不是整份演示文稿 (prs.save 会在保存时才写出全部部件)。
+
+    图片已是压缩格式 (JPEG/PNG)，以 ZIP_STORED 写入；在磁盘上有源文件 (预取/归一化后的本地文件) 的图片
+    直接从文件分块复制到压缩包，部件只保留路径与 sha1。XML 使用 deflate 压缩。
+    先写入同目录的临时文件，close 成功后再替换为目标文件。
+    """
+
+    def __init__(self, file_path: str, image_files: Optional[Dict[str, str]] = None):
+        """
+        :param image_files: 图片 sha1 -> 磁盘上内容相同的文件，渲染过程中由调用方继续填充
+        """
+        self.file_path = file_path
+        self.image_files = image_files if image_files is not None else {}
+        fd, self._tmp_path = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(file_path)), suffix=".tmp")
+        os.close(fd)
+        self._zip = zipfile.ZipFile(self._tmp_path, "w", compression=zipfile.ZIP_DEFLATED, allowZip64=True)
+        self._written: Set[str] = set()
+        self.media_bytes = 0
+        # 合并导出的幻灯片时使用：sha1 -> 演示文稿中的图片部件，以及下一个图片部件编号
+        self._media: Optional[Dict[str, ImagePart]] = None
+        self._next_image = 1
+
+    def _write(self, partname, data, compress_type=zipfile.ZIP_DEFLATED):
+        self._zip.writestr(partname.membername, data, compress_type=compress_type)
+        self._written.add(str(partname))
+
+    def _write_part_rels(self, part: Part):
+        if part._rels:
+            self._zip.writestr(part.partname.rels_uri.membername, part.rels.xml)
+
+    def _flush_image(self, part: ImagePart):
+        if str(part.partname) in self._written:
+            return
+        # 释放前缓存 sha1 (lazyproperty)，后续幻灯片引用同一图片时仍可去重
+        sha1 = part.sha1
+        path = getattr(part, "_source_path", None) or self.image_files.get(sha1)
+        if path and os.path.isfile(path):
+            self._zip.write(path, part.partname.membername, compress_type=zipfile.ZIP_STORED)
+            self._written.add(str(part.partname))
+            self.media_bytes += os.path.getsize(path)
+            image_info = None
+        else:
+            # 没有源文件 (如模板自带的图片)：写入内存中的字节，并在释放前记录尺寸
+            image_info = Image.from_blob(part._blob)
+            self._write(part.partname, memoryview(part._blob), compress_type=zipfile.ZIP_STORED)
+            self.media_bytes += len(part._blob)
+            path = None
+        part._blob = b""
+        part._source_path = path
+        part._image_info = image_info
+        part.__class__ = _FlushedImagePart
+
+    def flush_slide(self, slide):
+        """写出已完成的幻灯片及其引用的图片，并释放它们占用的内存"""
+        part = slide.part
+        for rel in part.rels.values():
+            if not rel.is_external and isinstance(rel.target_part, ImagePart):
+                self._flush_image(rel.target_part)
+        self._write(part.partname, serialize_part_xml(part._element))
+        self._write_part_rels(part)
+        # 用空白幻灯片元素替换已写出的 XML 树，并清除 lazyproperty 缓存的 Slide 对象
+        part._element = CT_Slide.new()
+        part.__dict__.pop("slide", None)
+
+    def merge_slides(self, prs, exported: Dict):
+        """
+        把 export_slides 导出的幻灯片追加到演示文稿末尾：XML 不经解析直接写入压缩包，
+        只在演示文稿中登记幻灯片部件与关系；图片按 sha1 与已有图片去重
+        """
+        package = prs.part.package
+        if self._media is None:
+            images = [p for p in package.iter_parts() if isinstance(p, ImagePart)]
+            self._media = {p.sha1: p for p in images}
+            self._next_image = max((p.partname.idx or 0 for p in images), default=0) + 1
+
+        media = []
+        for sha1, content_type, ext, path, blob in exported["media"]:
+            part = self._media.get(sha1)
+            if part is None:
+                # 有源文件的图片不读入内存，写出时从文件复制
+                part = ImagePart(PackURI(f"/ppt/media/image{self._next_image}.{ext}"), content_type, package, blob or b"")
+                part.__dict__["sha1"] = sha1
+                part._source_path = path
+                self._next_image += 1
+                self._media[sha1] = part
+            media.append(part)
+
+        layouts = prs.slide_layouts
+        for xml, rels in exported["slides"]:
+            slide_part = SlidePart(prs.part._next_slide_partname, CT.PML_SLIDE, package, CT_Slide.new())
+            # 按原顺序建立关系，新 rId 通常与导出时一致，不一致时改写 XML 中的引用
+            mapping = {}
+            for rId, reltype, kind, target in sorted(rels, key=lambda r: int(r[0][3:])):
+                if kind == "external":
+                    mapping[rId] = slide_part.relate_to(target, reltype, is_external=True)
+                elif kind == "layout":
+                    mapping[rId] = slide_part.relate_to(layouts[target].part, reltype)
+                else:
+                    self._flush_image(media[target])
+                    mapping[rId] = slide_part.relate_to(media[target], reltype)
+            if any(old != new for old, new in mapping.items()):
+                xml = _RID_PATTERN.sub(
+                    lambda m: b'="' + mapping.get(m.group(1).decode(), m.group(1).decode()).encode() + b'"', xml
+                )
+            self._write(slide_part.partname, xml)
+            self._write_part_rels(slide_part)
+            prs.slides._sldIdLst.add_sldId(prs.part.relate_to(slide_part, RT.SLIDE))
+
+    def close(self, prs):
+        """写出其余部件 (演示文稿、版式、母版、主题等)、关系与内容类型，完成文件"""
+        package = prs.part.package
+        try:
+            parts = tuple(package.iter_parts())
+            for part in parts:
+                if str(part.partname) in self._written:
+                    continue
+                if isinstance(part, ImagePart):
+                    self._flush_image(part)
+                else:
+                    self._write(part.partname, part.blob)
+                    self._write_part_rels(part)
+            self._zip.writestr(PACKAGE_URI.rels_uri.membername, package._rels.xml)
+            self._zip.writestr(CONTENT_TYPES_URI.membername, serialize_part_xml(_ContentTypesItem.xml_for(parts)))
+            self._zip.close()
+            os.replace(self._tmp_path, self.file_path)
+            logger.info(f"StreamingPptxWriter: Wrote {len(parts)} parts ({self.media_bytes // 1024} KB media) to {self.file_path}")
+        except Exception:
+            self.abort()
+            raise
+
+    def abort(self):
+        """放弃写入并删除临时文件"""
+        try:
+            self._zip.close()
+        except Exception:
+            pass
+        if os.path.exists(self._tmp_path):
+            os.remove(self._tmp_path)
@@ -1,15 +1,34 @@
 import os
+import threading
 
-def read_prompt(prompt_name: str) -> str:
-    """
-    从 src/prompts/ 目录下读取指定的 prompt 文本文件
-    """
+# prompt 名称 -> (文件 mtime, 内容)，文件修改后自动重新读取
+_prompt_cache = {}
+_lock = threading.Lock()
+
+def _prompt_path(prompt_name: str) -> str:
     current_dir = os.path.dirname(os.path.abspath(__file__))
     project_root = os.path.dirname(current_dir)
-    prompt_path = os.path.join(project_root, "prompts", f"{prompt_name}.txt")
-    
+    return os.path.join(project_root, "prompts", f"{prompt_name}.txt")
+
+def get_prompt_mtime(prompt_name: str) -> float:
+    """返回 prompt 文件的修改时间，用于判断是否需要重新加载"""
+    prompt_path = _prompt_path(prompt_name)
     if not os.path.exists(prompt_path):
         raise FileNotFoundError(f"Prompt file not found: {prompt_path}")
-        
-    with open(prompt_path, "r", encoding="utf-8") as f:
-        return f.read().strip()
+    return os.stat(prompt_path).st_mtime_ns
+
+def read_prompt(prompt_name: str) -> str:
+    """
+    从 src/prompts/ 目录下读取指定的 prompt 文本文件
+    内容按文件 mtime 缓存，仅在文件被修改后重新读取
+    """
+    mtime = get_prompt_mtime(prompt_name)
+    cached = _prompt_cache.get(prompt_name)
+    if cached and cached[0] == mtime:
+        return cached[1]
+
+    with open(_prompt_path(prompt_name), "r", encoding="utf-8") as f:
+        content = f.read().strip()
+    with _lock:
+        _prompt_cache[prompt_name] = (mtime, content)
+    return content
@@ -0,0 +1,156 @@
+import hashlib
+import json
+import os
+import shutil
+import sqlite3
+import threading
+import time
+from typing import Iterable, Optional
+from src.utils.image_cache import ImageCache
+from src.utils.logger import logger
+
+# 渲染逻辑变化导致同样的输入产出不同文件时递增，使旧的整体缓存失效
+RENDER_CACHE_VERSION = "2"
+
+# DashScope 等服务返回的图片链接有效期有限，远程 URL 只在该时间内复用
+REMOTE_IMAGE_TTL = 12 * 3600
+
+class RenderCache:
+    """
+    增量渲染缓存 (SQLite，Web UI 与任务队列工作进程共享)：
+    - 幻灯片哈希 -> 配图结果：内容未变化的幻灯片重新渲染时直接复用上次的配图
+    - 整体哈希 -> 已渲染的 .pptx：内容完全相同的渲染直接返回已有文件
+    幻灯片哈希由标题、要点、版式与图片来源 (image_path / image_query) 计算，与字段顺序无关。
+    """
+
+    def __init__(self, path: Optional[str] = None):
+        self.enabled = os.getenv("RENDER_CACHE_ENABLED", "true").lower() == "true"
+        self.path = path or os.getenv("RENDER_CACHE_PATH", "data/render_cache.sqlite")
+        self.max_entries = int(os.getenv("RENDER_CACHE_MAX_ENTRIES", "10000"))
+        self._conn = None
+        self._lock = threading.Lock()
+        self._puts = 0
+
+    @property
+    def conn(self) -> sqlite3.Connection:
+        # 延迟创建，避免未使用缓存时创建数据库文件
+        if self._conn is None:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            self._conn = sqlite3.connect(self.path, check_same_thread=False, timeout=30, isolation_level=None)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.executescript(
+                "CREATE TABLE IF NOT EXISTS slide_images (hash TEXT PRIMARY KEY, image_path TEXT NOT NULL, created_at REAL NOT NULL);"
+                "CREATE TABLE IF NOT EXISTS decks (hash TEXT PRIMARY KEY, file_path TEXT NOT NULL, size INTEGER NOT NULL, "
+                "mtime REAL NOT NULL, created_at REAL NOT NULL);"
+            )
+        return self._conn
+
+    @staticmethod
+    def slide_hash(slide) -> str:
+        """幻灯片内容的稳定哈希"""
+        raw = json.dumps({
+            "title": slide.title,
+            "bullet_points": list(slide.bullet_points),
+            "layout_type": slide.layout_type,
+            "image_query": slide.image_query,
+            "image_path": slide.image_path
+        }, ensure_ascii=False, sort_keys=True)
+        return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+    @staticmethod
+    def deck_hash(outline, slides: Iterable, template_digest: str, settings: Iterable = ()) -> str:
+        """整份演示文稿的哈希：大纲、每页的幻灯片哈希、模板内容与影响输出的渲染参数"""
+        raw = json.dumps({
+            "version": RENDER_CACHE_VERSION,
+            "title": outline.title,
+            "chapters": list(outline.chapters),
+            "slides": [RenderCache.slide_hash(s) for s in slides],
+            "template": template_digest,
+            "settings": list(settings)
+        }, ensure_ascii=False, sort_keys=True)
+        return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+    def get_image(self, slide_hash: str) -> Optional[str]:
+        """查询幻灯片上次的配图，本地文件已删除或远程链接可能过期时返回 None"""
+        if not self.enabled:
+            return None
+        with self._lock:
+            row = self.conn.execute("SELECT image_path, created_at FROM slide_images WHERE hash = ?", (slide_hash,)).fetchone()
+        if not row:
+            return None
+        image_path, created_at = row
+        if image_path.startswith(("http://", "https://")):
+            return image_path if time.time() - created_at < REMOTE_IMAGE_TTL else None
+        return image_path if os.path.exists(image_path) else None
+
+    def put_image(self, slide_hash: str, image_path: str):
+        if not self.enabled:
+            return
+        with self._lock:
+            self.conn.execute("INSERT OR REPLACE INTO slide_images VALUES (?, ?, ?)", (slide_hash, image_path, time.time()))
+            self._after_put()
+
+    def get_deck(self, deck_hash: str) -> Optional[str]:
+        """查询已渲染的文件，文件被删除或被其他渲染覆盖 (大小/修改时间不一致) 时返回 None"""
+        if not self.enabled:
+            return None
+        with self._lock:
+            row = self.conn.execute("SELECT file_path, size, mtime FROM decks WHERE hash = ?", (deck_hash,)).fetchone()
+        if not row:
+            return None
+        file_path, size, mtime = row
+        try:
+            st = os.stat(file_path)
+        except OSError:
+            return None
+        return file_path if st.st_size == size and st.st_mtime == mtime else None
+
+    def put_deck(self, deck_hash: str, file_path: str):
+        if not self.enabled:
+            return
+        st = os.stat(file_path)
+        with self._lock:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO decks VALUES (?, ?, ?, ?, ?)",
+                (deck_hash, file_path, st.st_size, st.st_mtime, time.time())
+            )
+            self._after_put()
+
+    def reuse_deck(self, deck_hash: str, file_path: str) -> bool:
+        """整体缓存命中时把已有文件放到 file_path (路径不同时复制)，返回是否命中"""
+        cached = self.get_deck(deck_hash)
+        if not cached:
+            return False
+        if os.path.abspath(cached) != os.path.abspath(file_path):
+            shutil.copyfile(cached, file_path)
+            self.put_deck(deck_hash, file_path)
+        logger.info(f"RenderCache: Deck {deck_hash[:12]} unchanged, reusing {cached}")
+        return True
+
+    def _after_put(self):
+        # 每 100 次写入清理一次超出上限的最旧条目
+        self._puts += 1
+        if self._puts % 100 or self.max_entries <= 0:
+            return
+        for table in ("slide_images", "decks"):
+            self.conn.execute(
+                f"DELETE FROM {table} WHERE hash IN "
+                f"(SELECT hash FROM {table} ORDER BY created_at DESC LIMIT -1 OFFSET ?)", (self.max_entries,)
+            )
+
+# 全局实例
+render_cache = RenderCache()
+
+def source_image_key(url: str) -> str:
+    """远程图片本地副本在 normalized_image_cache 中的键"""
+    return hashlib.sha256(f"source:{url}".encode("utf-8")).hexdigest()
+
+# 归一化后的图片缓存：按 (源图片内容, 目标区域, DPI, 质量) 存储，未变化的图片不再重新缩放；
+# 远程图片另按 URL (source_image_key) 保存一份本地副本，预取的临时目录清理后缩略图仍可读取
+normalized_image_cache = ImageCache(
+    cache_dir=os.path.join(os.getenv("RENDER_CACHE_DIR", "data/render_cache"), "normalized"),
+    max_bytes=int(float(os.getenv("RENDER_CACHE_MAX_MB", "512")) * 1024 * 1024),
+    enabled=render_cache.enabled
+)
@@ -0,0 +1,222 @@
+import asyncio
+import os
+import random
+import threading
+import time
+from email.utils import parsedate_to_datetime
+from typing import Awaitable, Callable, Dict, Optional, Tuple, TypeVar
+import httpx
+import openai
+import requests
+from langchain_core.runnables import RunnableConfig, RunnableLambda
+from src.utils.logger import logger
+
+T = TypeVar("T")
+
+# 可重试的 HTTP 状态码：超时、限流与服务端临时错误
+RETRYABLE_STATUS_CODES = {408, 425, 429, 500, 502, 503, 504}
+
+class OutboundError(Exception):
+    """外部服务返回的非成功响应 (用于不抛 HTTP 异常的 SDK，如 DashScope)"""
+
+    def __init__(self, status_code: Optional[int], message: str = "", retry_after: Optional[float] = None):
+        super().__init__(f"HTTP {status_code}: {message}")
+        self.status_code = status_code
+        self.retry_after = retry_after
+
+class CircuitOpenError(Exception):
+    """熔断器处于打开状态，请求被快速拒绝"""
+
+def parse_retry_after(value) -> Optional[float]:
+    """解析 Retry-After 头 (秒数或 HTTP 日期)"""
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except (TypeError, ValueError):
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+def classify_error(error: Exception) -> Tuple[bool, Optional[float]]:
+    """
+    按状态码 (而不是错误信息文本) 对异常分类
+    :return: (是否可重试, Retry-After 秒数)
+    """
+    if isinstance(error, OutboundError):
+        return error.status_code in RETRYABLE_STATUS_CODES, error.retry_after
+
+    # 网络层错误 (连接失败、超时) 均可重试
+    if isinstance(error, (requests.ConnectionError, requests.Timeout, httpx.TransportError, openai.APIConnectionError)):
+        return True, None
+
+    response = getattr(error, "response", None)
+    status_code = getattr(error, "status_code", None) or getattr(response, "status_code", None)
+    if status_code is None:
+        return False, None
+    headers = getattr(response, "headers", None) or {}
+    return status_code in RETRYABLE_STATUS_CODES, parse_retry_after(headers.get("Retry-After"))
+
+class CircuitBreaker:
+    """
+    单个外部端点的熔断器：连续失败达到阈值后打开，打开期间快速失败；
+    冷却时间过后进入半开状态，放行一个探测请求，成功则关闭。
+    """
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(self, name: str, failure_threshold: int, recovery_timeout: float):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.recovery_timeout = recovery_timeout
+        self.state = self.CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self._probing = False
+        self._lock = threading.Lock()
+
+    def allow(self) -> bool:
+        with self._lock:
+            if self.state == self.CLOSED:
+                return True
+            if self.state == self.OPEN and time.monotonic() - self.opened_at >= self.recovery_timeout:
+                self.state = self.HALF_OPEN
+                self._probing = False
+            if self.state == self.HALF_OPEN and not self._probing:
+                self._probing = True
+                logger.info(f"CircuitBreaker: {self.name} half-open, sending probe request")
+                return True
+            return False
+
+    def is_open(self) -> bool:
+        with self._lock:
+            return self.state == self.OPEN
+
+    def record_success(self):
+        with self._lock:
+            if self.state != self.CLOSED:
+                logger.info(f"CircuitBreaker: {self.name} closed")
+            self.state = self.CLOSED
+            self.failures = 0
+            self._probing = False
+
+    def release_probe(self):
+        """结束探测请求但不改变状态 (探测请求因调用方错误失败，无法说明服务是否恢复)，允许下一个请求继续探测"""
+        with self._lock:
+            self._probing = False
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self.state == self.HALF_OPEN or self.failures >= self.failure_threshold:
+                if self.state != self.OPEN:
+                    logger.warning(f"CircuitBreaker: {self.name} opened after {self.failures} failures, failing fast for {self.recovery_timeout:g}s")
+                self.state = self.OPEN
+                self.opened_at = time.monotonic()
+                self._probing = False
+
+class Resilience:
+    """
+    统一的外部调用重试与熔断层：所有出站调用 (LLM、DashScope、Unsplash、Bing、图片下载) 都经由此处。
+
+    - 带抖动的指数退避 (full jitter)，遵守 Retry-After
+    - 按状态码区分可重试错误 (限流、5xx、网络错误) 与不可重试错误 (其他 4xx)
+    - 每个端点一个熔断器，打开期间直接抛出 CircuitOpenError，调用方走本地兜底，不再阻塞等待
+    """
+
+    def __init__(self):
+        self.max_attempts = int(os.getenv("RETRY_MAX_ATTEMPTS", "3"))
+        self.base_delay = float(os.getenv("RETRY_BASE_DELAY", "0.5"))
+        self.max_delay = float(os.getenv("RETRY_MAX_DELAY", "20"))
+        self.failure_threshold = int(os.getenv("BREAKER_FAILURE_THRESHOLD", "5"))
+        self.recovery_timeout = float(os.getenv("BREAKER_RECOVERY_TIMEOUT", "30"))
+        self._breakers: Dict[str, CircuitBreaker] = {}
+        self._lock = threading.Lock()
+
+    def breaker(self, endpoint: str) -> CircuitBreaker:
+        with self._lock:
+            if endpoint not in self._breakers:
+                self._breakers[endpoint] = CircuitBreaker(endpoint, self.failure_threshold, self.recovery_timeout)
+            return self._breakers[endpoint]
+
+    def backoff(self, attempt: int, retry_after: Optional[float] = None) -> float:
+        """第 attempt 次 (从 0 开始) 失败后的等待时间"""
+        delay = random.uniform(0, min(self.max_delay, self.base_delay * (2 ** attempt)))
+        if retry_after is not None:
+            delay = max(delay, retry_after)
+        return delay
+
+    def _before_attempt(self, endpoint: str, breaker: CircuitBreaker):
+        if not breaker.allow():
+            raise CircuitOpenError(f"Circuit open for {endpoint}")
+
+    def _after_failure(self, endpoint: str, breaker: CircuitBreaker, error: Exception, attempt: int, attempts: int) -> float:
+        """记录失败并返回重试前的等待时间；不应重试时重新抛出原异常"""
+        retryable, retry_after = classify_error(error)
+        if not retryable:
+            # 调用方错误 (如参数错误、鉴权失败) 既不说明服务不可用，也不说明服务已恢复，不改变熔断状态
+            breaker.release_probe()
+            raise error
+        breaker.record_failure()
+        if attempt + 1 >= attempts or breaker.is_open():
+            raise error
+
+        delay = self.backoff(attempt, retry_after)
+        if delay > self.max_delay:
+            logger.warning(f"Resilience: {endpoint} asked to retry after {delay:.0f}s, giving up")
+            raise error
+        logger.warning(f"Resilience: {endpoint} failed ({str(error)[:100]}), retrying in {delay:.1f}s (attempt {attempt + 1}/{attempts})")
+        return delay
+
+    def call(self, endpoint: str, fn: Callable[[], T], max_attempts: Optional[int] = None) -> T:
+        """
+        执行一次出站调用，失败时按策略重试
+        :param endpoint: 端点名称，决定使用的熔断器
+        :param fn: 无参调用，失败时抛出异常 (非成功响应应抛出 OutboundError 或 HTTPError)
+        :param max_attempts: 最大尝试次数，默认 RETRY_MAX_ATTEMPTS
+        """
+        breaker = self.breaker(endpoint)
+        attempts = max_attempts or self.max_attempts
+
+        for attempt in range(attempts):
+            self._before_attempt(endpoint, breaker)
+            try:
+                result = fn()
+            except Exception as e:
+                time.sleep(self._after_failure(endpoint, breaker, e, attempt, attempts))
+                continue
+            breaker.record_success()
+            return result
+
+    async def acall(self, endpoint: str, afn: Callable[[], Awaitable[T]], max_attempts: Optional[int] = None) -> T:
+        """call 的异步版本：afn 返回协程，退避期间不占用线程"""
+        breaker = self.breaker(endpoint)
+        attempts = max_attempts or self.max_attempts
+
+        for attempt in range(attempts):
+            self._before_attempt(endpoint, breaker)
+            try:
+                result = await afn()
+            except Exception as e:
+                await asyncio.sleep(self._after_failure(endpoint, breaker, e, attempt, attempts))
+                continue
+            breaker.record_success()
+            return result
+
+    def wrap(self, endpoint: str, runnable):
+        """为 Runnable 添加重试与熔断，返回 Runnable (支持 invoke / batch 及其异步版本)"""
+
+        def invoke(inputs, config: RunnableConfig):
+            return self.call(endpoint, lambda: runnable.invoke(inputs, config=config))
+
+        async def ainvoke(inputs, config: RunnableConfig):
+            return await self.acall(endpoint, lambda: runnable.ainvoke(inputs, config=config))
+
+        return RunnableLambda(invoke, afunc=ainvoke, name=f"{endpoint}_resilient")
+
+# 全局实例
+resilience = Resilience()
@@ -0,0 +1,181 @@
+import hashlib
+import json
+import os
+import threading
+from io import BytesIO
+from typing import Dict, List, Optional, Sequence, Tuple
+from PIL import Image, ImageDraw, ImageOps
+from src.models.state import PPTOutline, SlideContent
+from src.utils.image_cache import ImageCache
+from src.utils.image_prefetcher import is_placeholder_url
+from src.utils.layout_manager import LayoutManager, TemplateProfile
+from src.utils.placeholder_image import PlaceholderImage
+from src.utils.ppt_generator import PPTGenerator
+from src.utils.render_cache import render_cache, normalized_image_cache, source_image_key
+from src.utils.text_fit import text_fitter, EMU_PER_PT, INSET_X, INSET_Y, LINE_SPACING, PARAGRAPH_SPACING
+from src.utils.logger import logger
+
+# 绘制逻辑变化时递增，使旧的缩略图失效
+THUMBNAIL_VERSION = "1"
+
+class SlideThumbnailer:
+    """
+    幻灯片缩略图 (Pillow 绘制，不依赖 LibreOffice)：
+    按模板版式中占位符的位置绘制标题、要点 (与渲染时相同的换行与自动缩放字号) 和图片：
+    远程图片读取渲染时按 URL 保存的本地副本，不重新下载；没有副本时只绘制图片区域。
+    缩略图按 (幻灯片哈希, 模板, 宽度) 缓存为本地 PNG，内容未变化的幻灯片不再重绘。
+    """
+
+    BACKGROUND = (255, 255, 255)
+    TEXT_COLOR = (33, 33, 33)
+    IMAGE_BOX_COLOR = (225, 228, 232)
+    BORDER_COLOR = (200, 200, 200)
+
+    def __init__(self):
+        self.enabled = os.getenv("THUMBNAIL_ENABLED", "true").lower() == "true"
+        self.width = int(os.getenv("THUMBNAIL_WIDTH", "480"))
+        self.cache = ImageCache(
+            cache_dir=os.path.join(os.getenv("RENDER_CACHE_DIR", "data/render_cache"), "thumbnails"),
+            max_bytes=int(float(os.getenv("THUMBNAIL_CACHE_MAX_MB", "128")) * 1024 * 1024),
+            enabled=self.enabled
+        )
+        self._fonts: Dict[int, object] = {}
+        self._lock = threading.Lock()
+
+    def render_deck(self, outline: PPTOutline, slides: Sequence[SlideContent], template_path: Optional[str] = None) -> List[Tuple[str, str]]:
+        """
+        按渲染时的页面顺序生成整份演示文稿的缩略图
+        :return: [(缩略图路径, 说明)]，绘制失败的幻灯片不在结果中
+        """
+        if not self.enabled or not outline:
+            return []
+        template = LayoutManager.get_template(template_path)
+
+        # 与 PPTGenerator 一致：第一页为 title_slide 时作为标题页，否则用大纲标题与第一页的图片生成标题页
+        if slides and slides[0].layout_type == "title_slide":
+            title_slide, content_slides = slides[0], slides[1:]
+        else:
+            cover = slides[0].image_path if slides else None
+            title_slide = SlideContent(title=outline.title, image_path=cover, layout_type="title_slide")
+            content_slides = slides
+
+        results = [(self.render(title_slide, template, is_title=True), f"Slide 1: {title_slide.title}")]
+        for number, slide in enumerate(content_slides, start=2):
+            results.append((self.render(slide, template), f"Slide {number}: {slide.title}"))
+        return [(path, caption) for path, caption in results if path]
+
+    def render(self, slide: SlideContent, template: TemplateProfile, is_title: bool = False) -> Optional[str]:
+        """返回单张幻灯片的缩略图路径 (优先使用缓存)"""
+        image = self._local_image(slide.image_path)
+        # 图片是否可读计入键：先前只绘制了图片区域的缩略图，在图片可用后重新绘制
+        raw = json.dumps([
+            THUMBNAIL_VERSION, is_title, render_cache.slide_hash(slide), template.digest, self.width,
+            text_fitter.settings(), image is not None
+        ])
+        key = hashlib.sha256(raw.encode("utf-8")).hexdigest()
+        path = self.cache.get(key)
+        if path:
+            return path
+
+        try:
+            picture = self._draw(slide, template, is_title, image)
+        except Exception as e:
+            logger.warning(f"SlideThumbnailer: Failed to draw slide '{slide.title}': {str(e)}")
+            return None
+        buffer = BytesIO()
+        picture.save(buffer, "PNG")
+        return self.cache.put(key, buffer.getvalue(), ".png")
+
+    @staticmethod
+    def _local_image(source: Optional[str]) -> Optional[str]:
+        """图片的本地文件：本地路径直接使用，远程图片使用渲染时保存的副本，占位图或无副本时返回 None"""
+        if not source or is_placeholder_url(source):
+            return None
+        if source.startswith(("http://", "https://")):
+            return normalized_image_cache.get(source_image_key(source))
+        return source if os.path.exists(source) else None
+
+    def _font(self, size: int):
+        with self._lock:
+            font = self._fonts.get(size)
+            if font is None:
+                font = PlaceholderImage._load_font(size)
+                self._fonts[size] = font
+            return font
+
+    def _draw(self, slide: SlideContent, template: TemplateProfile, is_title: bool, local_image: Optional[str]) -> Image.Image:
+        scale = self.width / template.slide_width
+        image = Image.new("RGB", (self.width, round(template.slide_height * scale)), self.BACKGROUND)
+        draw = ImageDraw.Draw(image)
+        layout_idx = template.layout_index("title_slide" if is_title else slide.layout_type)
+        geometry = template.geometry[layout_idx]
+
+        if "title" in geometry:
+            self._draw_text(draw, [slide.title], geometry["title"], template.text_style(layout_idx, "title"), scale, center=True)
+
+        if not is_title and "body" in geometry and slide.bullet_points:
+            size, indent = template.text_style(layout_idx, "body")
+            size = text_fitter.fit_size(slide.bullet_points, geometry["body"][2:], size, indent) or size
+            self._draw_text(draw, slide.bullet_points, geometry["body"], (size, indent), scale, bullet=indent > 0)
+
+        # 与渲染一致，图片在文本之后添加 (位于上层)；标题页的封面图与没有图片占位符的版式一样按固定区域放置
+        if slide.image_path and not is_placeholder_url(slide.image_path):
+            self._draw_image(image, draw, local_image, None if is_title else geometry.get("picture"), template, scale)
+
+        draw.rectangle([0, 0, image.width - 1, image.height - 1], outline=self.BORDER_COLOR)
+        return image
+
+    def _draw_image(self, image: Image.Image, draw: ImageDraw.ImageDraw, local_path: Optional[str], rect, template: TemplateProfile, scale: float):
+        """图片占位符内裁剪填满 (与 insert_picture 一致)，否则按渲染时的固定区域缩放；没有本地文件时只绘制区域"""
+        picture = Image.open(local_path) if local_path else None
+        try:
+            if rect is None:
+                # 没有本地文件时尺寸未知，按 4:3 估算
+                size = picture.size if picture else (4, 3)
+                rect = PPTGenerator.force_image_rect(template, *size)
+            left, top, width, height = (round(v * scale) for v in rect)
+            if width <= 0 or height <= 0:
+                return
+            if picture is None:
+                draw.rectangle([left, top, left + width, top + height], fill=self.IMAGE_BOX_COLOR)
+                return
+            picture.draft("RGB", (width, height))
+            picture = ImageOps.fit(picture.convert("RGB"), (width, height))
+            image.paste(picture, (left, top))
+        finally:
+            if picture:
+                picture.close()
+
+    def _draw_text(self, draw: ImageDraw.ImageDraw, paragraphs: Sequence[str], rect, style: Tuple[float, int],
+                   scale: float, center: bool = False, bullet: bool = False):
+        """按占位符位置、字号与缩进绘制文本，换行使用 TextFitter 的估算"""
+        size, indent = style
+        left, top, width, height = rect
+        font_px = max(1, round(size * EMU_PER_PT * scale))
+        font = self._font(font_px)
+        line_width = (width - 2 * INSET_X - indent) / (size * EMU_PER_PT)
+        if line_width <= 0:
+            return
+
+        wrapped = [text_fitter.wrap(text, line_width) for text in paragraphs]
+        y = (top + INSET_Y) * scale
+        if center:
+            # 标题在占位符内垂直居中
+            lines = sum(len(lines) for lines in wrapped)
+            y = top * scale + (height * scale - lines * LINE_SPACING * font_px) / 2
+
+        for i, lines in enumerate(wrapped):
+            if i:
+                y += PARAGRAPH_SPACING * font_px
+            for j, line in enumerate(lines):
+                if center:
+                    x = left * scale + (width * scale - draw.textlength(line, font=font)) / 2
+                else:
+                    x = (left + INSET_X + indent) * scale
+                    if bullet and j == 0:
+                        draw.text(((left + INSET_X) * scale, y), "•", font=font, fill=self.TEXT_COLOR)
+                draw.text((x, y), line, font=font, fill=self.TEXT_COLOR)
+                y += LINE_SPACING * font_px
+
+# 全局实例
+slide_thumbnailer = SlideThumbnailer()
@@ -0,0 +1,113 @@
+import asyncio
+import threading
+import time
+from typing import Dict, Iterable, Optional
+from src.utils.async_image_engine import AsyncImageEngine
+from src.utils.logger import logger
+
+class SpeculativeImageJob:
+    """
+    单个会话的推测生成任务：在后台线程中用 AsyncImageEngine 生成一批 prompt 的图片，
+    结果以 prompt 为键保存，供恢复执行时按 image_query 复用。
+    """
+
+    def __init__(self, prompts: Iterable[str]):
+        self.prompts = list(dict.fromkeys(prompts))
+        self.engine = AsyncImageEngine()
+        self.results: Dict[str, str] = {}
+        self.created_at = time.monotonic()
+        self.done = threading.Event()
+        self.thread = threading.Thread(target=self._run, daemon=True)
+
+    def start(self):
+        self.thread.start()
+        return self
+
+    def _run(self):
+        try:
+            self.engine.run({prompt: prompt for prompt in self.prompts}, on_complete=self.results.__setitem__)
+        except Exception as e:
+            logger.error(f"SpeculativeImages: Background generation failed: {str(e)}")
+        finally:
+            self.done.set()
+
+    def collect(self, prompts: Iterable[str], timeout: Optional[float] = None) -> Dict[str, str]:
+        """
+        取消已不再需要的 prompt，等待其余任务完成，并返回成功生成的结果
+        :return: prompt -> 图片路径或 URL (仅包含成功的结果)
+        """
+        wanted = set(prompts)
+        stale = [prompt for prompt in self.prompts if prompt not in wanted]
+        if stale:
+            logger.info(f"SpeculativeImages: Discarding {len(stale)} jobs whose query was edited")
+            self.engine.cancel(stale)
+        self.done.wait(timeout)
+        return {prompt: self.results[prompt] for prompt in wanted if self.results.get(prompt)}
+
+    async def acollect(self, prompts: Iterable[str], timeout: Optional[float] = None, poll_interval: float = 0.2) -> Dict[str, str]:
+        """collect 的异步版本：以 asyncio.sleep 轮询完成状态，等待期间不占用线程"""
+        wanted = set(prompts)
+        stale = [prompt for prompt in self.prompts if prompt not in wanted]
+        if stale:
+            logger.info(f"SpeculativeImages: Discarding {len(stale)} jobs whose query was edited")
+            self.engine.cancel(stale)
+        deadline = time.monotonic() + timeout if timeout is not None else None
+        while not self.done.is_set() and (deadline is None or time.monotonic() < deadline):
+            await asyncio.sleep(poll_interval)
+        return {prompt: self.results[prompt] for prompt in wanted if self.results.get(prompt)}
+
+class SpeculativeImageRegistry:
+    """
+    推测生成任务登记表：HITL 中断后 (image_advisor 之后) 以 thread_id 登记后台任务，
+    恢复执行时由 visual_agent 取回结果。
+    """
+
+    # 超过该时长未被取回的任务会在下次登记时清理
+    MAX_AGE_SECONDS = 3600
+
+    def __init__(self):
+        self._jobs: Dict[str, SpeculativeImageJob] = {}
+        self._lock = threading.Lock()
+
+    def start(self, thread_id: str, prompts: Iterable[str]):
+        """为会话启动后台生成，替换该会话之前的任务"""
+        job = SpeculativeImageJob(prompts)
+        if not job.prompts:
+            return
+
+        with self._lock:
+            now = time.monotonic()
+            expired = [k for k, j in self._jobs.items() if now - j.created_at > self.MAX_AGE_SECONDS]
+            dropped = [self._jobs.pop(k) for k in expired]
+            previous = self._jobs.get(thread_id)
+            self._jobs[thread_id] = job
+
+        if previous:
+            dropped.append(previous)
+        for old_job in dropped:
+            old_job.engine.cancel(old_job.prompts)
+        logger.info(f"SpeculativeImages: Started background generation of {len(job.prompts)} images for session {thread_id}")
+        job.start()
+
+    def collect(self, thread_id: Optional[str], prompts: Iterable[str], timeout: Optional[float] = None) -> Dict[str, str]:
+        """取回会话的推测结果 (仅限 prompts 中的部分)，并移除登记"""
+        if not thread_id:
+            return {}
+        with self._lock:
+            job = self._jobs.pop(thread_id, None)
+        if not job:
+            return {}
+        return job.collect(prompts, timeout)
+
+    async def acollect(self, thread_id: Optional[str], prompts: Iterable[str], timeout: Optional[float] = None) -> Dict[str, str]:
+        """collect 的异步版本"""
+        if not thread_id:
+            return {}
+        with self._lock:
+            job = self._jobs.pop(thread_id, None)
+        if not job:
+            return {}
+        return await job.acollect(prompts, timeout)
+
+# 全局登记表
+speculative_images = SpeculativeImageRegistry()
@@ -0,0 +1,176 @@
+import os
+import threading
+from typing import Dict, List, Optional, Sequence, Tuple
+import numpy as np
+from PIL import ImageFont
+from src.utils.logger import logger
+
+# 1 磅 = 12700 EMU
+EMU_PER_PT = 12700
+
+# 文本框默认内边距 (左右 0.1 英寸，上下 0.05 英寸)
+INSET_X = 91440
+INSET_Y = 45720
+
+# 行高与段前间距 (相对字号)，与默认模板的单倍行距、段前 20% 一致
+LINE_SPACING = 1.2
+PARAGRAPH_SPACING = 0.2
+
+# 全角字符 (中日韩文字、全角标点等) 按 1 个字宽计算，不需要字体中存在对应字形
+_FULL_WIDTH_RANGES = [
+    (0x1100, 0x115F), (0x2E80, 0x303E), (0x3041, 0x33FF), (0x3400, 0x4DBF), (0x4E00, 0x9FFF),
+    (0xA000, 0xA4CF), (0xAC00, 0xD7A3), (0xF900, 0xFAFF), (0xFE30, 0xFE4F), (0xFF00, 0xFF60), (0xFFE0, 0xFFE6)
+]
+
+# 逐字测量宽度的区间：拉丁、希腊、西里尔字母与常用标点
+_MEASURED_RANGES = [(0x20, 0x24F), (0x370, 0x4FF), (0x2000, 0x206F)]
+
+# 未找到可用字体时的近似字宽 (相对字号)
+_FALLBACK_WIDTHS = {"narrow": 0.28, "lower": 0.5, "upper": 0.65, "digit": 0.55, "space": 0.28, "other": 0.55}
+_NARROW_CHARS = "iljtfrI.,:;'!|()[]"
+
+# 默认测量字体 (按顺序尝试，Pillow 会在系统字体目录中查找)
+_DEFAULT_FONTS = ["arial.ttf", "Arial.ttf", "LiberationSans-Regular.ttf", "DejaVuSans.ttf"]
+
+class TextFitter:
+    """
+    正文自动缩放：估算要点文本在占位符中的换行与总高度，二分查找能完整放下的最大字号。
+
+    - 字宽表：每种字体每个进程只测量一次，存为按码位索引的 numpy 数组 (单位为字号的倍数)，
+      与字号无关，任意字号下的宽度只需乘以字号
+    - 换行估算：每段文本一次性查表得到字宽前缀和与可断行位置，
+      每个候选字号只需对每行做一次 searchsorted，整页估算在亚毫秒级
+    - 模板默认字号能放下时不改动字号，保留模板样式
+    """
+
+    _tables: Dict[str, np.ndarray] = {}
+    _lock = threading.Lock()
+
+    def __init__(self):
+        self.enabled = os.getenv("TEXT_AUTOFIT_ENABLED", "true").lower() == "true"
+        self.font = os.getenv("TEXT_FIT_FONT", "")
+        self.min_size = float(os.getenv("TEXT_FIT_MIN_PT", "12"))
+
+    @property
+    def table(self) -> np.ndarray:
+        with TextFitter._lock:
+            table = TextFitter._tables.get(self.font)
+            if table is None:
+                table = TextFitter._build_table(self.font)
+                TextFitter._tables[self.font] = table
+            return table
+
+    def settings(self) -> Tuple:
+        """影响渲染结果的参数 (计入整体渲染缓存的哈希)"""
+        return (self.enabled, self.font, self.min_size)
+
+    @staticmethod
+    def _load_font(font: str) -> Optional[ImageFont.FreeTypeFont]:
+        for name in ([font] if font else _DEFAULT_FONTS):
+            try:
+                return ImageFont.truetype(name, 1000)
+            except OSError:
+                continue
+        if font:
+            logger.warning(f"TextFitter: Font {font} not found, using approximate glyph widths")
+        return None
+
+    @staticmethod
+    def _build_table(font: str) -> np.ndarray:
+        """构建字宽表：全角字符为 1，常用字母与标点逐字测量，其余字符使用小写字母的平均宽度"""
+        loaded = TextFitter._load_font(font)
+        table = np.empty(0x10000, dtype=np.float32)
+
+        if loaded is not None:
+            measure = lambda ch: loaded.getlength(ch) / 1000
+            table.fill(np.mean([measure(ch) for ch in "abcdefghijklmnopqrstuvwxyz"]))
+            for start, end in _MEASURED_RANGES:
+                table[start:end + 1] = [measure(chr(code)) for code in range(start, end + 1)]
+        else:
+            table.fill(_FALLBACK_WIDTHS["other"])
+            for code in range(0x20, 0x7F):
+                ch = chr(code)
+                kind = "narrow" if ch in _NARROW_CHARS else "space" if ch == " " else \
+                    "lower" if ch.islower() else "upper" if ch.isupper() else "digit" if ch.isdigit() else "other"
+                table[code] = _FALLBACK_WIDTHS[kind]
+
+        for start, end in _FULL_WIDTH_RANGES:
+            table[start:end + 1] = 1.0
+        table[:0x20] = 0
+        logger.info(f"TextFitter: Built glyph width table ({getattr(loaded, 'path', None) or 'approximate'})")
+        return table
+
+    def _prepare(self, text: str) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        预处理一段文本：
+        - 字宽前缀和 cum[i] 为前 i 个字符的总宽度 (字号倍数)
+        - last_break[i] 为不超过 i 的最后一个可断行位置 (空格之后、全角字符前后)
+        """
+        codes = np.frombuffer(text.encode("utf-32-le"), dtype=np.uint32)
+        widths = self.table[np.minimum(codes, 0xFFFF)]
+        cum = np.concatenate(([0.0], np.cumsum(widths, dtype=np.float64)))
+
+        full_width = widths >= 1.0
+        breakable = np.zeros(len(codes) + 1, dtype=bool)
+        breakable[1:] = (codes == 0x20) | full_width
+        breakable[:-1] |= full_width
+        positions = np.where(breakable, np.arange(len(codes) + 1), 0)
+        return cum, np.maximum.accumulate(positions)
+
+    @staticmethod
+    def _line_starts(cum: np.ndarray, last_break: np.ndarray, line_width: float) -> List[int]:
+        """按可用行宽 (字号倍数) 贪心换行，返回每行起始字符位置；单词超过行宽时在行内强制断开"""
+        total = len(cum) - 1
+        starts = [0]
+        while cum[total] - cum[starts[-1]] > line_width:
+            start = starts[-1]
+            end = int(np.searchsorted(cum, cum[start] + line_width, side="right")) - 1
+            brk = int(last_break[end])
+            starts.append(brk if brk > start else max(end, start + 1))
+        return starts
+
+    def wrap(self, text: str, line_width: float) -> List[str]:
+        """按可用行宽 (字号倍数) 折行，换行位置与 fit_size 的估算一致"""
+        starts = self._line_starts(*self._prepare(text), line_width)
+        return [text[a:b].strip() for a, b in zip(starts, starts[1:] + [len(text)])]
+
+    def _fits(self, prepared: List, box: Tuple[int, int], indent: int, size: float) -> bool:
+        size_emu = size * EMU_PER_PT
+        line_width = (box[0] - 2 * INSET_X - indent) / size_emu
+        if line_width <= 0:
+            return False
+        lines = sum(len(self._line_starts(cum, last_break, line_width)) for cum, last_break in prepared)
+        height = lines * LINE_SPACING * size_emu + max(len(prepared) - 1, 0) * PARAGRAPH_SPACING * size_emu
+        return height <= box[1] - 2 * INSET_Y
+
+    def fit_size(self, paragraphs: Sequence[str], box: Optional[Tuple[int, int]], max_size: float, indent: int = 0) -> Optional[float]:
+        """
+        计算能放下全部段落的最大字号 (整磅)
+        :param box: 占位符尺寸 (宽, 高) EMU
+        :param max_size: 模板默认字号 (磅)
+        :param indent: 段落左缩进 (EMU)
+        :return: 需要缩小时返回新字号，默认字号能放下 (或未启用、无法估算) 时返回 None
+        """
+        if not self.enabled or not box or not paragraphs:
+            return None
+        prepared = [self._prepare(text) for text in paragraphs]
+        if self._fits(prepared, box, indent, max_size):
+            return None
+
+        # 模板默认字号不大于最小字号时无法缩小，保留默认字号 (不放大)
+        if self.min_size >= max_size:
+            return None
+
+        # 在 [min_size, max_size) 内二分查找能放下的最大整磅字号，最小字号仍放不下时使用最小字号
+        low, high = int(self.min_size), int(max_size) - 1
+        best = low
+        while low <= high:
+            mid = (low + high) // 2
+            if self._fits(prepared, box, indent, mid):
+                best, low = mid, mid + 1
+            else:
+                high = mid - 1
+        return float(best)
+
+# 全局实例
+text_fitter = TextFitter()
@@ -1,5 +1,8 @@
+import json
 import os
 import requests
+from src.utils.image_cache import ImageCache, image_cache
+from src.utils.resilience import resilience
 from src.utils.logger import logger
 
 class UnsplashSearcher:
@@ -12,6 +15,46 @@ class UnsplashSearcher:
 
     @staticmethod
     def search_images(query: str, count: int = 1) -> list[str]:
+        """
+        搜索图片并返回缓存中的本地路径列表 (缓存不可用时返回 URL)
+        查询的原始结果列表按 (unsplash, results, query) 缓存，按需截取前 count 张；图片按 URL 缓存
+        """
+        urls = UnsplashSearcher._cached_urls(query, count)
+        if urls is None:
+            urls = UnsplashSearcher._search_urls(query, count)
+            if urls and image_cache.enabled:
+                data = json.dumps({"per_page": count, "urls": urls}).encode("utf-8")
+                image_cache.put(UnsplashSearcher._results_key(query), data, ".json")
+
+        paths = []
+        for url in urls[:count]:
+            key = ImageCache.make_key("unsplash", "regular", "", url)
+            paths.append(image_cache.get(key) or image_cache.put_url(key, url) or url)
+        return paths
+
+    @staticmethod
+    def _results_key(query: str) -> str:
+        return ImageCache.make_key("unsplash", "results", "", query)
+
+    @staticmethod
+    def _cached_urls(query: str, count: int):
+        """
+        缓存的结果列表：足够 count 张，或当时请求的数量不少于 count (结果本来就不足) 时返回，否则返回 None
+        """
+        path = image_cache.get(UnsplashSearcher._results_key(query))
+        if not path:
+            return None
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                cached = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if len(cached["urls"]) >= count or cached["per_page"] >= count:
+            return cached["urls"]
+        return None
+
+    @staticmethod
+    def _search_urls(query: str, count: int = 1) -> list[str]:
         """
         使用 Unsplash API 搜索图片
         注意：需要有效的 UNSPLASH_ACCESS_KEY 环境变量
@@ -42,7 +85,7 @@ class UnsplashSearcher:
             headers = {"Authorization": f"Bearer {secret_key}"}
             logger.debug("Using Unsplash Bearer Token authentication")
 
-        try:
+        def call():
             response = requests.get(
                 f"{UnsplashSearcher.BASE_URL}/search/photos",
                 params=params,
@@ -50,6 +93,10 @@ class UnsplashSearcher:
                 timeout=10
             )
             response.raise_for_status()
+            return response
+
+        try:
+            response = resilience.call("unsplash", call)
 
             data = response.json()
             photos = data.get("results", [])
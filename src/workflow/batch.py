@@ -0,0 +1,189 @@
+import json
+import os
+import re
+import time
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from typing import Dict, List, Optional
+from src.utils.docx_parser import DocxParser
+from src.utils.input_condenser import InputCondenser
+from src.utils.logger import logger
+
+MANIFEST_NAME = "manifest.jsonl"
+
+# 请求 id 用作输出文件名，只允许字母、数字、点、下划线与连字符 (不以点开头)，防止写出 output_dir
+_VALID_ID = re.compile(r"^[\w-][\w.-]*$")
+
+# 每个工作进程内的无中断工作流 (进程启动时构建一次)
+_worker_app = None
+
+def load_requests(input_path: str) -> List[Dict]:
+    """
+    读取 JSONL 请求文件，每行一个 JSON 对象：
+    {"id": "可选，默认行号", "input_text": "需求描述", "file": "可选，docx 或音频路径", "template": "可选，.potx/.pptx 模板路径"}
+    """
+    requests_list = []
+    with open(input_path, "r", encoding="utf-8") as f:
+        for line_no, line in enumerate(f, 1):
+            line = line.strip()
+            if not line:
+                continue
+            item = json.loads(line)
+            item["id"] = str(item.get("id") or f"{line_no:05d}")
+            if not _VALID_ID.match(item["id"]):
+                raise ValueError(f"Invalid request id on line {line_no}: {item['id']!r} (use letters, digits, '.', '_' or '-')")
+            item["input_text"] = item.get("input_text") or item.get("prompt") or ""
+            requests_list.append(item)
+    return requests_list
+
+def load_manifest(output_dir: str) -> Dict[str, Dict]:
+    """读取已有的结果清单，返回 id -> 最后一条记录"""
+    records = {}
+    path = os.path.join(output_dir, MANIFEST_NAME)
+    if not os.path.exists(path):
+        return records
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                # 中断时可能残留半行，忽略
+                continue
+            records[record["id"]] = record
+    return records
+
+def _init_worker():
+    """工作进程初始化：预先构建工作流并创建模型实例"""
+    global _worker_app
+    from src.workflow.graph import create_workflow
+    from src.utils.llm_factory import LLMFactory
+
+    _worker_app = create_workflow(interactive=False)
+    for node_name in ("planner", "generator", "image_advisor"):
+        LLMFactory.get_model(node_name)
+
+def _build_input_text(request: Dict) -> str:
+    """合并文本需求与附带文件的内容 (与 Web UI 的 process_input 一致)"""
+    text = request["input_text"]
+    file_path = request.get("file")
+    if file_path:
+        if file_path.endswith(".docx"):
+            text = f"{text}\n\n参考文档内容：\n{InputCondenser.condense(DocxParser.parse(file_path))}"
+        elif file_path.endswith((".mp3", ".wav", ".m4a", ".flac")):
+            from src.utils.whisper_asr import WhisperASR
+            text = f"{text}\n\n语音转录内容：\n{InputCondenser.condense(WhisperASR.transcribe(file_path))}"
+    return text
+
+def run_request(request: Dict, output_dir: str) -> Dict:
+    """在工作进程中完整运行一次工作流 (无 HITL 中断)，返回结果记录"""
+    if _worker_app is None:
+        _init_worker()
+
+    start = time.monotonic()
+    output_path = os.path.join(output_dir, f"{request['id']}.pptx")
+    stages = {}
+    state = {}
+    record = {"id": request["id"], "status": "failed", "file": None, "error": None}
+
+    try:
+        stage_start = time.monotonic()
+        input_text = _build_input_text(request)
+        stages["input"] = time.monotonic() - stage_start
+
+        initial_state = {
+            "input_text": input_text,
+            "input_files": [request["file"]] if request.get("file") else [],
+            "outline": None,
+            "slides": [],
+            "current_step": "start",
+            "is_approved": True,
+            "error": None,
+            "output_path": output_path,
+            "template_path": request.get("template")
+        }
+
+        # 按节点产出的增量更新计时，得到每个阶段的耗时
+        stage_start = time.monotonic()
+        for update in _worker_app.stream(initial_state, stream_mode="updates"):
+            for node_name, node_state in update.items():
+                now = time.monotonic()
+                stages[node_name] = now - stage_start
+                stage_start = now
+                if node_state:
+                    state.update(node_state)
+
+        generated_file = state.get("generated_file")
+        if generated_file and os.path.exists(generated_file) and not state.get("error"):
+            record.update(status="ok", file=generated_file)
+        else:
+            record["error"] = state.get("error") or "No file generated"
+    except Exception as e:
+        logger.exception(f"Batch: Request {request['id']} failed")
+        record["error"] = str(e)
+
+    record["seconds"] = round(time.monotonic() - start, 2)
+    record["stages"] = {name: round(seconds, 2) for name, seconds in stages.items()}
+    return record
+
+def run_batch(input_path: str, output_dir: str, workers: Optional[int] = None, resume: bool = True) -> Dict:
+    """
+    批量生成 PPT：请求分发到进程池并发执行，每个请求输出 <id>.pptx，
+    结果逐条追加到 manifest.jsonl。resume=True 时跳过清单中已成功且文件存在的请求。
+    :return: 汇总统计
+    """
+    workers = workers or int(os.getenv("BATCH_WORKERS", "4"))
+    os.makedirs(output_dir, exist_ok=True)
+
+    requests_list = load_requests(input_path)
+    done = load_manifest(output_dir) if resume else {}
+    pending = [
+        r for r in requests_list
+        if not (done.get(r["id"], {}).get("status") == "ok" and os.path.exists(done[r["id"]].get("file") or ""))
+    ]
+    skipped = len(requests_list) - len(pending)
+    logger.info(f"Batch: {len(requests_list)} requests, {skipped} already done, running {len(pending)} with {workers} workers")
+
+    start = time.monotonic()
+    stage_totals = defaultdict(float)
+    succeeded = failed = 0
+
+    manifest_path = os.path.join(output_dir, MANIFEST_NAME)
+    with open(manifest_path, "a", encoding="utf-8") as manifest, \
+            ProcessPoolExecutor(max_workers=workers, initializer=_init_worker) as executor:
+        futures = {executor.submit(run_request, r, output_dir): r["id"] for r in pending}
+        for future in as_completed(futures):
+            try:
+                record = future.result()
+            except Exception as e:
+                # 工作进程异常退出
+                record = {"id": futures[future], "status": "failed", "file": None, "error": str(e), "seconds": 0, "stages": {}}
+
+            manifest.write(json.dumps(record, ensure_ascii=False) + "\n")
+            manifest.flush()
+
+            if record["status"] == "ok":
+                succeeded += 1
+                for name, seconds in record["stages"].items():
+                    stage_totals[name] += seconds
+            else:
+                failed += 1
+            elapsed = time.monotonic() - start
+            logger.info(f"Batch: [{succeeded + failed}/{len(pending)}] {record['id']} {record['status']} in {record['seconds']}s ({succeeded / elapsed * 60:.2f} decks/min)")
+
+    elapsed = time.monotonic() - start
+    summary = {
+        "total": len(requests_list),
+        "skipped": skipped,
+        "succeeded": succeeded,
+        "failed": failed,
+        "elapsed_seconds": round(elapsed, 2),
+        "decks_per_minute": round(succeeded / elapsed * 60, 2) if elapsed > 0 else 0.0,
+        "avg_stage_seconds": {name: round(total / succeeded, 2) for name, total in stage_totals.items()} if succeeded else {}
+    }
+    logger.info(f"Batch: Finished {succeeded} decks ({failed} failed) in {elapsed:.1f}s, {summary['decks_per_minute']} decks/min")
+    for name, seconds in summary["avg_stage_seconds"].items():
+        logger.info(f"Batch:   {name}: {seconds}s avg")
+    return summary
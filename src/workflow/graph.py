@@ -1,24 +1,28 @@
+from langchain_core.runnables import RunnableLambda
 from langgraph.graph import StateGraph, END
-from langgraph.checkpoint.memory import MemorySaver
 from src.models.state import PPTState
-from src.nodes.planner import content_planner_node
-from src.nodes.generator import content_generator_node
-from src.nodes.image_advisor import image_advisor_node
-from src.nodes.visual_agent import visual_agent_node
-from src.utils.ppt_generator import ppt_generator_node
+from src.nodes.planner import content_planner_node, acontent_planner_node
+from src.nodes.generator import content_generator_node, acontent_generator_node
+from src.nodes.image_advisor import image_advisor_node, aimage_advisor_node
+from src.nodes.visual_agent import visual_agent_node, avisual_agent_node
+from src.utils.ppt_generator import ppt_generator_node, appt_generator_node
+from src.utils.checkpointer import create_checkpointer
 
-def create_workflow():
-    """创建并编译具有智能 Agent 工具能力的 LangGraph 工作流"""
+def create_workflow(interactive: bool = True):
+    """
+    创建并编译具有智能 Agent 工具能力的 LangGraph 工作流
+    :param interactive: True 时在 planner 与 image_advisor 之后中断等待人工确认 (HITL)；
+                        False 时一次跑完全流程且不保存检查点 (用于批量生成)
+    """
     
-    checkpointer = MemorySaver()
     workflow = StateGraph(PPTState)
     
-    # 添加节点
-    workflow.add_node("planner", content_planner_node)
-    workflow.add_node("generator", content_generator_node)
-    workflow.add_node("image_advisor", image_advisor_node)
-    workflow.add_node("visual_agent", visual_agent_node)
-    workflow.add_node("renderer", ppt_generator_node)
+    # 添加节点 (同时提供同步与异步实现：invoke/stream 走同步版本，ainvoke/astream 走异步版本)
+    workflow.add_node("planner", RunnableLambda(content_planner_node, afunc=acontent_planner_node))
+    workflow.add_node("generator", RunnableLambda(content_generator_node, afunc=acontent_generator_node))
+    workflow.add_node("image_advisor", RunnableLambda(image_advisor_node, afunc=aimage_advisor_node))
+    workflow.add_node("visual_agent", RunnableLambda(visual_agent_node, afunc=avisual_agent_node))
+    workflow.add_node("renderer", RunnableLambda(ppt_generator_node, afunc=appt_generator_node))
     
     # 设置入口
     workflow.set_entry_point("planner")
@@ -30,9 +34,11 @@ def create_workflow():
     workflow.add_edge("visual_agent", "renderer")
     workflow.add_edge("renderer", END)
     
-    # 编译
+    # 编译 (交互模式的检查点默认持久化到 SQLite，服务重启后会话仍可继续)
+    if not interactive:
+        return workflow.compile()
     app = workflow.compile(
-        checkpointer=checkpointer,
+        checkpointer=create_checkpointer(),
         interrupt_after=["planner", "image_advisor"]
     )
     return app
@@ -0,0 +1,99 @@
+#!/usr/bin/env python3
+"""
+DashScope 图片生成异步接口的本地 stub 服务
+用于离线压测 AsyncImageEngine，不消耗真实 API 额度
+
+运行方式：
+    python stub_image_server.py [port] [delay_seconds]
+
+然后设置：
+    IMAGE_GEN_API_BASE=http://127.0.0.1:8765/api/v1
+"""
+
+import base64
+import json
+import sys
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+TASKS = {}
+LOCK = threading.Lock()
+DELAY = 3.0
+
+# 1x1 像素 PNG，作为生成结果的下载内容
+STUB_PNG = base64.b64decode(
+    "iVBORw0KGgoAAAANSUhEUgAAAAEAAAABCAYAAAAfFcSJAAAADUlEQVR42mNk+M9QDwADhgGAWjR9awAAAABJRU5ErkJggg=="
+)
+
+class StubHandler(BaseHTTPRequestHandler):
+    def _send_json(self, data, status=200):
+        body = json.dumps(data).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length", 0))
+        self.rfile.read(length)
+        if self.path.endswith("/cancel"):
+            task_id = self.path.rstrip("/").split("/")[-2]
+            with LOCK:
+                TASKS.pop(task_id, None)
+            return self._send_json({"request_id": task_id})
+        if not self.path.endswith("/services/aigc/text2image/image-synthesis"):
+            return self._send_json({"code": "NotFound"}, 404)
+
+        task_id = str(uuid.uuid4())
+        with LOCK:
+            TASKS[task_id] = time.monotonic()
+        self._send_json({"output": {"task_id": task_id, "task_status": "PENDING"}})
+
+    def do_GET(self):
+        if self.path.startswith("/images/"):
+            self.send_response(200)
+            self.send_header("Content-Type", "image/png")
+            self.send_header("Content-Length", str(len(STUB_PNG)))
+            self.end_headers()
+            self.wfile.write(STUB_PNG)
+            return
+
+        task_id = self.path.rstrip("/").split("/")[-1]
+        with LOCK:
+            submitted_at = TASKS.get(task_id)
+        if submitted_at is None:
+            return self._send_json({"output": {"task_id": task_id, "task_status": "UNKNOWN"}})
+
+        if time.monotonic() - submitted_at < DELAY:
+            return self._send_json({"output": {"task_id": task_id, "task_status": "RUNNING"}})
+
+        host = self.headers.get("Host", "127.0.0.1")
+        self._send_json({
+            "output": {
+                "task_id": task_id,
+                "task_status": "SUCCEEDED",
+                "results": [{"url": f"http://{host}/images/{task_id}.png"}]
+            }
+        })
+
+    def log_message(self, format, *args):
+        pass
+
+def main():
+    global DELAY
+    port = int(sys.argv[1]) if len(sys.argv) > 1 else 8765
+    if len(sys.argv) > 2:
+        DELAY = float(sys.argv[2])
+
+    server = ThreadingHTTPServer(("127.0.0.1", port), StubHandler)
+    print(f"🧪 Stub 图片服务已启动: http://127.0.0.1:{port}/api/v1 (每个任务耗时 {DELAY}s)")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        server.shutdown()
+
+if __name__ == "__main__":
+    main()